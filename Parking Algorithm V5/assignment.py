@@ -0,0 +1,341 @@
+import numpy as np
+
+from availability_index import AvailabilityIndex, requirement_types
+from car_park_table import CarParkTable
+
+TIME_TO_MOVE = 5  # 5 minutes to move between elements, same as calculate_time
+SPACE_TYPES = ['handicapped_space', 'family_space', 'ev_charging_space']
+PRICE_TOLERANCE = 1e-6  # Reduced costs above -PRICE_TOLERANCE count as no improvement
+CELL_WEIGHT = 12  # A CostGrid over n car parks has about sqrt(CELL_WEIGHT * n) cells
+
+
+# Function to calculate times between positions (same measure as calculate_time); arrays of positions broadcast
+def travel_times(positions1, positions2):
+    return np.abs(positions1[..., 0] - positions2[..., 0]) + np.abs(positions1[..., 1] - positions2[..., 1]) * TIME_TO_MOVE
+
+
+# Function to calculate times between every pair of positions at once (same measure as calculate_time)
+def calculate_times(positions1, positions2):
+    positions1 = np.asarray(positions1, dtype=np.float64)[:, None, :]
+    positions2 = np.asarray(positions2, dtype=np.float64)[None, :, :]
+    return travel_times(positions1, positions2)
+
+
+# Function to number the entries of a sorted row vector within their row (0 for the first of every row)
+def rank_in_rows(rows):
+    return np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+
+# Class to search the cheapest car parks for many trips at once without costing every trip against every car park.
+# With y scaled by TIME_TO_MOVE, a trip costs the same at every car park inside the box spanned by its origin and
+# destination (the box's width plus height), and twice the L1 distance to the box more outside it. The car parks are
+# sorted into a grid of cells, and the distance from a trip's box to the bounding box of a cell's car parks bounds
+# the cost of all of them from below, so only cells that can hold a cheap enough car park are opened.
+class CostGrid:
+    def __init__(self, positions):
+        scaled = positions * [1, TIME_TO_MOVE]
+        # More cells mean more bounds to work out per trip but fewer car parks to cost in the cells it opens
+        cells_per_side = max(1, int(round((CELL_WEIGHT * len(positions)) ** 0.25)))
+        low = scaled.min(axis=0)
+        extent = scaled.max(axis=0) - low
+        cell_size = np.where(extent > 0, extent / cells_per_side, 1.0)
+        cell_xy = np.minimum(((scaled - low) / cell_size).astype(np.int64), cells_per_side - 1)
+        self.order = np.argsort(cell_xy[:, 0] * cells_per_side + cell_xy[:, 1], kind='stable')  # Cell by cell
+        _, self.starts, self.counts = np.unique((cell_xy[:, 0] * cells_per_side + cell_xy[:, 1])[self.order],
+                                                return_index=True, return_counts=True)
+        self.scaled = scaled
+        self.low = np.minimum.reduceat(scaled[self.order], self.starts)
+        self.high = np.maximum.reduceat(scaled[self.order], self.starts)
+
+    # Function to give the scaled boxes of trips, as (low corners, high corners)
+    @staticmethod
+    def trip_boxes(origins, destinations):
+        origins, destinations = origins * [1, TIME_TO_MOVE], destinations * [1, TIME_TO_MOVE]
+        return np.minimum(origins, destinations), np.maximum(origins, destinations)
+
+    # Function to bound the cost of every cell's car parks from below for every trip (trips x cells)
+    # With upper, it instead bounds them from above, except that cells inside the box, where every car park costs the
+    # same, are ranked below that by how far inside they lie: trips whose boxes overlap then favour cells near their
+    # own middle rather than all the same ones
+    def bounds(self, box_low, box_high, upper=False):
+        bounds = np.zeros((len(box_low), len(self.starts)))
+        for axis in range(2):
+            if upper:
+                # Distance from the box to the cell's far side, on whichever side that is; negative inside the box
+                gap = np.subtract.outer(-box_high[:, axis], -self.high[:, axis])
+                np.maximum(gap, np.subtract.outer(box_low[:, axis], self.low[:, axis]), out=gap)
+            else:
+                # A cell lies on one side of a box, in it or beside it, so at most one of the two gaps is positive
+                gap = np.subtract.outer(box_low[:, axis], self.high[:, axis])
+                np.maximum(gap, np.subtract.outer(-box_high[:, axis], -self.low[:, axis]), out=gap)
+                np.maximum(gap, 0, out=gap)
+            bounds += gap
+        bounds *= 2
+        bounds += (box_high - box_low).sum(axis=1)[:, None]
+        return bounds
+
+    # Function to cost trips at car parks (indices into the positions the grid was built from)
+    # With depths, also returns how far inside the box every car park lies (negative outside), to break ties with
+    def costs(self, box_low, box_high, rows, car_parks, depths=False):
+        scaled = self.scaled[car_parks]
+        signed_gap = np.maximum(scaled - box_high[rows], box_low[rows] - scaled)
+        costs = (box_high[rows] - box_low[rows]).sum(axis=1) + 2 * np.maximum(signed_gap, 0).sum(axis=1)
+        return (costs, -signed_gap.sum(axis=1)) if depths else costs
+
+    # Function to expand (trip, cell) pairs into (trip, car park) pairs
+    def car_parks_in(self, rows, cells):
+        counts = self.counts[cells]
+        firsts = np.cumsum(counts) - counts
+        offsets = np.arange(firsts[-1] + counts[-1] if len(counts) else 0) + np.repeat(self.starts[cells] - firsts, counts)
+        return np.repeat(rows, counts), self.order[offsets]
+
+    # Function to open, for every trip, the few cells with the lowest of the given bounds (trips x cells), enough to
+    # hold about 2k car parks
+    # Returns (trip, car park) pairs and the opened cells of every trip
+    def open_cells(self, bounds, k):
+        num_trips, num_cells = bounds.shape
+        opened = min(num_cells, int(np.ceil(2 * k * num_cells / len(self.scaled))) + 1)
+        cells = np.argpartition(bounds, opened - 1, axis=1)[:, :opened] if opened < num_cells else \
+            np.tile(np.arange(num_cells), (num_trips, 1))
+        return self.car_parks_in(np.repeat(np.arange(num_trips), opened), cells.reshape(-1)) + (cells,)
+
+    # Function to find the k cheapest car parks of every trip: first among the few cells whose car parks cost the
+    # least at most, then, for trips with a cell left out that could still hold something cheaper, among every such cell
+    # Returns (trip, car park) pairs
+    def nearest(self, box_low, box_high, k):
+        rows, car_parks, cells = self.open_cells(self.bounds(box_low, box_high, upper=True), k)
+        rows, car_parks, costs = self.cheapest(rows, car_parks, *self.costs(box_low, box_high, rows, car_parks, True), k)
+        worst = np.full(len(box_low), np.inf)  # The k-th cost found, for trips that found k car parks
+        last = rank_in_rows(rows) == k - 1
+        worst[rows[last]] = costs[last]
+
+        # No car park costs less than the box itself, so only trips that found a dearer k-th car park need checking
+        unsure = np.flatnonzero(worst > (box_high - box_low).sum(axis=1))
+        if len(unsure):
+            lower = self.bounds(box_low[unsure], box_high[unsure])
+            unopened = lower.copy()
+            unopened[np.arange(len(unsure))[:, None], cells[unsure]] = np.inf
+            still = unopened.min(axis=1) < worst[unsure]
+            unsure, lower = unsure[still], lower[still]
+        if len(unsure):
+            # Every car park cheaper than the k-th found so far lies in a cell bounded below it
+            keep = ~np.isin(rows, unsure)
+            unsure_rows, unsure_cells = np.nonzero(lower <= worst[unsure, None])
+            more_rows, more_car_parks = self.car_parks_in(unsure[unsure_rows], unsure_cells)
+            more_rows, more_car_parks, _ = self.cheapest(more_rows, more_car_parks,
+                                                         *self.costs(box_low, box_high, more_rows, more_car_parks, True), k)
+            rows = np.concatenate([rows[keep], more_rows])
+            car_parks = np.concatenate([car_parks[keep], more_car_parks])
+        return rows, car_parks
+
+    # Function to find, for every trip, car parks whose reduced cost (cost - trip price - car park price) is
+    # negative: the k lowest, or as many of the lowest as it takes for their free spaces to add up to min_capacity.
+    # They are first looked for among the few cells whose car parks have the lowest reduced costs at most, and trips
+    # that find that many there keep them (any such car park improves the assignment, the lowest just need fewer
+    # rounds); the others search every cell that could hold one
+    # Returns (trip, car park) pairs
+    def improving(self, box_low, box_high, trip_prices, car_park_prices, capacities, k, min_capacity):
+        lowest_prices = np.minimum.reduceat(car_park_prices[self.order], self.starts)
+        highest_prices = np.maximum.reduceat(car_park_prices[self.order], self.starts)
+
+        def find(trips, rows, car_parks):
+            reduced_cost = self.costs(box_low, box_high, trips[rows], car_parks) - trip_prices[trips[rows]] - \
+                car_park_prices[car_parks]
+            found = reduced_cost < -PRICE_TOLERANCE
+            rows, car_parks, _, enough = self.cheapest(rows[found], car_parks[found], reduced_cost[found], None, k,
+                                                       capacities, min_capacity, len(trips))
+            return trips[rows], car_parks, trips[~enough]
+
+        trips = np.arange(len(box_low))
+        rows, car_parks, _ = self.open_cells(self.bounds(box_low, box_high, upper=True) - lowest_prices, k)
+        rows, car_parks, short = find(trips, rows, car_parks)
+        if len(short):
+            lower = self.bounds(box_low[short], box_high[short]) - trip_prices[short, None] - highest_prices
+            keep = ~np.isin(rows, short)
+            short_rows, short_car_parks = self.car_parks_in(*np.nonzero(lower < -PRICE_TOLERANCE))
+            more_rows, more_car_parks, _ = find(short, short_rows, short_car_parks)
+            rows = np.concatenate([rows[keep], more_rows])
+            car_parks = np.concatenate([car_parks[keep], more_car_parks])
+        return rows, car_parks
+
+    # Function to keep, of (trip, car park, value) triples, the k lowest values of every trip, or as many of its lowest
+    # as it takes for their free spaces (capacities, per car park) to add up to min_capacity; sorted by trip and value,
+    # equal values by depth (deepest first) when given
+    # Returns the kept triples, and with capacities also whether each of num_trips trips kept both that many
+    @staticmethod
+    def cheapest(rows, car_parks, values, depths, k, capacities=None, min_capacity=0, num_trips=0):
+        # Trip numbers are small, and sort faster as small integers
+        trips = rows.astype(np.min_scalar_type(rows.max() if len(rows) else 0))
+        order = np.lexsort((-depths, values, trips) if depths is not None else (values, trips))
+        rows, car_parks, values = rows[order], car_parks[order], values[order]
+        if capacities is None:
+            kept = rank_in_rows(rows) < k
+            return rows[kept], car_parks[kept], values[kept]
+        capacity_after = np.cumsum(capacities[car_parks])
+        capacity_before = capacity_after - capacities[car_parks]
+        capacity_before -= np.concatenate([[0], capacity_after])[np.searchsorted(rows, rows)]
+        kept = (rank_in_rows(rows) < k) | (capacity_before < min_capacity)
+        rows, car_parks, values = rows[kept], car_parks[kept], values[kept]
+        enough = (np.bincount(rows, minlength=num_trips) >= k) & \
+            (np.bincount(rows, weights=capacities[car_parks], minlength=num_trips) >= min_capacity)
+        return rows, car_parks, values, enough
+
+
+# Function to list the free spaces of every car park from its occupancy bitmap
+def free_spaces(car_parks):
+    return [list(cp['parking_matrix'].free_spaces()) for cp in car_parks]
+
+
+# Function to build the availability index of the car parks: a bitmap per space type and one of car parks with a
+# free space (capacities > 0)
+def build_availability_index(car_parks, capacities):
+    type_masks = {}
+    for space_type in SPACE_TYPES:
+        if isinstance(car_parks, CarParkTable):
+            type_masks[space_type] = car_parks.column(space_type).astype(bool) if space_type in car_parks.columns else np.zeros(len(car_parks), dtype=bool)
+        else:
+            type_masks[space_type] = np.array([bool(cp.get(space_type, 0)) for cp in car_parks], dtype=bool).reshape(-1)
+    return AvailabilityIndex(type_masks, capacities > 0)
+
+
+# Function to find the k cheapest eligible car parks for every driver
+# Drivers are grouped by requirement and each group is only searched among the car parks matching it, found by
+# intersecting the availability bitmaps (a requirement can be one space type or a list of them, all required), through
+# a CostGrid of those car parks
+# Given the prices of a solved assignment (one per driver, one per car park) it instead finds, for every driver, the
+# eligible car parks whose cost is below the driver's price plus the car park's, i.e. those that would improve it:
+# up to k of them, or as many as it takes for their free spaces to add up to min_capacity
+# Returns the driver index, car park index and cost of every candidate pair
+def candidate_car_parks(drivers, car_parks, capacities, k=8, chunk_size=1024, driver_prices=None, car_park_prices=None,
+                        min_capacity=0):
+    if isinstance(car_parks, CarParkTable):
+        positions = car_parks.column('position').astype(np.float64)
+    else:
+        positions = np.array([cp['position'] for cp in car_parks], dtype=np.float64).reshape(-1, 2)
+    origins = np.array([driver['origin'] for driver in drivers], dtype=np.float64).reshape(-1, 2)
+    destinations = np.array([driver['destination'] for driver in drivers], dtype=np.float64).reshape(-1, 2)
+    box_low, box_high = CostGrid.trip_boxes(origins, destinations)
+    availability = build_availability_index(car_parks, capacities)
+
+    groups = {}
+    for index, driver in enumerate(drivers):
+        groups.setdefault(requirement_types(driver.get('requirement')), []).append(index)
+
+    rows, cols = [], []
+    for requirement, group in groups.items():
+        columns = availability.candidates(requirement)
+        if not len(columns):
+            continue
+        grid = CostGrid(positions[columns])
+        group = np.array(group)
+        group_k = min(k, len(columns))
+        for start in range(0, len(group), chunk_size):
+            members = group[start:start + chunk_size]
+            if driver_prices is None:
+                member_rows, picked = grid.nearest(box_low[members], box_high[members], group_k)
+            else:
+                member_rows, picked = grid.improving(box_low[members], box_high[members], driver_prices[members],
+                                                     car_park_prices[columns], capacities[columns], group_k,
+                                                     min_capacity)
+            rows.append(members[member_rows])
+            cols.append(columns[picked])
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    # Pairs come back in driver order, as if every driver had been costed in turn
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    order = np.argsort(rows, kind='stable')
+    rows, cols = rows[order], cols[order]
+    return rows, cols, travel_times(origins[rows], positions[cols]) + travel_times(destinations[rows], positions[cols])
+
+
+# Function to assign a batch of waiting drivers to free spaces at once
+# Each driver is a dictionary with 'origin', 'destination' and an optional 'requirement' (one of SPACE_TYPES, or a
+# list of them that must all be present)
+# Drivers making the same trip are interchangeable, so they are solved for together as one trip with a number of
+# drivers. The problem is first pruned to the k nearest eligible car parks per trip and solved as a min-cost flow
+# (a transportation problem with per-car-park capacities, whose LP relaxation has integral optimal vertices)
+# The k nearest are not always enough: when many drivers head for the same spot those car parks fill up while others
+# still have spaces. So the prices (duals) of every solution are checked against all eligible car parks, those that
+# would lower the cost or place another driver are added, and the problem is solved again until none are left; the
+# result is then optimal over every car park, not just the k nearest. Car park prices are never positive, so a trip
+# priced no higher than its k-th nearest car park costs cannot gain from any other car park and is not checked
+# Returns (car park index, space index) per driver, or None for drivers that could not be placed
+def assign_drivers(drivers, car_parks, k=8, chunk_size=1024):
+    spaces = free_spaces(car_parks)
+    capacities = np.array([len(free) for free in spaces])
+    trips = {}
+    for index, driver in enumerate(drivers):
+        key = (tuple(driver['origin']), tuple(driver['destination']), requirement_types(driver.get('requirement')))
+        trips.setdefault(key, []).append(index)
+    trip_drivers = list(trips.values())
+    first_drivers = [drivers[members[0]] for members in trip_drivers]
+    demands = np.array([len(members) for members in trip_drivers])
+
+    assignments = [None] * len(drivers)
+    rows, cols, costs = candidate_car_parks(first_drivers, car_parks, capacities, k, chunk_size)
+    if len(rows) == 0:
+        return assignments
+    # Trips with fewer than k candidates already have every eligible car park
+    nearest_bound = np.full(len(trip_drivers), -np.inf)
+    np.maximum.at(nearest_bound, rows, costs)
+    nearest_bound[np.bincount(rows, minlength=len(trip_drivers)) < k] = np.inf
+
+    while True:
+        flows, trip_prices, car_park_prices = solve_assignment(rows, cols, costs, capacities, demands)
+        priced = np.flatnonzero(trip_prices > nearest_bound + PRICE_TOLERANCE)
+        if not len(priced):
+            break
+        new_rows, new_cols, new_costs = candidate_car_parks([first_drivers[trip] for trip in priced], car_parks,
+                                                            capacities, k, chunk_size, trip_prices[priced],
+                                                            car_park_prices, demands.sum() - flows.sum())
+        new_rows = priced[new_rows]
+        new = ~np.isin(new_rows * len(car_parks) + new_cols, rows * len(car_parks) + cols)
+        if not new.any():
+            break
+        rows = np.concatenate([rows, new_rows[new]])
+        cols = np.concatenate([cols, new_cols[new]])
+        costs = np.concatenate([costs, new_costs[new]])
+
+    next_driver = np.zeros(len(trip_drivers), dtype=np.int64)
+    next_space = np.zeros(len(car_parks), dtype=np.int64)
+    for pair in np.flatnonzero(flows):
+        trip, car_park_index, flow = rows[pair], cols[pair], flows[pair]
+        for driver in trip_drivers[trip][next_driver[trip]:next_driver[trip] + flow]:
+            assignments[driver] = (int(car_park_index), int(spaces[car_park_index][next_space[car_park_index]]))
+            next_space[car_park_index] += 1
+        next_driver[trip] += flow
+    return assignments
+
+
+# Function to solve the transportation problem over the candidate pairs as a linear program
+# Returns the drivers sent along every candidate pair, the price of every trip and the price of every car park (0
+# where unused)
+def solve_assignment(rows, cols, costs, capacities, demands):
+    # SciPy is only imported once an assignment is actually solved
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix
+
+    num_pairs, num_trips = len(rows), len(demands)
+    # Leaving a driver unassigned costs more than any complete assignment, so as many drivers as possible get a space
+    unassigned_cost = (costs.max() + 1) * demands.sum()
+    objective = np.concatenate([costs, np.full(num_trips, unassigned_cost)])
+
+    # Every trip sends all its drivers along candidate pairs or to the unassigned option
+    trip_rows = np.concatenate([rows, np.arange(num_trips)])
+    a_eq = coo_matrix((np.ones(num_pairs + num_trips), (trip_rows, np.arange(num_pairs + num_trips))),
+                      shape=(num_trips, num_pairs + num_trips))
+
+    # Every car park used as a candidate takes at most its number of free spaces
+    used_car_parks, car_park_rows = np.unique(cols, return_inverse=True)
+    a_ub = coo_matrix((np.ones(num_pairs), (car_park_rows, np.arange(num_pairs))),
+                      shape=(len(used_car_parks), num_pairs + num_trips))
+
+    result = linprog(objective, A_ub=a_ub.tocsr(), b_ub=capacities[used_car_parks], A_eq=a_eq.tocsr(),
+                     b_eq=demands, bounds=(0, None), method='highs-ds')
+    if result.status != 0:
+        raise ValueError(f"Assignment problem could not be solved: {result.message}")
+
+    car_park_prices = np.zeros(len(capacities))
+    car_park_prices[used_car_parks] = result.ineqlin.marginals
+    return np.rint(result.x[:num_pairs]).astype(np.int64), result.eqlin.marginals, car_park_prices
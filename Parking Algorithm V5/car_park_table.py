@@ -0,0 +1,147 @@
+import numpy as np
+
+from occupancy import OccupancyBitmap
+
+
+class TextColumn:
+    # Strings stored as one UTF-8 buffer plus offsets instead of one Python object each
+    def __init__(self, values):
+        encoded = [str(value).encode('utf-8') for value in values]
+        self.data = b''.join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+class OccupancyView(OccupancyBitmap):
+    # The occupancy bitmap of one table row, read and written in place in the table's shared buffer
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+        self.size = int(table.space_counts[index])
+        self.free_value = table.free_value
+        self.bits = memoryview(table.occupancy)[table.byte_offsets[index]:table.byte_offsets[index + 1]]
+
+    @property
+    def free_count(self):
+        return int(self.table.free_counts[self.index])
+
+    @free_count.setter
+    def free_count(self, value):
+        self.table.free_counts[self.index] = value
+
+
+class TableRow:
+    # Lightweight view of one car park whose columns read like the keys of a car park dictionary (car_park['name'])
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.table.value(self.index, key)
+
+    def __contains__(self, key):
+        return key in self.table.columns or key == self.table.occupancy_column
+
+    def __eq__(self, other):
+        return isinstance(other, TableRow) and self.table is other.table and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.index})"
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(self.table.columns) + [self.table.occupancy_column]
+
+
+class CarParkTable:
+    def __init__(self, columns, spaces, free_value=1, occupancy_column='parking_spaces'):
+        # columns maps a name to one value per car park: strings become a TextColumn, (x, y) pairs an n x 2 array
+        # and everything else a NumPy array (pass one with an explicit dtype to pick the type).
+        # spaces holds each car park's spaces in the source encoding (free_value marks a free space) or an
+        # OccupancyBitmap. All of them are packed into one buffer, each car park starting on a byte boundary.
+        self.free_value = free_value
+        self.occupancy_column = occupancy_column
+        self.columns = {}
+        for name, values in columns.items():
+            if not isinstance(values, np.ndarray):
+                values = list(values)
+                if values and all(isinstance(value, str) for value in values):
+                    values = TextColumn(values)
+                else:
+                    values = np.asarray(values)
+            self.columns[name] = values
+
+        self.pack_spaces(spaces)
+        for name, values in self.columns.items():
+            if len(values) != len(self.space_counts):
+                raise ValueError(f"Column {name!r} has {len(values)} values for {len(self.space_counts)} car parks")
+
+    def pack_spaces(self, spaces):
+        packed = []
+        space_counts = []
+        free_counts = []
+        for car_park_spaces in spaces:
+            if isinstance(car_park_spaces, OccupancyBitmap):
+                packed.append(bytes(car_park_spaces.bits))
+                space_counts.append(car_park_spaces.size)
+                free_counts.append(car_park_spaces.free_count)
+            else:
+                free = np.asarray(car_park_spaces).reshape(-1) == self.free_value
+                packed.append(np.packbits(free, bitorder='little').tobytes())
+                space_counts.append(len(free))
+                free_counts.append(int(free.sum()))
+        self.occupancy = bytearray(b''.join(packed))
+        self.space_counts = np.array(space_counts, dtype=np.int32)
+        self.free_counts = np.array(free_counts, dtype=np.int32)
+        self.byte_offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+        np.cumsum((self.space_counts + 7) // 8, out=self.byte_offsets[1:])
+
+    @classmethod
+    def from_records(cls, records, fields, free_value=1, occupancy_column='parking_spaces'):
+        # Builds a table from car park dictionaries or objects, keeping the given fields
+        records = list(records)
+
+        def field(record, name):
+            return record[name] if isinstance(record, dict) else getattr(record, name)
+
+        columns = {name: [field(record, name) for record in records] for name in fields}
+        spaces = [field(record, occupancy_column) for record in records]
+        return cls(columns, spaces, free_value, occupancy_column)
+
+    def __len__(self):
+        return len(self.space_counts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TableRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TableRow(self, index)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def value(self, index, name):
+        if name == self.occupancy_column:
+            return OccupancyView(self, index)
+        value = self.columns[name][index]
+        if isinstance(value, np.ndarray):
+            return tuple(value.tolist())
+        return value.item() if isinstance(value, np.generic) else value
@@ -1,7 +1,15 @@
+import argparse
+import datetime
 import random
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from tabulate import tabulate
+from scoring import SkylineRanker, build_criteria_matrix, calculate_scores, rank_car_parks
+from running_statistics import RunningStatistics
+from assignment import SPACE_TYPES, assign_drivers
+from occupancy import OccupancyBitmap
+from traffic import TrafficRaster
+from car_park_table import CarParkTable
+from metrics import Metrics
+from occupancy_history import OccupancyHistory
 
 # Function to calculate time between two positions
 def calculate_time(position1, position2):
@@ -15,7 +23,8 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
         'traffic_density': 0.0,
         'handicapped_space': 0.0,
         'family_space': 0.0,
-        'ev_charging_space': 0.0
+        'ev_charging_space': 0.0,
+        'forecast_free_spaces': 0.2
     }
 
     car_park_positions = {
@@ -38,7 +47,7 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
             'time_to_carpark': calculate_time(user_position, car_park_positions['Alpha']),
             'time_from_carpark': calculate_time(car_park_positions['Alpha'], destination_position),
             'traffic_density': 0.0,
-            'parking_matrix': np.array([1, 0, 0, 0]),  # One full parking space
+            'parking_matrix': OccupancyBitmap.from_matrix([1, 0, 0, 0]),  # One full parking space
             'handicapped_space': 0,
             'family_space': 1,
             'ev_charging_space': 1,
@@ -49,7 +58,7 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
             'time_to_carpark': calculate_time(user_position, car_park_positions['Bravo']),
             'time_from_carpark': calculate_time(car_park_positions['Bravo'], destination_position),
             'traffic_density': 0.0,
-            'parking_matrix': np.array([1, 0, 0, 1]),  # One full parking space
+            'parking_matrix': OccupancyBitmap.from_matrix([1, 0, 0, 1]),  # One full parking space
             'handicapped_space': 1,
             'family_space': 0,
             'ev_charging_space': 1,
@@ -60,7 +69,7 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
             'time_to_carpark': calculate_time(user_position, car_park_positions['Charlie']),
             'time_from_carpark': calculate_time(car_park_positions['Charlie'], destination_position),
             'traffic_density': 0.0,
-            'parking_matrix': np.array([1, 1, 1, 1]),  # One full parking space
+            'parking_matrix': OccupancyBitmap.from_matrix([1, 1, 1, 1]),  # One full parking space
             'handicapped_space': 1,
             'family_space': 1,
             'ev_charging_space': 0,
@@ -71,7 +80,7 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
             'time_to_carpark': calculate_time(user_position, car_park_positions['Delta']),
             'time_from_carpark': calculate_time(car_park_positions['Delta'], destination_position),
             'traffic_density': 0.0,
-            'parking_matrix': np.array([0, 0, 0, 1]),  # One full parking space
+            'parking_matrix': OccupancyBitmap.from_matrix([0, 0, 0, 1]),  # One full parking space
             'handicapped_space': 0,
             'family_space': 0,
             'ev_charging_space': 1,
@@ -82,7 +91,7 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
             'time_to_carpark': calculate_time(user_position, car_park_positions['Echo']),
             'time_from_carpark': calculate_time(car_park_positions['Echo'], destination_position),
             'traffic_density': 0.0,
-            'parking_matrix': np.array([1, 1, 0, 1]),  # One full parking space
+            'parking_matrix': OccupancyBitmap.from_matrix([1, 1, 0, 1]),  # One full parking space
             'handicapped_space': 1,
             'family_space': 1,
             'ev_charging_space': 1,
@@ -95,12 +104,48 @@ def generate_sample_car_parks(user_position=None, destination_position=None):
 # Function to generate a sample parking matrix (binary: 0 - available, 1 - occupied)
 def generate_parking_matrix(num_parking_spaces, occupancy_prob=0.5):
     parking_matrix = np.random.choice([0, 1], size=(num_parking_spaces,), p=[1 - occupancy_prob, occupancy_prob])
-    return parking_matrix
+    return OccupancyBitmap.from_matrix(parking_matrix)
+
+# Function to generate a sample congestion raster (traffic density per grid cell for each hour of the day)
+def generate_traffic_raster(width, height, buckets=24):
+    return TrafficRaster(np.random.uniform(0.1, 1, size=(buckets, width, height)))
+
+# Function to generate a sample occupancy history for the car parks: the last days of samples, with the share of
+# free spaces following a daily cycle and ending at each car park's current free spaces
+def generate_occupancy_history(car_parks, days=2, sample_minutes=15):
+    spaces = np.array([len(car_park['parking_matrix']) for car_park in car_parks])
+    history = OccupancyHistory(spaces, sample_minutes=sample_minutes)
+    now = OccupancyHistory.minute(datetime.datetime.now()) // sample_minutes * sample_minutes
+    for minute in range(now - days * 24 * 60, now, sample_minutes):
+        busy = 0.5 + 0.4 * np.sin(2 * np.pi * (minute % (24 * 60) - 6 * 60) / (24 * 60))  # Busiest at noon
+        history.record(np.rint(spaces * np.clip(1 - busy + np.random.normal(0, 0.1, len(spaces)), 0, 1)), minute)
+    history.record([car_park['parking_matrix'].free_count for car_park in car_parks], now)
+    return history
+
+# Function to render the Location Matrix (user, destination and the first letter of every car park) as a grid
+def render_location_matrix(user_position, destination_position, car_park_positions, grid_size=11):
+    from tabulate import tabulate  # Only needed when a grid is rendered
+
+    location_matrix = np.zeros((grid_size, grid_size), dtype=str)
+    location_matrix[user_position] = 'U'  # User
+    location_matrix[destination_position] = 'X'  # Destination
+    for car_park in car_park_positions:
+        location_matrix[car_park_positions[car_park]] = car_park[0]  # First letter of car park name
 
-# Function to solve the assignment problem
-def solve_assignment_problem(cost_matrix):
-    _, occupancy_matrix = linear_sum_assignment(cost_matrix)
-    return occupancy_matrix
+    headers = [''] + [f'Col {i+1}' for i in range(grid_size)]
+    return tabulate(location_matrix, headers, showindex=[f'Row {i+1}' for i in range(grid_size)], tablefmt='grid')
+
+# Function to generate a batch of waiting drivers with origins, destinations and space requirements
+def generate_waiting_drivers(num_drivers, available_positions):
+    available_positions = list(available_positions)
+    drivers = []
+    for _ in range(num_drivers):
+        drivers.append({
+            'origin': random.choice(available_positions),
+            'destination': random.choice(available_positions),
+            'requirement': random.choice([None, None] + SPACE_TYPES)
+        })
+    return drivers
 
 # Function to recommend parking based on user and destination positions
 def recommend_parking(user_position, car_park_positions, ranked_car_parks, full_car_parks):
@@ -119,132 +164,179 @@ def recommend_parking(user_position, car_park_positions, ranked_car_parks, full_
     return recommended_car_park_info, recommended_index, non_full_indices
 
 
-# Function to calculate normalized value using Z-Score Normalization
-def z_score_normalization(value, mean, std_dev):
-    if std_dev == 0 or np.isnan(mean) or np.isnan(std_dev):
-        return 0  # Return 0 for invalid cases
-    try:
-        result = (value - mean) / std_dev
-        if not np.isfinite(result):
-            print(f"Invalid result in z_score_normalization: {result}")
-            print(f"value: {value}, mean: {mean}, std_dev: {std_dev}")
-            return 0  # Return 0 if the result is NaN or inf
-        return result
-    except Exception as e:
-        print(f"Error in z_score_normalization: {e}")
-        return 0  # Return 0 in case of any exception
-
-# Function to calculate overall score for a car park
-def calculate_score(car_park, weights, means, std_devs):
-    # Assuming the car_park dictionary contains values for each criterion
-    # Modify this based on your actual data structure
-
-    # Calculate normalized values for each criterion using Z-Score Normalization
-    normalised_time_to_carpark = z_score_normalization(car_park['time_to_carpark'], means['time_to_carpark'], std_devs['time_to_carpark'])
-    normalised_time_from_carpark = z_score_normalization(car_park['time_from_carpark'], means['time_from_carpark'], std_devs['time_from_carpark'])
-
-    # Sum of time_to_carpark and time_from_carpark as time_to_destination
-    normalised_time_to_destination = normalised_time_to_carpark + normalised_time_from_carpark
-
-    normalised_traffic_density = z_score_normalization(car_park['traffic_density'], means['traffic_density'], std_devs['traffic_density'])
-
-    # Additional spaces
-    normalised_handicapped_space = z_score_normalization(car_park['handicapped_space'], means['handicapped_space'], std_devs['handicapped_space'])
-    normalised_family_space = z_score_normalization(car_park['family_space'], means['family_space'], std_devs['family_space'])
-    normalised_ev_charging_space = z_score_normalization(car_park['ev_charging_space'], means['ev_charging_space'], std_devs['ev_charging_space'])
-
-    # Calculate overall score using the provided weights
-    score = (weights['time_to_destination'] * normalised_time_to_destination) + \
-            (weights['traffic_density'] * normalised_traffic_density) + \
-            (weights['handicapped_space'] * normalised_handicapped_space) + \
-            (weights['family_space'] * normalised_family_space) + \
-            (weights['ev_charging_space'] * normalised_ev_charging_space)
-
-    return score
-
 # Main function
-def main():
-    # Generate a sample set of car parks
-    result = generate_sample_car_parks(user_position=None, destination_position=None)
-    sample_car_parks, car_park_positions, user_weights = result[0], result[1], result[2]
-
-    # Randomize user and destination positions excluding car park locations
-    available_positions = set([(x, y) for x in range(11) for y in range(11)]) - set(car_park_positions.values())
-    user_position = random.choice(list(available_positions))
-    destination_position = random.choice(list(available_positions - {user_position}))
-
-    print(f"User Position: {user_position}")
-    print(f"Destination Position: {destination_position}")
-
-    # Check and print full car parks
-    full_car_parks = [car_park['name'] for car_park in sample_car_parks if 'parking_matrix' in car_park and np.all(car_park['parking_matrix'] == 1)]
-    if full_car_parks:
-        print(f"\nFull Car Parks: {', '.join(full_car_parks)}")
-    else:
-        print("\nNo Full Car Parks")
-
-    # Exclude full car parks
-    non_full_car_parks = [cp for cp in sample_car_parks if 'parking_matrix' in cp and not np.all(cp['parking_matrix'] == 1)]
-
-    # Print the generated parking matrix and special spaces
-    print("\nGenerated Parking Matrix:")
-    for car_park in sample_car_parks:
-        print(f"{car_park['name']} - Parking Matrix: {car_park.get('parking_matrix', 'N/A')}")
-        print(f"  Handicapped Space: {car_park['handicapped_space']}")
-        print(f"  Family Space: {car_park['family_space']}")
-        print(f"  EV Charging Space: {car_park['ev_charging_space']}")
-        print(f"  Position: {car_park['position']}")
-
-    # Print the Location Matrix in a grid using tabulate
-    print("\nLocation Matrix:")
-    location_matrix = np.zeros((11, 11), dtype=str)
-    location_matrix[user_position] = 'U'  # User
-    location_matrix[destination_position] = 'X'  # Destination
-    for car_park in car_park_positions:
-        location_matrix[car_park_positions[car_park]] = car_park[0]  # First letter of car park name
-
-    headers = [''] + [f'Col {i+1}' for i in range(11)]
-    table = tabulate(location_matrix, headers, showindex=[f'Row {i+1}' for i in range(11)], tablefmt='grid')
-    print(table)
-
-    # Extract mean and standard deviation for each criterion
-    criteria = ['time_to_carpark', 'time_from_carpark', 'traffic_density', 'handicapped_space', 'family_space', 'ev_charging_space']
-    means = {criterion: np.mean([cp[criterion] for cp in sample_car_parks if 'parking_matrix' in cp]) for criterion in criteria}
-    std_devs = {criterion: np.std([cp[criterion] for cp in sample_car_parks if 'parking_matrix' in cp]) for criterion in criteria}
-
-    # Create a cost matrix (negation of the parking matrix to convert the minimization problem to maximization)
-    cost_matrix = -np.array([[calculate_score(cp, user_weights, means, std_devs) for cp in non_full_car_parks] for _ in range(len(non_full_car_parks))])
-
-    # Solve the assignment problem to determine the optimal occupancy matrix
-    occupancy_matrix = solve_assignment_problem(cost_matrix)
-
-    # Rank car parks based on scores
-    car_park_scores = []
-    for car_park in non_full_car_parks:
-        score = calculate_score(car_park, user_weights, means, std_devs)
-        car_park_scores.append((car_park, score))
-
-    # Rank car parks based on scores
-    ranked_car_parks = sorted(car_park_scores, key=lambda x: x[1], reverse=True)
-
-    # Display ranked car parks
-    print("\nRanked Car Parks:")
-    for rank, (name, score) in enumerate(ranked_car_parks, start=1):
-        print(f"{rank}. {name['name']} - Score: {score:.2f}")
-
-    # Integrate the recommendation algorithm
-    car_park_positions = [car_park['position'] for car_park in sample_car_parks]
-    full_car_parks = [car_park['name'] for car_park in sample_car_parks if
-                          'parking_matrix' in car_park and np.all(car_park['parking_matrix'] == 1)]
-    # Call recommend_parking with full_car_parks and user_position
-    recommended_car_park_info, recommended_index, non_full_indices = recommend_parking(user_position, car_park_positions, ranked_car_parks, full_car_parks)
-    if recommended_car_park_info is not None:
-        recommended_car_park_name = recommended_car_park_info[0]['name']
-        recommended_car_park_position = recommended_car_park_info[0]['position']
-        print("\nRecommended Car Park Position:")
-        print(f"{recommended_car_park_name} - Position: {recommended_car_park_position}")
-    else:
-        print("\nNo recommended car parks.")
+# Every step is timed as a stage of metrics (a new Metrics when not given), printed at the end
+# The parking matrix table and the location grid are only rendered when render is set
+def main(metrics=None, render=False):
+    metrics = metrics if metrics is not None else Metrics()
+    with metrics.request('main'):
+        # Generate a sample set of car parks
+        with metrics.stage('load'):
+            result = generate_sample_car_parks(user_position=None, destination_position=None)
+            sample_car_parks, car_park_positions, user_weights = result[0], result[1], result[2]
+
+            # Randomize user and destination positions excluding car park locations
+            available_positions = set([(x, y) for x in range(11) for y in range(11)]) - set(car_park_positions.values())
+            user_position = random.choice(list(available_positions))
+            destination_position = random.choice(list(available_positions - {user_position}))
+        metrics.count('car_parks_loaded', len(sample_car_parks))
+
+        print(f"User Position: {user_position}")
+        print(f"Destination Position: {destination_position}")
+
+        # Traffic density of each car park is the mean congestion on the drive to it from the user at the current hour
+        with metrics.stage('traffic'):
+            traffic = generate_traffic_raster(11, 11)
+            densities = traffic.path_densities(user_position, [car_park['position'] for car_park in sample_car_parks], traffic.bucket())
+            for car_park, density in zip(sample_car_parks, densities):
+                car_park['traffic_density'] = float(density)
+
+        # Forecast the free spaces of every car park at the time the user would get there, from its occupancy history
+        with metrics.stage('forecast'):
+            history = generate_occupancy_history(sample_car_parks)
+            forecasts = history.forecast(np.arange(len(sample_car_parks)), [car_park['time_to_carpark'] for car_park in sample_car_parks])
+            for car_park, forecast in zip(sample_car_parks, forecasts):
+                car_park['forecast_free_spaces'] = float(forecast)
+
+        # Keep the car parks as typed columns; the rows below read like the dictionaries did
+        with metrics.stage('table'):
+            sample_car_parks = CarParkTable.from_records(sample_car_parks, ['name', 'time_to_carpark', 'time_from_carpark', 'traffic_density', 'handicapped_space', 'family_space', 'ev_charging_space', 'forecast_free_spaces', 'position'],
+                                                         free_value=0, occupancy_column='parking_matrix')
+
+        # Check and print full car parks
+        with metrics.stage('filter'):
+            full_car_parks = [car_park['name'] for car_park in sample_car_parks if 'parking_matrix' in car_park and car_park['parking_matrix'].free_count == 0]
+
+            # Exclude full car parks
+            non_full_car_parks = [cp for cp in sample_car_parks if 'parking_matrix' in cp and cp['parking_matrix'].free_count > 0]
+        metrics.count_all({'car_parks_scanned': len(sample_car_parks), 'car_parks_filtered': len(full_car_parks)})
+
+        with metrics.stage('print'):
+            if full_car_parks:
+                print(f"\nFull Car Parks: {', '.join(full_car_parks)}")
+            else:
+                print("\nNo Full Car Parks")
+
+        if render:
+            # Print the generated parking matrix and special spaces
+            with metrics.stage('render'):
+                lines = ["\nGenerated Parking Matrix:"]
+                for car_park in sample_car_parks:
+                    lines += [f"{car_park['name']} - Parking Matrix: {car_park.get('parking_matrix', 'N/A')}",
+                              f"  Handicapped Space: {car_park['handicapped_space']}",
+                              f"  Family Space: {car_park['family_space']}",
+                              f"  EV Charging Space: {car_park['ev_charging_space']}",
+                              f"  Position: {car_park['position']}",
+                              f"  Traffic Density: {car_park['traffic_density']:.2f}",
+                              f"  Forecast Free Spaces: {car_park['forecast_free_spaces']:.1f}"]
+
+                # Print the Location Matrix in a grid using tabulate
+                lines += ["\nLocation Matrix:", render_location_matrix(user_position, destination_position, car_park_positions)]
+                print("\n".join(lines))
+
+        # Build the criteria matrix (car parks x criteria) and keep running mean and standard deviation for each criterion
+        # over the candidate set (the non-full car parks), updated as car parks leave it
+        with metrics.stage('normalize'):
+            criteria = ['time_to_carpark', 'time_from_carpark', 'traffic_density', 'handicapped_space', 'family_space', 'ev_charging_space', 'forecast_free_spaces']
+            criteria_matrix = build_criteria_matrix(sample_car_parks, criteria)
+            non_full_mask = np.array([cp['parking_matrix'].free_count > 0 for cp in sample_car_parks], dtype=bool)
+            statistics = RunningStatistics(criteria)
+            statistics.add_many(criteria_matrix[non_full_mask])
+
+        # Score every non-full car park in one vectorised pass
+        with metrics.stage('score'):
+            scores = calculate_scores(criteria_matrix[non_full_mask], user_weights, criteria, statistics.means, statistics.std_devs)
+        metrics.count('car_parks_scored', len(scores))
+
+        # Rank car parks based on scores
+        with metrics.stage('sort'):
+            ranked_car_parks = [(non_full_car_parks[index], scores[index]) for index in rank_car_parks(scores)]
+
+        # Display ranked car parks
+        with metrics.stage('print'):
+            print("\nRanked Car Parks:")
+            for rank, (name, score) in enumerate(ranked_car_parks, start=1):
+                print(f"{rank}. {name['name']} - Score: {score:.2f}")
+
+        # Re-rank for a few preference slider positions from the skyline of the non-full car parks, found once
+        # (higher scores rank first, so a slider that avoids traffic puts a negative weight on it)
+        with metrics.stage('skyline'):
+            ranker = SkylineRanker(criteria_matrix[non_full_mask], criteria, statistics.means, statistics.std_devs, k=3)
+        metrics.count('skyline_size', len(ranker.band))
+        with metrics.stage('rerank'):
+            slider_settings = {
+                'Less traffic': dict(user_weights, traffic_density=-0.5),
+                'Family space': dict(user_weights, family_space=1.0),
+                'EV charging': dict(user_weights, ev_charging_space=1.0)
+            }
+            slider_rankings, _ = ranker.top_k_batch(slider_settings.values())
+        with metrics.stage('print'):
+            print("\nRe-ranked For Preference Sliders:")
+            for setting, indices in zip(slider_settings, slider_rankings):
+                print(f"{setting}: {', '.join(non_full_car_parks[index]['name'] for index in indices)}")
+
+        # Integrate the recommendation algorithm
+        with metrics.stage('recommend'):
+            car_park_positions = [car_park['position'] for car_park in sample_car_parks]
+            full_car_parks = [car_park['name'] for car_park in sample_car_parks if
+                                  'parking_matrix' in car_park and car_park['parking_matrix'].free_count == 0]
+            # Call recommend_parking with full_car_parks and user_position
+            recommended_car_park_info, recommended_index, non_full_indices = recommend_parking(user_position, car_park_positions, ranked_car_parks, full_car_parks)
+        with metrics.stage('print'):
+            if recommended_car_park_info is not None:
+                recommended_car_park_name = recommended_car_park_info[0]['name']
+                recommended_car_park_position = recommended_car_park_info[0]['position']
+                print("\nRecommended Car Park Position:")
+                print(f"{recommended_car_park_name} - Position: {recommended_car_park_position}")
+            else:
+                print("\nNo recommended car parks.")
+
+        # Assign a batch of waiting drivers to the free spaces at once
+        with metrics.stage('assign'):
+            waiting_drivers = generate_waiting_drivers(4, available_positions)
+            assignments = assign_drivers(waiting_drivers, sample_car_parks)
+        metrics.count('drivers_assigned', sum(assignment is not None for assignment in assignments))
+        with metrics.stage('print'):
+            print("\nBatch Allocation:")
+            for driver, assignment in zip(waiting_drivers, assignments):
+                requirement = driver['requirement'] or 'no special space'
+                if assignment is None:
+                    print(f"Driver at {driver['origin']} ({requirement}) - No space available")
+                else:
+                    car_park_index, space_index = assignment
+                    print(f"Driver at {driver['origin']} ({requirement}) - {sample_car_parks[car_park_index]['name']} space {space_index}")
+
+        # Car parks the allocation filled leave the candidate set: only their criteria come out of the running statistics.
+        # Those it only took spaces from expect that many fewer free spaces, so only their old values are swapped for the
+        # new ones. The car parks left are then ranked again for the next arrivals
+        with metrics.stage('update'):
+            spaces_taken = np.bincount([assignment[0] for assignment in assignments if assignment is not None], minlength=len(sample_car_parks))
+            filled = [index for index in np.flatnonzero(non_full_mask) if spaces_taken[index] >= sample_car_parks[index]['parking_matrix'].free_count]
+            for index in filled:
+                statistics.remove(criteria_matrix[index])
+            non_full_mask[filled] = False
+            forecast_column = criteria.index('forecast_free_spaces')
+            changed = np.flatnonzero(non_full_mask & (spaces_taken > 0))
+            for index in changed:
+                new_values = criteria_matrix[index].copy()
+                new_values[forecast_column] = max(new_values[forecast_column] - spaces_taken[index], 0.0)
+                statistics.update(criteria_matrix[index], new_values)
+                criteria_matrix[index] = new_values
+            remaining_car_parks = [sample_car_parks[index] for index in np.flatnonzero(non_full_mask)]
+            scores = calculate_scores(criteria_matrix[non_full_mask], user_weights, criteria, statistics.means, statistics.std_devs)
+            ranked_car_parks = [(remaining_car_parks[index], scores[index]) for index in rank_car_parks(scores)]
+        metrics.count('car_parks_filled', len(filled))
+        metrics.count('car_parks_updated', len(changed))
+        with metrics.stage('print'):
+            print("\nRanked Car Parks After Allocation:")
+            for rank, (car_park, score) in enumerate(ranked_car_parks, start=1):
+                print(f"{rank}. {car_park['name']} - Score: {score:.2f}")
+
+    print("\nStage Timings:")
+    print(metrics.to_text())
+    return metrics
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rank the sample car parks and assign a batch of waiting drivers")
+    parser.add_argument('--render', action='store_true', help="Also print the parking matrices and the location grid")
+    main(render=parser.parse_args().render)
\ No newline at end of file
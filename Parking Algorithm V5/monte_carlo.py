@@ -0,0 +1,142 @@
+import argparse
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from assignment import SPACE_TYPES, calculate_times
+from car_park_table import CarParkTable
+
+# Requirement drawn for each simulated driver, the same odds as generate_waiting_drivers (None twice as likely)
+REQUIREMENT_PROBABILITIES = [0.4, 0.2, 0.2, 0.2]  # None, then SPACE_TYPES in order
+# Car park data shared with the workers: one row per car park with x, y, number of spaces and a 0/1 flag per space type
+COLUMNS = 3 + len(SPACE_TYPES)
+
+shared_car_parks = None  # Set in each worker process by attach_car_parks
+
+
+# Function to lay out the car parks (dictionaries or a CarParkTable) as the shared car park matrix
+def car_park_matrix(car_parks):
+    if isinstance(car_parks, CarParkTable):
+        positions = car_parks.column('position')
+        num_spaces = car_parks.space_counts
+        flags = [car_parks.column(space_type) for space_type in SPACE_TYPES]
+    else:
+        positions = [cp['position'] for cp in car_parks]
+        num_spaces = [len(cp['parking_matrix']) for cp in car_parks]
+        flags = [[cp.get(space_type, 0) for cp in car_parks] for space_type in SPACE_TYPES]
+    matrix = np.empty((len(car_parks), COLUMNS), dtype=np.float64)
+    matrix[:, 0:2] = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    matrix[:, 2] = num_spaces
+    for column, values in enumerate(flags, start=3):
+        matrix[:, column] = np.asarray(values, dtype=bool)
+    return matrix
+
+
+# Function run once in every worker to map the shared car park matrix (read only, no copy)
+def attach_car_parks(name, num_car_parks):
+    global shared_car_parks
+    memory = shared_memory.SharedMemory(name=name)
+    shared_car_parks = (memory, np.ndarray((num_car_parks, COLUMNS), dtype=np.float64, buffer=memory.buf))
+    shared_car_parks[1].flags.writeable = False
+
+
+# Function to simulate one block of independent drivers, each arriving at a freshly drawn city
+# Every space is occupied with occupancy_prob (as in generate_parking_matrix), so a car park is full with
+# probability occupancy_prob ** spaces; each driver takes the eligible, non-full car park with the lowest
+# time to it plus time from it to the destination, or misses when there is none
+def simulate_block(task):
+    block, num_scenarios, seed_sequence, grid_size, occupancy_prob, max_cells = task
+    car_parks = shared_car_parks[1]
+    rng = np.random.default_rng(seed_sequence)
+    positions = car_parks[:, 0:2]
+    full_probability = occupancy_prob ** car_parks[:, 2]
+    eligible_by_requirement = np.vstack([np.ones(len(car_parks), dtype=bool), car_parks[:, 3:].T > 0])
+
+    chosen = np.zeros(len(car_parks), dtype=np.int64)
+    total_time = 0
+    misses = 0
+    chunk_size = max(1, max_cells // max(len(car_parks), 1))
+    for start in range(0, num_scenarios, chunk_size):
+        size = min(chunk_size, num_scenarios - start)
+        origins = rng.integers(0, grid_size, size=(size, 2))
+        destinations = rng.integers(0, grid_size, size=(size, 2))
+        requirements = rng.choice(len(REQUIREMENT_PROBABILITIES), size=size, p=REQUIREMENT_PROBABILITIES)
+        available = rng.random((size, len(car_parks))) >= full_probability
+
+        times = calculate_times(origins, positions) + calculate_times(destinations, positions)
+        times[~(available & eligible_by_requirement[requirements])] = np.inf
+        best = np.argmin(times, axis=1) if len(car_parks) else np.zeros(size, dtype=np.int64)
+        best_times = times[np.arange(size), best] if len(car_parks) else np.full(size, np.inf)
+        placed = np.isfinite(best_times)
+
+        chosen += np.bincount(best[placed], minlength=len(car_parks))
+        total_time += int(best_times[placed].sum())  # Times are whole minutes, so block totals add up exactly
+        misses += int(size - placed.sum())
+    return block, chosen, total_time, misses
+
+
+# Function to run num_scenarios independent drivers across worker processes and merge their aggregates
+# Scenarios are split into fixed blocks, each with its own seed derived from seed, so the result only depends
+# on seed and block_size: the same for any number of workers
+def simulate_city(car_parks, num_scenarios, workers=None, seed=0, grid_size=11, occupancy_prob=0.5,
+                  block_size=100000, max_cells=1 << 22):
+    workers = workers or os.cpu_count() or 1
+    matrix = car_park_matrix(car_parks)
+    num_blocks = (num_scenarios + block_size - 1) // block_size
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_blocks)
+    tasks = [(block, min(block_size, num_scenarios - block * block_size), seed_sequences[block], grid_size,
+              occupancy_prob, max_cells) for block in range(num_blocks)]
+
+    memory = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        np.ndarray(matrix.shape, dtype=np.float64, buffer=memory.buf)[:] = matrix
+        if workers == 1:
+            attach_car_parks(memory.name, len(matrix))
+            results = [simulate_block(task) for task in tasks]
+        else:
+            context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+            with context.Pool(workers, attach_car_parks, (memory.name, len(matrix))) as pool:
+                results = sorted(pool.imap_unordered(simulate_block, tasks), key=lambda result: result[0])
+    finally:
+        global shared_car_parks
+        if shared_car_parks is not None:
+            shared_car_parks[0].close()
+            shared_car_parks = None
+        memory.close()
+        memory.unlink()
+
+    chosen = np.zeros(len(matrix), dtype=np.int64)
+    total_time = misses = 0
+    for _, block_chosen, block_total_time, block_misses in results:
+        chosen += block_chosen
+        total_time += block_total_time
+        misses += block_misses
+    placed = num_scenarios - misses
+    return {
+        'scenarios': num_scenarios,
+        'chosen': chosen,
+        'choice_distribution': chosen / placed if placed else np.zeros(len(matrix)),
+        'mean_total_time': total_time / placed if placed else float('nan'),
+        'miss_rate': misses / num_scenarios if num_scenarios else 0.0
+    }
+
+
+if __name__ == "__main__":
+    from main import generate_sample_car_parks
+
+    parser = argparse.ArgumentParser(description="Monte Carlo simulation of independent drivers on the sample city")
+    parser.add_argument('--scenarios', type=int, default=1000000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--occupancy-prob', type=float, default=0.5)
+    args = parser.parse_args()
+
+    sample_car_parks = generate_sample_car_parks()[0]
+    result = simulate_city(sample_car_parks, args.scenarios, args.workers, args.seed, occupancy_prob=args.occupancy_prob)
+    print(f"Scenarios: {result['scenarios']}")
+    print(f"Mean Total Time: {result['mean_total_time']:.2f}")
+    print(f"Miss Rate: {result['miss_rate']:.4f}")
+    for car_park, share in zip(sample_car_parks, result['choice_distribution']):
+        print(f"{car_park['name']}: {share:.4f}")
@@ -0,0 +1,141 @@
+import datetime
+import os
+import threading
+
+import numpy as np
+
+PROFILE_SCALE = np.iinfo(np.uint16).max  # Saved profiles keep free fractions as multiples of 1 / PROFILE_SCALE
+
+
+# Class to keep a bounded occupancy history for every car park and forecast its free spaces at a driver's arrival.
+# The free spaces of all car parks are sampled together every sample_minutes into one ring buffer per car park
+# (a row of a uint16 array, capacity samples long), and every sample also moves the mean free fraction kept for its
+# time-of-week slot. The rings hold the recent past and the profile the usual week, so memory stays at
+# capacity * 2 + slots * 4 bytes per car park however many years of samples go through it.
+class OccupancyHistory:
+    def __init__(self, spaces, capacity=96, sample_minutes=15, period_minutes=7 * 24 * 60, profile_alpha=0.1):
+        self.spaces = np.asarray(spaces, dtype=np.int64)
+        self.capacity = capacity
+        self.sample_minutes = sample_minutes
+        self.slots = max(1, period_minutes // sample_minutes)
+        self.profile_alpha = profile_alpha  # Weight of a new sample in its slot's mean once the slot has 1 / alpha
+        self.samples = np.zeros((len(self.spaces), capacity), dtype=np.uint16)  # Free spaces, one ring per car park
+        self.times = np.zeros(capacity, dtype=np.int64)  # Minutes since the epoch of every ring position
+        self.head = 0  # Ring position of the next sample
+        self.count = 0  # Samples in the rings
+        self.profile = np.zeros((len(self.spaces), self.slots), dtype=np.float32)  # Mean free fraction per slot
+        self.profile_counts = np.zeros(self.slots, dtype=np.uint32)  # Samples seen per slot
+
+    def __len__(self):
+        return len(self.spaces)
+
+    # Bytes held by the rings and the profile
+    @property
+    def nbytes(self):
+        return self.samples.nbytes + self.times.nbytes + self.profile.nbytes + self.profile_counts.nbytes
+
+    # Function to turn a datetime (now when None) or minutes since the epoch into minutes since the epoch
+    @staticmethod
+    def minute(when=None):
+        if isinstance(when, datetime.datetime):
+            return int(when.timestamp() // 60)
+        if when is None:
+            return int(datetime.datetime.now().timestamp() // 60)
+        return int(when)
+
+    # Function to find the time-of-week slot of minutes since the epoch (a number or an array)
+    def slot(self, minutes):
+        return minutes // self.sample_minutes % self.slots
+
+    # Function to record the free spaces of every car park at one time
+    def record(self, free_counts, when=None):
+        minute = self.minute(when)
+        free_counts = np.clip(np.asarray(free_counts, dtype=np.int64), 0, np.iinfo(np.uint16).max)
+        self.samples[:, self.head] = free_counts
+        self.times[self.head] = minute
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        # A plain mean while the slot has fewer than 1 / alpha samples, a moving average after that
+        slot = self.slot(minute)
+        self.profile_counts[slot] += 1
+        alpha = max(self.profile_alpha, 1.0 / self.profile_counts[slot])
+        self.profile[:, slot] += alpha * (free_counts / np.maximum(self.spaces, 1) - self.profile[:, slot])
+
+    # Function to return the times and the free spaces of the given car parks for the last samples, oldest first
+    def recent(self, car_parks, samples):
+        samples = min(samples, self.count)
+        positions = (self.head - samples + np.arange(samples)) % self.capacity
+        return self.times[positions], self.samples[np.ix_(np.asarray(car_parks, dtype=np.int64), positions)]
+
+    # Function to forecast the free spaces of the given car parks (indices) at arrival_minutes after now (the last
+    # sample when None), for every candidate in one pass. arrival_minutes broadcasts against the car parks, so a
+    # (drivers x car parks) matrix of ETAs gives a (drivers x car parks) forecast.
+    # Each forecast is the usual free fraction of the arrival slot plus how far the car park is from its usual
+    # over the last recent_samples, with that difference halving every half_life_minutes; a slot never seen yet
+    # keeps the latest sample instead.
+    def forecast(self, car_parks, arrival_minutes, now=None, recent_samples=4, half_life_minutes=60.0):
+        if not self.count:
+            raise ValueError("No occupancy samples recorded")
+        car_parks = np.asarray(car_parks, dtype=np.int64)
+        spaces = np.maximum(self.spaces[car_parks], 1)
+        times, recent = self.recent(car_parks, recent_samples)
+        anomaly = (recent / spaces[:, None] - self.profile[car_parks[:, None], self.slot(times)]).mean(axis=1)
+        latest = recent[:, -1] / spaces
+
+        elapsed = 0 if now is None else self.minute(now) - times[-1]
+        ahead = np.maximum(np.asarray(arrival_minutes, dtype=np.float64) + elapsed, 0.0)
+        arrival_slots = self.slot(times[-1] + ahead.astype(np.int64))
+        usual = self.profile[car_parks, arrival_slots]
+        fraction = np.where(self.profile_counts[arrival_slots] > 0, usual + anomaly * 0.5 ** (ahead / half_life_minutes), latest)
+        return np.clip(fraction, 0.0, 1.0) * self.spaces[car_parks]
+
+    # Function to write the history to a compressed .npz file. Rings are stored oldest first as each car park's
+    # first sample and the differences between consecutive ones, which stay small and compress well; the profile
+    # is stored as uint16 fractions. The file is written beside path and renamed over it, so readers never see
+    # half of one.
+    def save(self, path):
+        positions = (self.head - self.count + np.arange(self.count)) % self.capacity
+        samples = self.samples[:, positions].astype(np.int32)
+        deltas = np.diff(samples, axis=1)
+        fits_int16 = not deltas.size or np.abs(deltas).max() <= np.iinfo(np.int16).max
+        times = self.times[positions]
+        arrays = {
+            'settings': np.array([self.capacity, self.sample_minutes, self.slots * self.sample_minutes], dtype=np.int64),
+            'profile_alpha': np.array(self.profile_alpha),
+            'spaces': self.spaces.astype(np.int32),
+            'first_samples': samples[:, :1].astype(np.uint16),
+            'sample_deltas': deltas.astype(np.int16 if fits_int16 else np.int32),
+            'first_time': times[:1],
+            'time_deltas': np.diff(times).astype(np.int32),
+            'profile': np.rint(self.profile * PROFILE_SCALE).astype(np.uint16),
+            'profile_counts': self.profile_counts
+        }
+
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary_path, 'wb') as file:
+                np.savez_compressed(file, **arrays)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    # Function to read a history written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            capacity, sample_minutes, period_minutes = arrays['settings'].tolist()
+            history = cls(arrays['spaces'], capacity, sample_minutes, period_minutes, float(arrays['profile_alpha']))
+            samples = np.cumsum(np.concatenate([arrays['first_samples'].astype(np.int64), arrays['sample_deltas']], axis=1), axis=1)
+            times = np.cumsum(np.concatenate([arrays['first_time'], arrays['time_deltas']]))
+            history.count = len(times)
+            history.head = history.count % capacity
+            history.samples[:, :history.count] = samples
+            history.times[:history.count] = times
+            history.profile[:] = arrays['profile'] / PROFILE_SCALE
+            history.profile_counts[:] = arrays['profile_counts']
+        return history
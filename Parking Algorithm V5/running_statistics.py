@@ -0,0 +1,74 @@
+import numpy as np
+
+
+# Class to keep the mean and standard deviation of every criterion up to date (Welford's algorithm)
+# as car parks join or leave the candidate set or change their values, so a ranking reads them in O(1).
+# NaN values are left out of their criterion, the same as in criteria_statistics.
+class RunningStatistics:
+    def __init__(self, criteria):
+        self.criteria = list(criteria)
+        self.counts = np.zeros(len(self.criteria), dtype=np.int64)
+        self.mean_values = np.zeros(len(self.criteria))
+        self.squared_deviations = np.zeros(len(self.criteria))  # Sum of squared deviations from the mean (M2)
+
+    # Function to turn a car park dictionary or a row of the criteria matrix into a vector of criteria values
+    def values(self, car_park):
+        if isinstance(car_park, dict):
+            return np.array([car_park[criterion] for criterion in self.criteria], dtype=np.float64)
+        return np.asarray(car_park, dtype=np.float64)
+
+    # Function to add one car park
+    def add(self, car_park):
+        values = self.values(car_park)
+        valid = ~np.isnan(values)
+        self.counts += valid
+        delta = np.where(valid, values - self.mean_values, 0.0)
+        self.mean_values += np.where(valid, delta / np.maximum(self.counts, 1), 0.0)
+        self.squared_deviations += np.where(valid, delta * (values - self.mean_values), 0.0)
+
+    # Function to remove one car park that was added before
+    def remove(self, car_park):
+        values = self.values(car_park)
+        valid = ~np.isnan(values)
+        self.counts -= valid
+        remaining = np.maximum(self.counts, 1)
+        delta = np.where(valid, values - self.mean_values, 0.0)
+        self.mean_values -= np.where(valid, delta / remaining, 0.0)
+        self.squared_deviations -= np.where(valid, delta * (values - self.mean_values), 0.0)
+        empty = self.counts == 0
+        self.mean_values[empty] = 0.0
+        self.squared_deviations[empty] = 0.0
+        np.maximum(self.squared_deviations, 0.0, out=self.squared_deviations)
+
+    # Function to replace the values of a car park that was added before
+    def update(self, old_car_park, new_car_park):
+        self.remove(old_car_park)
+        self.add(new_car_park)
+
+    # Function to add a whole criteria matrix (car parks x criteria) at once by merging its statistics
+    def add_many(self, criteria_matrix):
+        criteria_matrix = np.asarray(criteria_matrix, dtype=np.float64)
+        valid = ~np.isnan(criteria_matrix)
+        batch_counts = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            batch_means = np.where(valid, criteria_matrix, 0.0).sum(axis=0) / batch_counts
+        batch_means = np.where(batch_counts > 0, batch_means, 0.0)
+        batch_squared_deviations = (np.where(valid, criteria_matrix - batch_means, 0.0) ** 2).sum(axis=0)
+
+        total_counts = self.counts + batch_counts
+        safe_totals = np.maximum(total_counts, 1)
+        delta = batch_means - self.mean_values
+        self.squared_deviations += batch_squared_deviations + delta ** 2 * self.counts * batch_counts / safe_totals
+        self.mean_values += delta * batch_counts / safe_totals
+        self.counts = total_counts
+
+    # Means per criterion (NaN for a criterion with no values)
+    @property
+    def means(self):
+        return np.where(self.counts > 0, self.mean_values, np.nan)
+
+    # Population standard deviations per criterion, as np.std (NaN for a criterion with no values)
+    @property
+    def std_devs(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, np.sqrt(self.squared_deviations / self.counts), np.nan)
@@ -0,0 +1,184 @@
+import numpy as np
+
+from car_park_table import CarParkTable
+
+# Criteria whose normalised values share one user weight (their sum is the time to destination)
+WEIGHT_KEYS = {
+    'time_to_carpark': 'time_to_destination',
+    'time_from_carpark': 'time_to_destination'
+}
+
+
+# Function to build the criteria matrix (car parks x criteria) from a list of car park dictionaries or a CarParkTable
+def build_criteria_matrix(car_parks, criteria):
+    criteria_matrix = np.empty((len(car_parks), len(criteria)), dtype=np.float64)
+    for column, criterion in enumerate(criteria):
+        if isinstance(car_parks, CarParkTable):
+            criteria_matrix[:, column] = car_parks.column(criterion)
+            continue
+        criteria_matrix[:, column] = np.fromiter((cp[criterion] for cp in car_parks), dtype=np.float64, count=len(car_parks))
+    return criteria_matrix
+
+
+# Function to calculate the mean and standard deviation of every criterion column, ignoring NaN entries
+def criteria_statistics(criteria_matrix):
+    valid = ~np.isnan(criteria_matrix)
+    counts = valid.sum(axis=-2)
+    values = np.where(valid, criteria_matrix, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = values.sum(axis=-2) / counts
+        deviations = np.where(valid, criteria_matrix - np.expand_dims(means, -2), 0.0)
+        std_devs = np.sqrt((deviations ** 2).sum(axis=-2) / counts)
+    return means, std_devs
+
+
+# Function to normalise every criterion column using Z-Score Normalisation
+# Columns with a zero, NaN or infinite standard deviation (and NaN entries) normalise to 0
+def z_score_normalisation(criteria_matrix, means, std_devs):
+    means = np.asarray(means, dtype=np.float64)
+    std_devs = np.asarray(std_devs, dtype=np.float64)
+    valid_columns = (std_devs > 0) & np.isfinite(std_devs) & np.isfinite(means)
+    safe_means = np.expand_dims(np.where(valid_columns, means, 0.0), -2)
+    safe_std_devs = np.expand_dims(np.where(valid_columns, std_devs, 1.0), -2)
+    normalised = (criteria_matrix - safe_means) / safe_std_devs
+    return np.where(np.expand_dims(valid_columns, -2) & np.isfinite(normalised), normalised, 0.0)
+
+
+# Function to turn a weights dictionary (or a list of them, one per user) into a weight vector per criterion column
+def weight_vector(weights, criteria):
+    if isinstance(weights, dict):
+        return np.array([weights.get(WEIGHT_KEYS.get(criterion, criterion), 0.0) for criterion in criteria])
+    return np.array([weight_vector(user_weights, criteria) for user_weights in weights])
+
+
+# Function to calculate overall scores for a whole catalog in one pass
+# criteria_matrix is (car parks x criteria) shared by every user, or (users x car parks x criteria)
+# weights is one weights dictionary, or a list with one dictionary per user
+# Returns a vector of scores per car park, or a (users x car parks) matrix for a batch of users
+def calculate_scores(criteria_matrix, weights, criteria, means=None, std_devs=None):
+    if means is None or std_devs is None:
+        means, std_devs = criteria_statistics(criteria_matrix)
+    normalised = z_score_normalisation(criteria_matrix, means, std_devs)
+    weights_matrix = weight_vector(weights, criteria)
+
+    if weights_matrix.ndim == 1:
+        return normalised @ weights_matrix
+    if normalised.ndim == 2:
+        return weights_matrix @ normalised.T
+    return np.einsum('unc,uc->un', normalised, weights_matrix)
+
+
+# Function to rank car parks by score (best first); works on a score vector or a (users x car parks) matrix
+def rank_car_parks(scores):
+    return np.argsort(-scores, axis=-1, kind='stable')
+
+
+# Function to rank only the best k car parks by score, the same as rank_car_parks(scores)[..., :k] without sorting
+# the rest; works on a score vector or a (users x car parks) matrix
+def rank_top_k(scores, k):
+    if k >= scores.shape[-1]:
+        return rank_car_parks(scores)
+    if scores.ndim == 2:
+        return np.array([rank_top_k(row, k) for row in scores], dtype=np.int64).reshape(len(scores), max(k, 0))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= threshold)  # Everything tied with the k-th score, so ties stay in catalog order
+    return candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+
+
+# Function to list the distinct weight keys of the criteria with a (criteria x keys) matrix that adds up the columns
+# sharing a key, which is all a weights dictionary can tell apart
+def weight_groups(criteria):
+    keys = list(dict.fromkeys(WEIGHT_KEYS.get(criterion, criterion) for criterion in criteria))
+    grouping = np.zeros((len(criteria), len(keys)))
+    for column, criterion in enumerate(criteria):
+        grouping[column, keys.index(WEIGHT_KEYS.get(criterion, criterion))] = 1.0
+    return keys, grouping
+
+
+# Function to find the k-skyband of a (car parks x dimensions) matrix in which larger values are better: the rows
+# dominated by fewer than k others, where a row dominates another if it is at least as large in every dimension and
+# comes first in catalog order. Under weights with no negative entry a dominating row scores at least as high and
+# wins ties in rank_car_parks, so the best k rows for any such weights are all in the band (k = 1: the skyline).
+# Rows are visited by decreasing sum, which puts every row after its dominators, and only rows of the band are
+# counted against (a dominator outside the band brings k dominators of its own). Returns the band in catalog order.
+def skyband(matrix, k=1, block_size=512, pivots=128, max_cells=1 << 22):
+    num_rows, num_dims = matrix.shape
+    order = np.lexsort((np.arange(num_rows), -matrix.sum(axis=1)))
+    band = np.empty(0, dtype=np.int64)
+
+    # Function to count how many of the rows others dominate each row of block, max_cells comparisons at a time
+    def dominators(others, block):
+        values = matrix[block]
+        counts = np.zeros(len(block), dtype=np.int64)
+        chunk_size = max(1, max_cells // max(len(block), 1))
+        for start in range(0, len(others), chunk_size):
+            chunk = others[start:start + chunk_size]
+            chunk_values = matrix[chunk]
+            dominates = chunk[:, None] < block[None, :]
+            for dimension in range(num_dims):
+                dominates &= chunk_values[:, dimension, None] >= values[None, :, dimension]
+            counts += dominates.sum(axis=0)
+        return counts
+
+    for start in range(0, num_rows, block_size):
+        block = order[start:start + block_size]
+        # The first rows of the band have the largest sums, and most rows are dominated k times over by them alone
+        block = block[dominators(band[:pivots], block) < k]
+        # Rows earlier in the same block are counted whether they join the band or not; any that does not has k
+        # band dominators that dominate these rows as well
+        band = np.concatenate([band, block[dominators(np.concatenate([band, block]), block) < k]])
+    return np.sort(band)
+
+
+# Class to re-rank one snapshot of car parks under any number of weight settings, e.g. as a user moves preference
+# sliders. The criteria are normalised and the k-skyband over the weight keys is found once; weights with no
+# negative entry then only score the band, while negative weights or more than k car parks fall back to scoring
+# the whole snapshot. Either way top_k gives the first k of rank_car_parks(calculate_scores(...)); top_k_batch gives
+# the same car parks, except that its matrix product may round scores that tie exactly into a different order.
+class SkylineRanker:
+    def __init__(self, criteria_matrix, criteria, means=None, std_devs=None, k=10):
+        if means is None or std_devs is None:
+            means, std_devs = criteria_statistics(criteria_matrix)
+        self.criteria = list(criteria)
+        self.k = k
+        self.normalised = z_score_normalisation(criteria_matrix, means, std_devs)
+        _, grouping = weight_groups(self.criteria)
+        self.band = skyband(self.normalised @ grouping, k)
+        self.band_matrix = self.normalised[self.band]
+
+    def __len__(self):
+        return len(self.normalised)
+
+    # Function to rank the best k car parks (self.k when not given) for one weights dictionary
+    # Returns their indices in the snapshot and their scores, best first
+    def top_k(self, weights, k=None):
+        k = self.k if k is None else k
+        weights_vector = weight_vector(weights, self.criteria)
+        if k <= self.k and (weights_vector >= 0).all():
+            scores = self.band_matrix @ weights_vector
+            order = rank_top_k(scores, k)
+            return self.band[order], scores[order]
+        scores = self.normalised @ weights_vector
+        order = rank_top_k(scores, k)
+        return order, scores[order]
+
+    # Function to rank the best k car parks for a list of weights dictionaries at once: the weight vectors that can
+    # use the band are scored in one matrix product against it, the rest in one against the whole snapshot
+    # Returns (weights x k) matrices of indices and scores
+    def top_k_batch(self, weights, k=None):
+        k = self.k if k is None else k
+        weights_matrix = weight_vector(list(weights), self.criteria).reshape(-1, len(self.criteria))
+        width = max(0, min(k, len(self)))
+        indices = np.empty((len(weights_matrix), width), dtype=np.int64)
+        scores = np.empty((len(weights_matrix), width))
+        banded = (weights_matrix >= 0).all(axis=1) & (k <= self.k)
+        for rows, matrix, positions in ((banded, self.band_matrix, self.band), (~banded, self.normalised, None)):
+            if not rows.any():
+                continue
+            row_scores = weights_matrix[rows] @ matrix.T
+            order = rank_top_k(row_scores, k)
+            indices[rows] = order if positions is None else positions[order]
+            scores[rows] = np.take_along_axis(row_scores, order, axis=1)
+        return indices, scores
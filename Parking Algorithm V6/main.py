@@ -1,4 +1,5 @@
 import random 
+from metrics import Metrics
 
 class CarPark:
     def __init__(self, id, name, location, parking_spaces, handicap_spaces, ev_charging_spaces):
@@ -33,8 +34,9 @@ class CarPark:
 
 
 class ParkingAlgorithm:
-    def __init__(self, car_parks):
+    def __init__(self, car_parks, metrics=None):
         self.car_parks = car_parks
+        self.metrics = metrics if metrics is not None else Metrics()  # Stage timings and counters
         self.matrix_size = 10
         self.time_intervals = {
             'low': 5,
@@ -62,37 +64,45 @@ class ParkingAlgorithm:
         return matrix
 
     def find_optimal_car_park(self, user_location, destination_location, requires_specialized_space=None):
-        time_to_carpark = {}  # Dictionary to store the time to reach each car park
-        for car_park in self.car_parks:
-            if car_park.has_available_space():
-                if requires_specialized_space:
-                    if not car_park.has_available_specialized_space(requires_specialized_space):
-                        continue  # Skip this car park if required specialized space is not available
-                drive_time = self.calculate_time(user_location, car_park.location, self.traffic_density)
-                walk_time = self.calculate_time(car_park.location, destination_location,
-                                                'low')  # Walking time is unaffected by traffic density
-                total_time = drive_time + walk_time
-                time_to_carpark[car_park] = total_time
-
-        # Sort the car parks based on total time and filter out full car parks
-        sorted_carparks = sorted(time_to_carpark.items(), key=lambda x: x[1])
-        available_carparks = [car_park for car_park, time in sorted_carparks if car_park.has_available_space()]
+        with self.metrics.request('find_optimal_car_park'):
+            time_to_carpark = {}  # Dictionary to store the time to reach each car park
+            with self.metrics.stage('score'):
+                for car_park in self.car_parks:
+                    if car_park.has_available_space():
+                        if requires_specialized_space:
+                            if not car_park.has_available_specialized_space(requires_specialized_space):
+                                continue  # Skip this car park if required specialized space is not available
+                        drive_time = self.calculate_time(user_location, car_park.location, self.traffic_density)
+                        walk_time = self.calculate_time(car_park.location, destination_location,
+                                                        'low')  # Walking time is unaffected by traffic density
+                        total_time = drive_time + walk_time
+                        time_to_carpark[car_park] = total_time
+            self.metrics.count_all({'car_parks_scanned': len(self.car_parks),
+                                    'car_parks_filtered': len(self.car_parks) - len(time_to_carpark),
+                                    'car_parks_scored': len(time_to_carpark)})
+
+            # Sort the car parks based on total time and filter out full car parks
+            with self.metrics.stage('sort'):
+                sorted_carparks = sorted(time_to_carpark.items(), key=lambda x: x[1])
+                available_carparks = [car_park for car_park, time in sorted_carparks if car_park.has_available_space()]
 
         return available_carparks
 
     def simulate(self, user_location, destination_location, requires_specialized_space=None):
-        # Step 4: Calculate optimal car park
-        car_parks = self.find_optimal_car_park(user_location, destination_location, requires_specialized_space)
-
-        # Step 5: Send output
-        if car_parks:
-            print("List of car parks in order of best option:")
-            for i, car_park in enumerate(car_parks, start=1):
-                print(f"{i}. {car_park.name}")
-                car_park.display_specialized_spaces()  # Display specialized spaces availability
-                car_park.display_parking_spaces()  # Display regular parking spaces availability
-        else:
-            print("No available parking spaces.")
+        with self.metrics.request('simulate'):
+            # Step 4: Calculate optimal car park
+            car_parks = self.find_optimal_car_park(user_location, destination_location, requires_specialized_space)
+
+            # Step 5: Send output
+            with self.metrics.stage('print'):
+                if car_parks:
+                    print("List of car parks in order of best option:")
+                    for i, car_park in enumerate(car_parks, start=1):
+                        print(f"{i}. {car_park.name}")
+                        car_park.display_specialized_spaces()  # Display specialized spaces availability
+                        car_park.display_parking_spaces()  # Display regular parking spaces availability
+                else:
+                    print("No available parking spaces.")
 
 
 if __name__ == "__main__":
@@ -129,3 +139,7 @@ if __name__ == "__main__":
     matrix = algorithm.generate_matrix(user_location, destination_location)
     for row in matrix:
         print(" ".join(row))
+
+    # Where the time went
+    print("\nMetrics:")
+    print(algorithm.metrics.to_text())
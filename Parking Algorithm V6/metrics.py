@@ -0,0 +1,101 @@
+import bisect
+import time
+
+# Histogram bucket upper bounds: powers of two from about 1 microsecond to about 1000 seconds, so recording a value
+# is one binary search and an increment, and the memory per histogram is fixed however long it stays on
+BUCKET_BOUNDS = [2.0 ** exponent for exponent in range(-20, 11)]
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # The last bucket counts values above the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the value at this fraction (never more than the largest value seen)
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max
+        }
+
+
+class StageTimer:
+    # Times one stage into its histogram; a plain class rather than a generator context manager to keep it cheap
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    # Stage timings and counters of one thread
+    def __init__(self):
+        self.stages = {}  # Stage name -> Histogram of seconds
+        self.counters = {}
+
+    def stage(self, name):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = Histogram()
+        return StageTimer(histogram)
+
+    def request(self, name):
+        # A whole request is timed like any other stage
+        return self.stage(name)
+
+    def count_all(self, amounts):
+        for name, amount in amounts.items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        return {
+            'stages': {name: histogram.snapshot() for name, histogram in sorted(self.stages.items())},
+            'counters': dict(sorted(self.counters.items()))
+        }
+
+    def to_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot['stages']:
+            lines.append(f"{'stage':<28}{'count':>10}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"
+                         f"{'max ms':>10}")
+            for name, stage in snapshot['stages'].items():
+                lines.append(f"{name:<28}{stage['count']:>10}{stage['total'] * 1000:>12.3f}{stage['mean'] * 1000:>10.3f}"
+                             f"{stage['p50'] * 1000:>10.3f}{stage['p99'] * 1000:>10.3f}{stage['max'] * 1000:>10.3f}")
+        for name, count in snapshot['counters'].items():
+            lines.append(f"{name}: {count}")
+        return '\n'.join(lines)
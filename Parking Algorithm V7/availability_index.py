@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def requirement_types(requirement):
+    # A requirement is None, one space type, or a collection of space types that must all be present
+    # (e.g. ('ev_charging', 'handicap')); returned as a sorted tuple usable as a key
+    if not requirement:
+        return ()
+    if isinstance(requirement, str):
+        return (requirement,)
+    return tuple(sorted(set(requirement)))
+
+
+class AvailabilityIndex:
+    # One bitmap (a bool per car park, by catalog position) for each space type saying which car parks have that
+    # kind of space, one saying which still have a free space, and the sorted positions of every type's members.
+    # Car parks matching a requirement are found from the members of its rarest type, narrowed by the other types'
+    # bitmaps (cached per combination) and then by the free bitmap, so a filtered query costs in proportion to the
+    # matching car parks instead of the catalog. The free bitmap is updated in place as spaces fill and empty.
+    def __init__(self, type_masks, free_mask):
+        self.type_masks = {space_type: np.asarray(mask, dtype=bool) for space_type, mask in type_masks.items()}
+        self.members = {space_type: np.flatnonzero(mask) for space_type, mask in self.type_masks.items()}
+        self.free = np.array(free_mask, dtype=bool)
+        self.combined = {}  # Sorted tuple of space types -> positions of the car parks that have all of them
+
+    def __len__(self):
+        return len(self.free)
+
+    def members_of(self, types):
+        # Positions of the car parks with every space type in types (free or not); unknown types match nothing
+        members = self.combined.get(types)
+        if members is None:
+            if any(space_type not in self.members for space_type in types):
+                members = np.empty(0, dtype=np.int64)
+            else:
+                rarest = min(types, key=lambda space_type: len(self.members[space_type]))
+                members = self.members[rarest]
+                for space_type in types:
+                    if space_type != rarest:
+                        members = members[self.type_masks[space_type][members]]
+            self.combined[types] = members
+        return members
+
+    def candidates(self, requirement=None):
+        # Sorted positions of the car parks with a free space and every required space type
+        types = requirement_types(requirement)
+        if not types:
+            return np.flatnonzero(self.free)
+        members = self.members_of(types)
+        return members[self.free[members]]
+
+    def mask(self, requirement=None):
+        # The same set as candidates, as a bitmap over the whole catalog
+        types = requirement_types(requirement)
+        if not types:
+            return self.free.copy()
+        mask = np.zeros(len(self.free), dtype=bool)
+        mask[self.candidates(types)] = True
+        return mask
+
+    def set_free(self, position, has_free_space):
+        # Returns whether the car park filled up or freed up, i.e. whether the bit changed
+        if self.free[position] == has_free_space:
+            return False
+        self.free[position] = has_free_space
+        return True
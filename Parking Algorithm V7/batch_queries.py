@@ -0,0 +1,161 @@
+import argparse
+import itertools
+import json
+import sqlite3
+import sys
+
+# Offline batch mode: a file of queries in, one JSON line of ranked car parks per query out.
+# Each input line is a JSON object in the service.py request format
+#   {"id": 1, "user_location": [2, 3], "destination_location": [7, 7], "requires_specialized_space": null, "limit": 3}
+# (id, requirement and limit are optional) or a bare [user_location, destination_location, requirement] array;
+# a requirement can be one space type or a list of space types that must all be present.
+# Each output line is {"id": ..., "car_parks": [{"id": ..., "name": ..., "location": [...]}, ...]}, or
+# {"id": ..., "error": ...} for a line that cannot be read; ids default to the query's line number (from 0).
+# Queries are read, ranked and written a chunk at a time, so memory stays flat however long the log is.
+
+
+def parse_location(value):
+    if not isinstance(value, list) or len(value) != 2 or \
+            not all(isinstance(coordinate, (int, float)) and not isinstance(coordinate, bool) for coordinate in value):
+        raise ValueError(f"location must be [x, y], got {value!r}")
+    return tuple(value)
+
+
+def parse_requirement(value):
+    if value is None or isinstance(value, str) or \
+            (isinstance(value, list) and all(isinstance(space_type, str) for space_type in value)):
+        return value
+    raise ValueError(f"requirement must be a space type or a list of them, got {value!r}")
+
+
+def parse_query(line, line_number):
+    # Returns (query id, (user_location, destination_location, requirement), limit or None)
+    query = json.loads(line)
+    if isinstance(query, list):
+        user_location, destination_location, *rest = query
+        return line_number, (parse_location(user_location), parse_location(destination_location),
+                             parse_requirement(rest[0] if rest else None)), None
+    if not isinstance(query, dict):
+        raise ValueError(f"query must be an object or an array, got {query!r}")
+    limit = query.get('limit')
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+        raise ValueError("limit must be null or a non-negative integer")
+    return query.get('id', line_number), (parse_location(query['user_location']),
+                                          parse_location(query['destination_location']),
+                                          parse_requirement(query.get('requires_specialized_space'))), limit
+
+
+class ResultWriter:
+    def __init__(self, output):
+        # Every car park is serialised once and reused in every result it appears in, until the catalog changes
+        self.output = output
+        self.fragments = {}
+        self.catalog_key = None
+
+    def car_park_json(self, car_park):
+        fragment = self.fragments.get(car_park.id)
+        if fragment is None:
+            fragment = json.dumps({'id': car_park.id, 'name': car_park.name, 'location': list(car_park.location)})
+            self.fragments[car_park.id] = fragment
+        return fragment
+
+    def write_chunk(self, catalog_key, results):
+        # results: (query id, car parks or None, error or None) in query order. catalog_key changes whenever car
+        # parks may have been renamed or moved.
+        if catalog_key != self.catalog_key:
+            self.fragments = {}
+            self.catalog_key = catalog_key
+        lines = []
+        for query_id, car_parks, error in results:
+            if error is not None:
+                lines.append(json.dumps({'id': query_id, 'error': error}) + '\n')
+            else:
+                lines.append(f'{{"id": {json.dumps(query_id)}, "car_parks": ['
+                             f'{", ".join(map(self.car_park_json, car_parks))}]}}\n')
+        self.output.writelines(lines)
+
+
+def run_batch(algorithm, lines, output, limit=None, chunk_size=1024):
+    # Ranks the queries in lines (an open file or any iterable of strings) chunk_size at a time with one
+    # find_optimal_car_parks pass per chunk, writing the results to output in input order. limit applies to queries
+    # without their own. Returns the number of queries answered and the number of lines rejected.
+    writer = ResultWriter(output)
+    answered = rejected = 0
+    numbered = ((number, line) for number, line in enumerate(lines) if line.strip())
+    while chunk := list(itertools.islice(numbered, chunk_size)):
+        parsed = []
+        for line_number, line in chunk:
+            try:
+                query_id, query, query_limit = parse_query(line, line_number)
+                parsed.append((query_id, query, limit if query_limit is None else query_limit, None))
+            except (ValueError, KeyError, TypeError) as error:
+                parsed.append((line_number, None, None, f"{type(error).__name__}: {error}"))
+
+        # One ranking pass with the largest limit asked for; smaller limits take a prefix of their result
+        queries = [query for _, query, _, error in parsed if error is None]
+        limits = [query_limit for _, _, query_limit, error in parsed if error is None]
+        chunk_limit = None if None in limits else max(limits, default=0)
+        with algorithm.metrics.stage('batch_rank'):
+            rankings = iter(algorithm.find_optimal_car_parks(queries, chunk_limit))
+        # The catalog list is replaced when car parks are added or removed, and its version moves when rows change
+        catalog_key = (id(algorithm.fetch_car_parks_from_database()), getattr(algorithm.catalog, 'version', None))
+
+        results = []
+        for query_id, query, query_limit, error in parsed:
+            if error is not None:
+                results.append((query_id, None, error))
+                rejected += 1
+            else:
+                car_parks = next(rankings)
+                results.append((query_id, car_parks if query_limit is None else car_parks[:query_limit], None))
+                answered += 1
+        with algorithm.metrics.stage('batch_write'):
+            writer.write_chunk(catalog_key, results)
+    output.flush()
+    return answered, rejected
+
+
+if __name__ == "__main__":
+    from car_park_store import CarParkStore
+    from database import CarParkDatabase, ConnectionPool
+    from main import CarParkRow, ParkingAlgorithm
+
+    parser = argparse.ArgumentParser(description="Rank a file of queries and stream the results as JSON lines")
+    parser.add_argument('queries', help="JSON lines file of queries ('-' for stdin)")
+    parser.add_argument('--output', default='-', help="JSON lines file to write ('-' for stdout)")
+    parser.add_argument('--limit', type=int, help="Car parks per query for queries without their own limit")
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    parser.add_argument('--traffic-density', choices=['low', 'medium', 'high'], default='medium')
+    parser.add_argument('--store', help="Read car parks from this car park store file instead of a database")
+    parser.add_argument('--sqlite', help="Read car parks from this SQLite file instead of MySQL")
+    args = parser.parse_args()
+    if args.limit is not None and args.limit < 0:
+        parser.error("--limit must be a non-negative integer")
+
+    if args.store:
+        pool = None
+    elif args.sqlite:
+        pool = ConnectionPool(lambda: sqlite3.connect(args.sqlite, check_same_thread=False), sqlite3.paramstyle)
+    else:
+        import mysql.connector
+
+        pool = ConnectionPool(lambda: mysql.connector.connect(
+            host="localhost",
+            user="your_username",
+            password="your_password",
+            database="your_database"
+        ), mysql.connector.paramstyle, size=1)
+    algorithm = ParkingAlgorithm(CarParkDatabase(pool) if pool else None, traffic_density=args.traffic_density,
+                                 catalog=CarParkStore(args.store, CarParkRow) if args.store else None)
+
+    queries = sys.stdin if args.queries == '-' else open(args.queries)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', buffering=1 << 20)
+    try:
+        answered, rejected = run_batch(algorithm, queries, output, args.limit, args.chunk_size)
+        print(f"Answered {answered} queries, rejected {rejected} lines", file=sys.stderr)
+    finally:
+        for file in (queries, output):
+            if file not in (sys.stdin, sys.stdout):
+                file.close()
+        if pool:
+            pool.close()
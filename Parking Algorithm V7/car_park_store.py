@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import threading
+
+import numpy as np
+
+from car_park_table import CarParkTable, TableRow, TextColumn
+
+# A car park store is one file: the magic bytes, the format version and the header length (two little-endian
+# uint32), a JSON header, then every array at a 64-byte aligned offset. Readers map the arrays with np.memmap:
+# columns read-only, occupancy copy-on-write, so every worker on the machine shares the same page cache pages
+# and a worker's own occupancy updates stay private to it.
+# Files are replaced, never rewritten: writers build a temporary file and rename it over the old one, so a reader
+# sees either the old or the new file in full and keeps its old mapping until it reopens.
+MAGIC = b'CARPARKS'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_store(table, path, version=None):
+    arrays = {
+        'occupancy': np.frombuffer(table.occupancy, dtype=np.uint8),
+        'space_counts': table.space_counts,
+        'free_counts': table.free_counts,
+        'byte_offsets': table.byte_offsets
+    }
+    if table.id_order is not None:
+        arrays['id_order'] = table.id_order
+    columns = {}
+    for name, values in table.columns.items():
+        if isinstance(values, TextColumn):
+            arrays[f'column:{name}:data'] = np.frombuffer(values.data, dtype=np.uint8)
+            arrays[f'column:{name}:offsets'] = values.offsets
+            columns[name] = 'text'
+        else:
+            arrays[f'column:{name}'] = values
+            columns[name] = 'array'
+
+    header = {
+        'version': version,
+        'count': len(table),
+        'free_value': table.free_value,
+        'occupancy_column': table.occupancy_column,
+        'columns': columns,
+        'arrays': {}
+    }
+    # Offsets depend on the header length, which depends on the offsets; lay out until it stops growing
+    header_length = 0
+    while True:
+        offset = align(len(MAGIC) + 8 + header_length)
+        for key, array in arrays.items():
+            header['arrays'][key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = align(offset + array.nbytes)
+        encoded_header = json.dumps(header).encode('utf-8')
+        if len(encoded_header) <= header_length:
+            break
+        header_length = len(encoded_header) + 64
+
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(MAGIC + struct.pack('<II', FORMAT_VERSION, header_length))
+            file.write(encoded_header.ljust(header_length))
+            for key, array in arrays.items():
+                file.seek(header['arrays'][key]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(offset)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def open_store(path, row_class=TableRow):
+    # Returns (table, version) with every array mapped from the file
+    with open(path, 'rb') as file:
+        preamble = file.read(len(MAGIC) + 8)
+        if preamble[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a car park store")
+        format_version, header_length = struct.unpack('<II', preamble[len(MAGIC):])
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} has store format {format_version}, expected {FORMAT_VERSION}")
+        header = json.loads(file.read(header_length))
+
+    def mapped(key, mode='r'):
+        layout = header['arrays'][key]
+        if not np.prod(layout['shape']):
+            return np.zeros(layout['shape'], dtype=layout['dtype'])
+        return np.memmap(path, dtype=layout['dtype'], mode=mode, offset=layout['offset'], shape=tuple(layout['shape']))
+
+    columns = {}
+    for name, kind in header['columns'].items():
+        if kind == 'text':
+            columns[name] = TextColumn.from_buffer(mapped(f'column:{name}:data'), mapped(f'column:{name}:offsets'))
+        else:
+            columns[name] = mapped(f'column:{name}')
+    table = CarParkTable.from_arrays(columns, mapped('occupancy', 'c'), mapped('space_counts'),
+                                     mapped('free_counts', 'c'), mapped('byte_offsets'),
+                                     mapped('id_order') if 'id_order' in header['arrays'] else None,
+                                     header['free_value'], header['occupancy_column'], row_class)
+    return table, header['version']
+
+
+class CarParkStore:
+    def __init__(self, path, row_class=TableRow):
+        # Serves the car parks of a store file to ParkingAlgorithm like a catalog, picking up a replaced file on
+        # the next read (checked with one stat call)
+        self.path = path
+        self.row_class = row_class
+        self.car_parks = None
+        self.version = None
+        self.changes = 0  # Moves with every file opened, like CarParkCatalog.changes
+        self.file_id = None
+        self.lock = threading.Lock()
+
+    @property
+    def by_id(self):
+        return self.get_car_parks()
+
+    def get_car_parks(self):
+        with self.lock:
+            status = os.stat(self.path)
+            file_id = (status.st_dev, status.st_ino, status.st_mtime_ns)
+            if file_id != self.file_id:
+                self.car_parks, self.version = open_store(self.path, self.row_class)
+                self.changes += 1
+                self.file_id = file_id
+            return self.car_parks
+
+    def invalidate(self, car_park_id=None):
+        with self.lock:
+            self.file_id = None
+
+
+def export_car_parks(database, path, version_column='updated_at'):
+    # Writes the whole car_parks table to a store file, versioned by the highest version column value
+    from main import car_park_table_from_rows
+
+    rows = database.fetch_all()
+    version = max((row[version_column] for row in rows if row.get(version_column) is not None), default=None)
+    write_store(car_park_table_from_rows(rows), path, version)
+    return len(rows), version
+
+
+if __name__ == "__main__":
+    from database import CarParkDatabase, ConnectionPool
+
+    parser = argparse.ArgumentParser(description="Export the car_parks table to a memory-mapped car park store")
+    parser.add_argument('output')
+    parser.add_argument('--sqlite', help="Read car parks from this SQLite file instead of MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        pool = ConnectionPool(lambda: sqlite3.connect(args.sqlite, check_same_thread=False), sqlite3.paramstyle)
+    else:
+        import mysql.connector
+
+        pool = ConnectionPool(lambda: mysql.connector.connect(
+            host="localhost",
+            user="your_username",
+            password="your_password",
+            database="your_database"
+        ), mysql.connector.paramstyle, size=1)
+    try:
+        count, version = export_car_parks(CarParkDatabase(pool), args.output)
+        print(f"Exported {count} car parks (version {version}) to {args.output}")
+    finally:
+        pool.close()
@@ -0,0 +1,224 @@
+import numpy as np
+
+from occupancy import OccupancyBitmap
+
+
+class TextColumn:
+    # Strings stored as one UTF-8 buffer plus offsets instead of one Python object each
+    def __init__(self, values):
+        encoded = [str(value).encode('utf-8') for value in values]
+        self.data = b''.join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.offsets[1:])
+
+    @classmethod
+    def from_buffer(cls, data, offsets):
+        # Wraps an existing UTF-8 buffer (bytes, memoryview or uint8 array) and its offsets without copying
+        column = cls.__new__(cls)
+        column.data = memoryview(data).cast('B')
+        column.offsets = offsets
+        return column
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.nbytes
+
+
+class OccupancyView(OccupancyBitmap):
+    # The occupancy bitmap of one table row, read and written in place in the table's shared buffer
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+        self.size = int(table.space_counts[index])
+        self.free_value = table.free_value
+        self.bits = memoryview(table.occupancy)[table.byte_offsets[index]:table.byte_offsets[index + 1]]
+
+    @property
+    def free_count(self):
+        return int(self.table.free_counts[self.index])
+
+    @free_count.setter
+    def free_count(self, value):
+        self.table.free_counts[self.index] = value
+
+
+class TableRow:
+    # Lightweight view of one car park: columns read as attributes (car_park.name) or keys (car_park['name'])
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.table.value(self.index, key)
+
+    def __getattr__(self, key):
+        try:
+            return self.table.value(self.index, key)
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __contains__(self, key):
+        return key in self.table.columns or key == self.table.occupancy_column
+
+    def __eq__(self, other):
+        return isinstance(other, TableRow) and self.table is other.table and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.index})"
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(self.table.columns) + [self.table.occupancy_column]
+
+
+class CarParkTable:
+    def __init__(self, columns, spaces, free_value=1, occupancy_column='parking_spaces', row_class=TableRow,
+                 space_counts=None):
+        # columns maps a name to one value per car park: strings become a TextColumn, (x, y) pairs an n x 2 array
+        # and everything else a NumPy array (pass one with an explicit dtype to pick the type).
+        # spaces holds each car park's spaces in the source encoding (free_value marks a free space) or an
+        # OccupancyBitmap; with space_counts it is instead one flat array of every car park's spaces in turn.
+        # All of them are packed into one buffer, each car park starting on a byte boundary.
+        self.free_value = free_value
+        self.occupancy_column = occupancy_column
+        self.row_class = row_class
+        self.columns = {}
+        for name, values in columns.items():
+            if not isinstance(values, np.ndarray):
+                values = list(values)
+                if values and all(isinstance(value, str) for value in values):
+                    values = TextColumn(values)
+                else:
+                    values = np.asarray(values)
+            self.columns[name] = values
+
+        if space_counts is None:
+            self.pack_spaces(spaces)
+        else:
+            self.pack_flat_spaces(np.asarray(spaces).reshape(-1), np.asarray(space_counts))
+
+        for name, values in self.columns.items():
+            if len(values) != len(self.space_counts):
+                raise ValueError(f"Column {name!r} has {len(values)} values for {len(self.space_counts)} car parks")
+        self.id_order = np.argsort(self.columns['id'], kind='stable') if 'id' in self.columns else None
+
+    def pack_spaces(self, spaces):
+        packed = []
+        space_counts = []
+        free_counts = []
+        for car_park_spaces in spaces:
+            if isinstance(car_park_spaces, OccupancyBitmap):
+                packed.append(bytes(car_park_spaces.bits))
+                space_counts.append(car_park_spaces.size)
+                free_counts.append(car_park_spaces.free_count)
+            else:
+                free = np.asarray(car_park_spaces).reshape(-1) == self.free_value
+                packed.append(np.packbits(free, bitorder='little').tobytes())
+                space_counts.append(len(free))
+                free_counts.append(int(free.sum()))
+        self.occupancy = bytearray(b''.join(packed))
+        self.space_counts = np.array(space_counts, dtype=np.int32)
+        self.free_counts = np.array(free_counts, dtype=np.int32)
+        self.byte_offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+        np.cumsum((self.space_counts + 7) // 8, out=self.byte_offsets[1:])
+
+    def pack_flat_spaces(self, spaces, space_counts):
+        # Same layout as pack_spaces without a Python loop: every space is moved to its car park's bit offset
+        self.space_counts = space_counts.astype(np.int32)
+        self.byte_offsets = np.zeros(len(space_counts) + 1, dtype=np.int64)
+        np.cumsum((self.space_counts + 7) // 8, out=self.byte_offsets[1:])
+        space_starts = np.zeros(len(space_counts) + 1, dtype=np.int64)
+        np.cumsum(self.space_counts, out=space_starts[1:])
+        car_park_of_space = np.repeat(np.arange(len(space_counts)), self.space_counts)
+        free = spaces == self.free_value
+        bits = np.zeros(self.byte_offsets[-1] * 8, dtype=bool)
+        bits[np.arange(len(spaces)) - space_starts[car_park_of_space] + self.byte_offsets[car_park_of_space] * 8] = free
+        self.occupancy = bytearray(np.packbits(bits, bitorder='little').tobytes())
+        self.free_counts = np.bincount(car_park_of_space, weights=free, minlength=len(space_counts)).astype(np.int32)
+
+    @classmethod
+    def from_arrays(cls, columns, occupancy, space_counts, free_counts, byte_offsets, id_order=None, free_value=1,
+                    occupancy_column='parking_spaces', row_class=TableRow):
+        # Wraps already packed arrays (e.g. memory-mapped from a car park store) without copying them
+        table = cls.__new__(cls)
+        table.free_value = free_value
+        table.occupancy_column = occupancy_column
+        table.row_class = row_class
+        table.columns = dict(columns)
+        table.occupancy = occupancy
+        table.space_counts = space_counts
+        table.free_counts = free_counts
+        table.byte_offsets = byte_offsets
+        if id_order is None and 'id' in table.columns:
+            id_order = np.argsort(table.columns['id'], kind='stable')
+        table.id_order = id_order
+        return table
+
+    @classmethod
+    def from_records(cls, records, fields, free_value=1, occupancy_column='parking_spaces', row_class=TableRow):
+        # Builds a table from car park dictionaries or objects, keeping the given fields
+        records = list(records)
+
+        def field(record, name):
+            return record[name] if isinstance(record, dict) else getattr(record, name)
+
+        columns = {name: [field(record, name) for record in records] for name in fields}
+        spaces = [field(record, occupancy_column) for record in records]
+        return cls(columns, spaces, free_value, occupancy_column, row_class)
+
+    def __len__(self):
+        return len(self.space_counts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.row_class(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row_class(self, index)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def value(self, index, name):
+        if name == self.occupancy_column:
+            return OccupancyView(self, index)
+        value = self.columns[name][index]
+        if isinstance(value, np.ndarray):
+            return tuple(value.tolist())
+        return value.item() if isinstance(value, np.generic) else value
+
+    def available_mask(self):
+        return self.free_counts > 0
+
+    def get(self, car_park_id, default=None):
+        # Row for a car park id (binary search over the id column), or default
+        if self.id_order is None:
+            raise KeyError('id')
+        ids = self.columns['id']
+        position = np.searchsorted(ids, car_park_id, sorter=self.id_order)
+        if position < len(ids) and ids[self.id_order[position]] == car_park_id:
+            return self.row_class(self, int(self.id_order[position]))
+        return default
+
+    @property
+    def nbytes(self):
+        columns = sum(values.nbytes for values in self.columns.values())
+        return columns + len(self.occupancy) + self.space_counts.nbytes + self.free_counts.nbytes + \
+            self.byte_offsets.nbytes + (self.id_order.nbytes if self.id_order is not None else 0)
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from occupancy import OccupancyBitmap
+
+
+def car_park_state(car_park):
+    # Everything a car park holds, with its spaces as comparable bytes
+    return {name: (value.size, bytes(value.bits)) if isinstance(value, OccupancyBitmap) else value
+            for name, value in vars(car_park).items()}
+
+
+def replace_car_park(existing, car_park):
+    # Copies a re-read car park onto the one in the catalog; returns whether anything differed
+    changed = car_park_state(existing) != car_park_state(car_park)
+    vars(existing).update(vars(car_park))
+    return changed
+
+
+class CarParkCatalog:
+    def __init__(self, database, parse_row, max_staleness=5.0, version_column='updated_at', clock=time.monotonic,
+                 update_car_park=replace_car_park):
+        self.database = database
+        self.parse_row = parse_row  # Builds a car park from a row dictionary
+        # Applies a re-read car park to the existing one in place and returns whether that changed it
+        self.update_car_park = update_car_park
+        self.max_staleness = max_staleness  # Seconds before the next read refreshes; None only refreshes on request
+        self.version_column = version_column
+        self.clock = clock
+        self.car_parks = []
+        self.by_id = {}
+        self.version = None  # Highest version column value seen so far
+        # Moves whenever a load or refresh changes any car park, so anything derived from their contents (such as
+        # the availability index) knows to rebuild; re-reading unchanged rows leaves it alone
+        self.changes = 0
+        self.refreshed_at = None
+        self.pending_ids = set()  # Car parks explicitly invalidated since the last refresh
+        self.lock = threading.Lock()
+
+    def get_car_parks(self):
+        with self.lock:
+            if self.refreshed_at is None:
+                self.load()
+            elif self.pending_ids or (self.max_staleness is not None and
+                                      self.clock() - self.refreshed_at >= self.max_staleness):
+                self.refresh()
+            return self.car_parks
+
+    def invalidate(self, car_park_id=None):
+        # Without an id the next read reloads the whole table (e.g. after rows were deleted),
+        # with an id only that row is re-read
+        with self.lock:
+            if car_park_id is None:
+                self.refreshed_at = None
+            else:
+                self.pending_ids.add(car_park_id)
+
+    def load(self):
+        # Car parks already handed out stay the same objects, updated like on a refresh
+        rows = self.database.fetch_all()
+        by_id = {}
+        for row in rows:
+            car_park = self.parse_row(row)
+            existing = self.by_id.get(car_park.id)
+            if existing is not None:
+                self.update_car_park(existing, car_park)
+                car_park = existing
+            by_id[car_park.id] = car_park
+        self.car_parks = list(by_id.values())
+        self.by_id = by_id
+        self.version = max((row[self.version_column] for row in rows), default=None)
+        self.changes += 1
+        self.pending_ids.clear()
+        self.refreshed_at = self.clock()
+
+    def refresh(self):
+        # Rows with the same version as the last one seen are read again, so rows written within the same
+        # timestamp tick are never missed; applying an unchanged row is harmless
+        refreshed_at = self.clock()
+        if self.version is None:
+            rows = self.database.fetch_all()
+        else:
+            rows = self.database.fetch_changed(self.version_column, self.version)
+
+        pending_ids = self.pending_ids - {row['id'] for row in rows}
+        if pending_ids:
+            pending_rows = self.database.fetch_by_ids(pending_ids)
+            removed_ids = pending_ids - {row['id'] for row in pending_rows}
+            rows += pending_rows
+        else:
+            removed_ids = set()
+        self.apply(rows, removed_ids)
+        self.pending_ids.clear()
+        self.refreshed_at = refreshed_at
+
+    def apply(self, rows, removed_ids=()):
+        # Changed car parks are updated in place. The list itself is only replaced when car parks are added,
+        # removed or moved, so anything built from the locations (such as the spatial index) stays valid otherwise.
+        catalog_changed = bool(removed_ids)
+        car_parks_changed = False
+        for row in rows:
+            car_park = self.parse_row(row)
+            existing = self.by_id.get(car_park.id)
+            if existing is None:
+                self.by_id[car_park.id] = car_park
+                catalog_changed = True
+            else:
+                catalog_changed = catalog_changed or existing.location != car_park.location
+                car_parks_changed = self.update_car_park(existing, car_park) or car_parks_changed
+            version = row[self.version_column]
+            if self.version is None or version > self.version:
+                self.version = version
+
+        for car_park_id in removed_ids:
+            self.by_id.pop(car_park_id, None)
+        if catalog_changed:
+            self.car_parks = list(self.by_id.values())
+        if catalog_changed or car_parks_changed:
+            self.changes += 1
+
+
+class StaticCatalog:
+    # A fixed set of car parks (a list or a CarParkTable) served without a database
+    def __init__(self, car_parks):
+        self.car_parks = car_parks
+        self.by_id = car_parks if hasattr(car_parks, 'get') else {car_park.id: car_park for car_park in car_parks}
+        self.version = None
+        self.changes = 0
+
+    def get_car_parks(self):
+        return self.car_parks
+
+    def invalidate(self, car_park_id=None):
+        pass
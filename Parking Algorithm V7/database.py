@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import Histogram
+
+
+# Placeholder that replaces '?' in the SQL below, per DB-API paramstyle of the driver
+PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+
+class ConnectionPool:
+    def __init__(self, connect, paramstyle, size=8, timeout=None, prepared=False):
+        self.connect = connect  # Opens a new connection, e.g. lambda: mysql.connector.connect(...)
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError(f"Unsupported paramstyle {paramstyle!r}; expected one of {sorted(PLACEHOLDERS)}")
+        self.placeholder = PLACEHOLDERS[paramstyle]  # paramstyle is the driver's, e.g. mysql.connector.paramstyle
+        self.size = size
+        self.timeout = timeout  # Seconds to wait for a free connection; None waits forever
+        self.prepared = prepared  # Use server-side prepared statements (mysql.connector cursor(prepared=True))
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.statements = {}  # Prepared cursors per connection, keyed by SQL text
+        self.wait_time = Histogram()
+
+    def open_connection(self):
+        connection = self.connect()
+        self.statements[id(connection)] = {}
+        return connection
+
+    def acquire(self):
+        started = time.perf_counter()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            if can_open:
+                try:
+                    connection = self.open_connection()
+                except Exception:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                try:
+                    connection = self.idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No database connection became free within {self.timeout} seconds")
+        self.wait_time.record(time.perf_counter() - started)
+        return connection
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def cursor(self, connection, sql):
+        # Prepared cursors are kept per connection and SQL text so each statement is only prepared once.
+        # Without server-side preparation a plain cursor is used; sqlite3 caches compiled statements itself.
+        if not self.prepared:
+            return connection.cursor(), True
+        statements = self.statements[id(connection)]
+        if sql not in statements:
+            statements[sql] = connection.cursor(prepared=True)
+        return statements[sql], False
+
+    def close(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            for cursor in self.statements.pop(id(connection), {}).values():
+                cursor.close()
+            connection.close()
+            with self.lock:
+                self.opened -= 1
+
+
+class CarParkDatabase:
+    def __init__(self, pool, batch_size=100, metrics=None):
+        self.pool = pool
+        self.batch_size = batch_size  # Ids per bulk fetch; short batches are padded so one statement is reused
+        # Optional metrics.Metrics, e.g. the ParkingAlgorithm's, that also gets query stages (metrics() is this
+        # database's own pool and query figures)
+        self.stage_metrics = metrics
+        self.query_time = Histogram()
+        self.rows_fetched = 0
+        self.lock = threading.Lock()
+
+    def query(self, sql, params=()):
+        with self.pool.connection() as connection:
+            sql = sql.replace('?', self.pool.placeholder)
+            started = time.perf_counter()
+            cursor, close = self.pool.cursor(connection, sql)
+            try:
+                cursor.execute(sql, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            finally:
+                if close:
+                    cursor.close()
+            elapsed = time.perf_counter() - started
+            self.query_time.record(elapsed)
+        with self.lock:
+            self.rows_fetched += len(rows)
+        if self.stage_metrics is not None:
+            self.stage_metrics.record('database_query', elapsed)
+            self.stage_metrics.count('database_rows_fetched', len(rows))
+        return rows
+
+    def fetch_all(self):
+        return self.query("SELECT * FROM car_parks")
+
+    def fetch_changed(self, version_column, version):
+        return self.query(f"SELECT * FROM car_parks WHERE {version_column} >= ?", (version,))
+
+    def fetch_by_ids(self, ids):
+        ids = list(ids)
+        rows = []
+        sql = f"SELECT * FROM car_parks WHERE id IN ({', '.join(['?'] * self.batch_size)})"
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            rows += self.query(sql, tuple(batch + [batch[-1]] * (self.batch_size - len(batch))))
+        return rows
+
+    def fetch_region(self, min_location, max_location):
+        return self.query("SELECT * FROM car_parks WHERE location_x BETWEEN ? AND ? AND location_y BETWEEN ? AND ?",
+                          (min_location[0], max_location[0], min_location[1], max_location[1]))
+
+    def metrics(self):
+        with self.lock:
+            rows_fetched = self.rows_fetched
+        return {
+            'pool_size': self.pool.size,
+            'connections_open': self.pool.opened,
+            'pool_wait': self.pool.wait_time.snapshot(),
+            'query_time': self.query_time.snapshot(),
+            'rows_fetched': rows_fetched
+        }
@@ -0,0 +1,172 @@
+import heapq
+import time
+
+import numpy as np
+
+from availability_index import requirement_types
+
+# Arrivals per minute for each hour of the day: quiet nights, a morning and an evening peak
+DEFAULT_ARRIVAL_RATES = [2, 1, 1, 1, 2, 5, 15, 40, 60, 45, 35, 35, 40, 35, 30, 35, 45, 55, 40, 25, 15, 10, 6, 3]
+REQUIREMENTS = [None, 'handicap', 'ev_charging']
+REQUIREMENT_PROBABILITIES = [0.9, 0.05, 0.05]
+
+
+def lognormal_stays(mean_minutes=120.0, sigma=0.75):
+    # Returns a sampler of stay durations in minutes with the given mean
+    mu = np.log(mean_minutes) - sigma ** 2 / 2
+    return lambda rng, count: rng.lognormal(mu, sigma, count)
+
+
+class RankingChooser:
+    def __init__(self, algorithm, car_parks):
+        # The same choice as algorithm.find_optimal_car_park(..., limit=1) on a fixed catalog with grid travel times
+        # (ties go to catalog order), from cached travel time vectors and the algorithm's availability index, which
+        # the simulator keeps up to date through space_changed, instead of an index search per arrival
+        self.algorithm = algorithm
+        self.car_parks = car_parks
+        self.table = algorithm.get_travel_time_table(car_parks)
+        self.drive_interval = algorithm.time_intervals[algorithm.traffic_density]
+        self.walk_interval = algorithm.time_intervals['low']
+        self.availability = None
+        self.eligible = {}
+
+    def __call__(self, user_location, destination_location, requires_specialized_space):
+        if not len(self.car_parks):
+            return None
+        with self.algorithm.state_lock:
+            availability = self.algorithm.get_availability_index(self.car_parks)
+        if availability is not self.availability:
+            # Car parks with the required space types, free or not; only the free bitmap changes between rebuilds
+            self.availability = availability
+            self.eligible = {}
+        eligible = self.eligible.get(requires_specialized_space)
+        if eligible is None:
+            types = requirement_types(requires_specialized_space)
+            eligible = np.ones(len(availability), dtype=bool)
+            if types:
+                eligible[:] = False
+                eligible[availability.members_of(types)] = True
+            self.eligible[requires_specialized_space] = eligible
+        times = self.table.times(user_location, self.drive_interval) + \
+            self.table.times(destination_location, self.walk_interval)
+        times[~(availability.free & eligible)] = np.inf
+        best = int(times.argmin())
+        return self.car_parks[best] if np.isfinite(times[best]) else None
+
+    def space_changed(self, car_park):
+        self.algorithm.space_changed(car_park)
+
+
+class EventSimulator:
+    def __init__(self, car_parks, choose, arrival_rates=None, stay_minutes=None, bucket_minutes=60,
+                 area=None, sample_minutes=15.0, seed=0):
+        # choose(user_location, destination_location, requires_specialized_space) returns a car park or None,
+        # e.g. ParkingAlgorithm.find_optimal_car_park with limit=1 (see for_algorithm). Occupancy is changed in
+        # place on the car parks' parking_spaces bitmaps as cars arrive and leave.
+        self.car_parks = car_parks
+        self.choose = choose
+        self.space_changed = getattr(choose, 'space_changed', None)  # Told about every occupy and release
+        self.arrival_rates = np.asarray(DEFAULT_ARRIVAL_RATES if arrival_rates is None else arrival_rates, dtype=float)
+        self.stay_minutes = stay_minutes or lognormal_stays()
+        self.bucket_minutes = bucket_minutes
+        self.sample_minutes = sample_minutes
+        self.rng = np.random.default_rng(seed)
+        if area is None:
+            locations = np.array([car_park.location for car_park in car_parks], dtype=float).reshape(-1, 2)
+            area = (locations.min(axis=0), locations.max(axis=0)) if len(locations) else ((0, 0), (0, 0))
+        self.area = (np.asarray(area[0], dtype=int), np.asarray(area[1], dtype=int))  # Trips start and end in here
+
+    @classmethod
+    def for_algorithm(cls, algorithm, **options):
+        car_parks = algorithm.fetch_car_parks_from_database()
+        if algorithm.road_graph is None and algorithm.traffic is None:
+            return cls(car_parks, RankingChooser(algorithm, car_parks), **options)
+
+        def choose(user_location, destination_location, requires_specialized_space):
+            car_parks = algorithm.find_optimal_car_park(user_location, destination_location,
+                                                        requires_specialized_space, limit=1)
+            return car_parks[0] if car_parks else None
+
+        choose.space_changed = algorithm.space_changed  # The algorithm's availability index follows the simulation
+        return cls(car_parks, choose, **options)
+
+    def draw_arrivals(self, duration_minutes):
+        # Non-homogeneous Poisson arrivals: a Poisson count per rate bucket, spread uniformly within it
+        bucket_starts = np.arange(0, duration_minutes, self.bucket_minutes, dtype=float)
+        bucket_lengths = np.minimum(self.bucket_minutes, duration_minutes - bucket_starts)
+        rates = self.arrival_rates[(bucket_starts // self.bucket_minutes).astype(int) % len(self.arrival_rates)]
+        counts = self.rng.poisson(rates * bucket_lengths)
+        times = np.repeat(bucket_starts, counts) + self.rng.random(counts.sum()) * np.repeat(bucket_lengths, counts)
+        return np.sort(times)
+
+    def run(self, duration_minutes=24 * 60):
+        started = time.perf_counter()
+        arrivals = self.draw_arrivals(duration_minutes)
+        count = len(arrivals)
+        low, high = self.area
+        user_locations = self.rng.integers(low, high + 1, size=(count, 2)).tolist()
+        destination_locations = self.rng.integers(low, high + 1, size=(count, 2)).tolist()
+        requirements = self.rng.choice(len(REQUIREMENTS), size=count, p=REQUIREMENT_PROBABILITIES).tolist()
+        stays = self.stay_minutes(self.rng, count).tolist()
+
+        occupied = sum(car_park.parking_spaces.size - car_park.parking_spaces.free_count for car_park in self.car_parks)
+        capacity = sum(car_park.parking_spaces.size for car_park in self.car_parks)
+        num_buckets = int(np.ceil(duration_minutes / self.bucket_minutes))
+        rejected_by_bucket = [0] * num_buckets
+        arrivals_by_bucket = [0] * num_buckets
+        sample_times = np.arange(0, duration_minutes + 1e-9, self.sample_minutes).tolist()
+        samples = []
+        sample_index = 0
+        departures = []  # Heap of (time, sequence, car park, space)
+        events = 0
+
+        # The end of the run is handled as one last arrival time, after which only the departures due by then remain
+        for index, arrival_time in enumerate(arrivals.tolist() + [duration_minutes]):
+            # Departures due before this arrival go first; the curve is sampled as the clock passes each sample time
+            while departures and departures[0][0] <= arrival_time:
+                departure_time, _, car_park, space = heapq.heappop(departures)
+                while sample_index < len(sample_times) and sample_times[sample_index] <= departure_time:
+                    samples.append(occupied)
+                    sample_index += 1
+                car_park.parking_spaces.release(space)
+                if self.space_changed:
+                    self.space_changed(car_park)
+                occupied -= 1
+                events += 1
+            while sample_index < len(sample_times) and sample_times[sample_index] <= arrival_time:
+                samples.append(occupied)
+                sample_index += 1
+            if index == count:
+                break
+
+            events += 1
+            bucket = int(arrival_time // self.bucket_minutes)
+            arrivals_by_bucket[bucket] += 1
+            car_park = self.choose(tuple(user_locations[index]), tuple(destination_locations[index]),
+                                   REQUIREMENTS[requirements[index]])
+            space = car_park.parking_spaces.first_free() if car_park is not None else None
+            if space is None:
+                rejected_by_bucket[bucket] += 1
+                continue
+            car_park.parking_spaces.occupy(space)
+            if self.space_changed:
+                self.space_changed(car_park)
+            occupied += 1
+            heapq.heappush(departures, (arrival_time + stays[index], index, car_park, space))
+
+        samples.extend([occupied] * (len(sample_times) - sample_index))
+
+        wall_seconds = time.perf_counter() - started
+        return {
+            'arrivals': count,
+            'rejected': sum(rejected_by_bucket),
+            'arrivals_by_bucket': arrivals_by_bucket,
+            'rejected_by_bucket': rejected_by_bucket,
+            'sample_minutes': sample_times,
+            'occupied': samples,
+            'occupancy': [value / capacity if capacity else 0.0 for value in samples],
+            'still_parked': len(departures),
+            'events': events,
+            'wall_seconds': wall_seconds,
+            'events_per_second': events / wall_seconds if wall_seconds else 0.0
+        }
@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class Hold:
+    # One space set aside for a driver on the way; the space is marked occupied until the hold is confirmed,
+    # released or expires
+    __slots__ = ('id', 'car_park', 'space', 'expires_at')
+
+    def __init__(self, id, car_park, space, expires_at):
+        self.id = id
+        self.car_park = car_park
+        self.space = space
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"Hold({self.id}, car park {self.car_park.id}, space {self.space})"
+
+
+class SpaceHolds:
+    def __init__(self, algorithm, hold_seconds=300.0, candidates=8, max_rankings=4, clock=time.monotonic):
+        # Recommends and reserves in one step, so concurrent drivers are never sent to the same last space.
+        # Rankings read occupancy without locking; a claim then takes the car park's space lock, re-checks that a
+        # space is still free and occupies it. A claim that loses the race moves on to the next car park in the
+        # ranking, and once candidates of them are used up the query is ranked again (at most max_rankings times),
+        # by which point the winners' claims have left the availability index.
+        # Held spaces stay occupied when catalog refreshes re-read their car parks from the database, and a space
+        # an occupancy update reports on is no longer the hold's to free.
+        self.algorithm = algorithm
+        algorithm.holds = self
+        self.hold_seconds = hold_seconds
+        self.candidates = candidates
+        self.max_rankings = max_rankings
+        self.clock = clock
+        self.holds = {}  # Hold id -> Hold
+        self.held = {}  # Car park id -> {space: id of the hold that owns it}
+        self.expiries = []  # Heap of (expires_at, hold id); holds confirmed or released meanwhile are skipped
+        self.lock = threading.Lock()  # Guards the three above; taken inside space locks, never around one
+        self.ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.holds)
+
+    def recommend_and_hold(self, user_location, destination_location, requires_specialized_space=None,
+                           hold_seconds=None):
+        # Returns the Hold on a space in the best car park that still had one, or None when no car park does
+        self.expire()
+        algorithm = self.algorithm
+        metrics = algorithm.metrics
+        with metrics.request('recommend_and_hold'):
+            tried = set()
+            for ranking in range(self.max_rankings):
+                if ranking:
+                    metrics.count('hold_rerankings')
+                car_parks = algorithm.find_optimal_car_park(user_location, destination_location,
+                                                            requires_specialized_space,
+                                                            limit=len(tried) + self.candidates)
+                untried = [car_park for car_park in car_parks if car_park.id not in tried]
+                if not untried:
+                    break
+                for car_park in untried:
+                    with metrics.stage('claim'):
+                        hold = self.claim(car_park, self.hold_seconds if hold_seconds is None else hold_seconds)
+                    if hold is not None:
+                        metrics.count('holds_granted')
+                        return hold
+                    metrics.count('hold_conflicts')
+                    tried.add(car_park.id)
+            metrics.count('holds_refused')
+            return None
+
+    def claim(self, car_park, hold_seconds):
+        # Occupies the lowest free space of car_park for a new hold and returns the hold, or None if the car park
+        # has filled up since it was ranked. The hold is registered before the space lock is let go, so a refresh
+        # re-reading the car park in between cannot free the space again.
+        algorithm = self.algorithm
+        with algorithm.space_lock(car_park):
+            spaces = car_park.parking_spaces
+            space = spaces.first_free()
+            if space is None:
+                return None
+            spaces.occupy(space)
+            hold = self.add(car_park, space, hold_seconds)
+        algorithm.space_changed(car_park)  # Takes the state lock, so only after the space lock is let go
+        return hold
+
+    def add(self, car_park, space, hold_seconds):
+        hold = Hold(next(self.ids), car_park, space, self.clock() + hold_seconds)
+        with self.lock:
+            self.holds[hold.id] = hold
+            self.held.setdefault(car_park.id, {})[space] = hold.id
+            heapq.heappush(self.expiries, (hold.expires_at, hold.id))
+        return hold
+
+    def remove(self, hold_id):
+        # Forgets a hold and returns it, or None if it had already gone
+        with self.lock:
+            return self.holds.pop(hold_id, None)
+
+    def disown(self, hold):
+        # Gives up the hold's space; returns whether it was still the hold's (call with self.lock held)
+        spaces = self.held.get(hold.car_park.id)
+        if spaces is None or spaces.get(hold.space) != hold.id:
+            return False
+        del spaces[hold.space]
+        if not spaces:
+            del self.held[hold.car_park.id]
+        return True
+
+    def free(self, hold):
+        # Frees the hold's space if it is still the hold's own: a space an occupancy update has reported on since,
+        # or one a newer hold has claimed after such an update freed it, is left alone. Returns whether it was freed.
+        algorithm = self.algorithm
+        with algorithm.space_lock(hold.car_park):
+            with self.lock:
+                owned = self.disown(hold)
+            if owned:
+                hold.car_park.parking_spaces.release(hold.space)
+        if owned:
+            algorithm.space_changed(hold.car_park)
+        return owned
+
+    def spaces_held(self, car_park_id):
+        # The spaces of a car park held right now, for keeping them occupied when it is re-read from the database
+        with self.lock:
+            return list(self.held.get(car_park_id, ()))
+
+    def space_reported(self, car_park_id, space):
+        # An occupancy update has reported the space's real state, which no hold may undo by freeing it later
+        with self.lock:
+            spaces = self.held.get(car_park_id)
+            if spaces is not None and spaces.pop(space, None) is not None and not spaces:
+                del self.held[car_park_id]
+
+    def confirm(self, hold_id):
+        # The driver has parked: the space stays occupied and is no longer held. Returns the hold, or None if it
+        # had already expired or been released.
+        hold = self.remove(hold_id)
+        if hold is not None:
+            with self.lock:
+                self.disown(hold)
+            self.algorithm.metrics.count('holds_confirmed')
+        return hold
+
+    def release(self, hold_id):
+        # The driver has gone elsewhere: the space is freed now rather than at expiry
+        hold = self.remove(hold_id)
+        if hold is None:
+            return False
+        self.free(hold)
+        self.algorithm.metrics.count('holds_released')
+        return True
+
+    def expire(self, now=None):
+        # Frees the spaces of every hold past its expiry; returns how many expired
+        now = self.clock() if now is None else now
+        head = self.expiries[:1]  # Checked without the lock, so every call can afford it
+        if not head or head[0][0] > now:
+            return 0
+        expired = []
+        with self.lock:
+            while self.expiries and self.expiries[0][0] <= now:
+                _, hold_id = heapq.heappop(self.expiries)
+                hold = self.holds.pop(hold_id, None)
+                if hold is not None:
+                    expired.append(hold)
+        for hold in expired:
+            self.free(hold)
+        if expired:
+            self.algorithm.metrics.count('holds_expired', len(expired))
+        return len(expired)
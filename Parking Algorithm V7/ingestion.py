@@ -0,0 +1,137 @@
+import json
+import queue
+import threading
+import time
+
+# Sensor events are JSON objects such as {"car_park_id": 3, "space": 12, "occupied": true}
+
+
+def parse_events(lines):
+    # One json.loads call per micro-batch instead of one per event. A batch with a malformed line is parsed again
+    # line by line, and the malformed lines come back as None for coalesce to reject.
+    try:
+        events = json.loads('[' + ','.join(lines) + ']')
+        if len(events) == len(lines):  # A line such as '1, 2' would otherwise parse as two events
+            return events
+    except ValueError:
+        pass
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            events.append(None)
+    return events
+
+
+def valid_event(event):
+    return isinstance(event, dict) and isinstance(event.get('car_park_id'), (int, str)) and \
+        type(event.get('space')) is int and isinstance(event.get('occupied'), (bool, int))
+
+
+def read_jsonl(lines, batch_size=4096):
+    # Micro-batches from any iterable of JSON lines, e.g. an open file
+    batch = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield parse_events(batch)
+            batch = []
+    if batch:
+        yield parse_events(batch)
+
+
+def read_queue(events, batch_size=4096, max_delay=0.005):
+    # Micro-batches from a queue of event dictionaries or JSON lines; None ends the stream.
+    # A batch is closed when it is full or max_delay seconds after its first event.
+    while True:
+        item = events.get()
+        if item is None:
+            return
+        batch = [item]
+        finished = False
+        deadline = time.monotonic() + max_delay
+        while len(batch) < batch_size:
+            try:
+                item = events.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                finished = True
+                break
+            batch.append(item)
+
+        lines = [item for item in batch if isinstance(item, str)]
+        if lines:
+            parsed = iter(parse_events(lines))
+            batch = [next(parsed) if isinstance(item, str) else item for item in batch]
+        yield batch
+        if finished:
+            return
+
+
+def read_socket(connection, batch_size=4096, max_delay=0.005):
+    # Micro-batches from a connected socket sending one JSON event per line
+    lines = queue.Queue()
+
+    def receive():
+        with connection.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=receive, daemon=True).start()
+    yield from read_queue(lines, batch_size, max_delay)
+
+
+def coalesce(events):
+    # Only the last event for each space in a micro-batch matters. Returns those updates and the number of malformed
+    # events, which are left out.
+    latest = {}
+    malformed = 0
+    for event in events:
+        if not valid_event(event):
+            malformed += 1
+            continue
+        latest[event['car_park_id'], event['space']] = bool(event['occupied'])
+    return latest, malformed
+
+
+class OccupancyIngestor:
+    def __init__(self, apply_updates):
+        self.apply_updates = apply_updates  # Applies {(car park id, space): occupied} and returns (changed, rejected)
+        self.events_received = 0
+        self.events_coalesced = 0
+        self.spaces_changed = 0
+        self.events_rejected = 0
+        self.batches = 0
+
+    def ingest(self, batches):
+        for events in batches:
+            updates, malformed = coalesce(events)
+            changed, rejected = self.apply_updates(updates)
+            self.batches += 1
+            self.events_received += len(events)
+            self.events_coalesced += len(events) - malformed - len(updates)
+            self.spaces_changed += changed
+            self.events_rejected += malformed + rejected
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'events_received': self.events_received,
+            'events_coalesced': self.events_coalesced,
+            'spaces_changed': self.spaces_changed,
+            'events_rejected': self.events_rejected
+        }
@@ -1,17 +1,50 @@
-import mysql.connector
+import numpy as np
 import random
+import sys
+import threading
+from availability_index import AvailabilityIndex, requirement_types
+from car_park_table import CarParkTable, TableRow
+from catalog import CarParkCatalog, car_park_state
+from database import CarParkDatabase, ConnectionPool
+from metrics import Metrics
+from occupancy import OccupancyBitmap
+from spatial_index import CarParkIndex
+from travel_times import TravelTimeTable
+
+# Space types a requirement can ask for, and the car park column counting them
+SPACE_TYPE_COLUMNS = {'handicap': 'handicap_spaces', 'ev_charging': 'ev_charging_spaces'}
+# A filtered query with at most this many matching car parks ranks them directly instead of searching the spatial index
+DIRECT_RANKING_LIMIT = 4096
+# Occupancy writers lock the car park they change through one of this many locks, picked by car park id
+SPACE_LOCK_STRIPES = 256
 
 class CarPark:
     def __init__(self, id, name, location, parking_spaces, handicap_spaces, ev_charging_spaces):
         self.id = id
         self.name = name
         self.location = location
-        self.parking_spaces = parking_spaces
+        self.parking_spaces = parking_spaces if isinstance(parking_spaces, OccupancyBitmap) else \
+            OccupancyBitmap.from_spaces(parking_spaces)
         self.handicap_spaces = handicap_spaces
         self.ev_charging_spaces = ev_charging_spaces
 
     def has_available_space(self):
-        return any(space == 1 for space in self.parking_spaces)
+        return self.parking_spaces.free_count > 0
+
+    def has_available_specialized_space(self, space_type):
+        if space_type == 'handicap':
+            return self.handicap_spaces > 0
+        elif space_type == 'ev_charging':
+            return self.ev_charging_spaces > 0
+        else:
+            return False
+
+class CarParkRow(TableRow):
+    # A car park in a CarParkTable, usable wherever a CarPark is
+    __slots__ = ()
+
+    def has_available_space(self):
+        return self.table.free_counts[self.index] > 0
 
     def has_available_specialized_space(self, space_type):
         if space_type == 'handicap':
@@ -21,72 +54,485 @@ class CarPark:
         else:
             return False
 
+def car_park_from_row(row):
+    return CarPark(row['id'], row['name'], (row['location_x'], row['location_y']),
+                   OccupancyBitmap.from_spaces(map(int, row['parking_spaces'].split(','))), row['handicap_spaces'],
+                   row['ev_charging_spaces'])
+
+def car_park_table_from_rows(rows):
+    # Typed columns instead of one CarPark object per row, for catalogs of millions of car parks.
+    # Spaces are read as car_park_from_row reads them. When every list is single digits joined by bare commas (as
+    # the database writes them), they parse in one pass as every other byte of the joined text.
+    rows = list(rows)
+    spaces = [row['parking_spaces'] for row in rows]
+    space_counts = np.fromiter((len(text) + 1 >> 1 for text in spaces), dtype=np.int64, count=len(spaces))
+    joined = np.frombuffer(','.join(spaces).encode('ascii'), dtype=np.uint8)
+    flat_spaces = joined[::2] - ord('0')
+    if not all(len(text) & 1 for text in spaces) or (flat_spaces > 9).any() or (joined[1::2] != ord(',')).any():
+        space_lists = [[int(space) for space in text.split(',')] for text in spaces]
+        space_counts = np.fromiter(map(len, space_lists), dtype=np.int64, count=len(space_lists))
+        flat_spaces = np.fromiter((space for space_list in space_lists for space in space_list), dtype=np.int64,
+                                  count=int(space_counts.sum()))
+    return CarParkTable({
+        'id': np.array([row['id'] for row in rows], dtype=np.int64),
+        'name': [row['name'] for row in rows],
+        'location': np.array([(row['location_x'], row['location_y']) for row in rows]).reshape(-1, 2),
+        'handicap_spaces': np.array([row['handicap_spaces'] for row in rows], dtype=np.int32),
+        'ev_charging_spaces': np.array([row['ev_charging_spaces'] for row in rows], dtype=np.int32)
+    }, flat_spaces, row_class=CarParkRow, space_counts=space_counts)
+
+def car_park_locations(car_parks):
+    if isinstance(car_parks, CarParkTable):
+        return car_parks.column('location')
+    return [car_park.location for car_park in car_parks]
+
+def build_availability_index(car_parks):
+    if isinstance(car_parks, CarParkTable):
+        type_masks = {space_type: car_parks.column(column) > 0 for space_type, column in SPACE_TYPE_COLUMNS.items()}
+        return AvailabilityIndex(type_masks, car_parks.available_mask())
+    type_masks = {space_type: np.fromiter((car_park.has_available_specialized_space(space_type) for car_park in car_parks),
+                                          dtype=bool, count=len(car_parks))
+                  for space_type in SPACE_TYPE_COLUMNS}
+    return AvailabilityIndex(type_masks, np.fromiter((car_park.has_available_space() for car_park in car_parks),
+                                                     dtype=bool, count=len(car_parks)))
+
+def grid_times(locations, location, interval):
+    # Manhattan travel time from location to each of an n x 2 array of locations at interval minutes per step
+    return (np.abs(locations[:, 0] - location[0]) + np.abs(locations[:, 1] - location[1])) * float(interval)
+
+def reach_interval(drive_interval, user, walk_interval, destination, reach):
+    # Interval of x with drive_interval * |x - user| + walk_interval * |x - destination| <= reach. That sum is the
+    # largest of its four choices of signs for the two terms, so each choice bounds x from one side.
+    low, high = -np.inf, np.inf
+    for drive_sign in (1, -1):
+        for walk_sign in (1, -1):
+            slope = drive_sign * drive_interval + walk_sign * walk_interval
+            bound = reach + drive_sign * drive_interval * user + walk_sign * walk_interval * destination
+            if slope > 0:
+                high = min(high, bound / slope)
+            elif slope < 0:
+                low = max(low, bound / slope)
+    return low, high
+
+def rank_positions(times, positions, limit=None):
+    # positions ordered by their times, ties by position so catalog order breaks them, cut to limit. Car parks with an
+    # infinite time (unreachable on a street graph) are left out.
+    # Everything tied with the limit-th time is kept through the partition so those ties are still broken by position.
+    if limit is not None and limit <= 0:
+        return positions[:0]
+    reachable = np.isfinite(times)
+    if not reachable.all():
+        times, positions = times[reachable], positions[reachable]
+    if limit is not None and limit < len(times):
+        keep = np.flatnonzero(times <= np.partition(times, limit - 1)[limit - 1])
+        times, positions = times[keep], positions[keep]
+    return positions[np.lexsort((positions, times))[:limit]]
+
+def format_car_parks(car_parks):
+    # The simulate listing as one string, written with a single print
+    if not car_parks:
+        return "No available parking spaces."
+    lines = ["List of car parks in order of best option:"]
+    for i, car_park in enumerate(car_parks, start=1):
+        lines += [f"{i}. {car_park.name}",
+                  f"Location: {car_park.location}",
+                  f"Parking Spaces: {car_park.parking_spaces}",
+                  f"Handicap Spaces: {car_park.handicap_spaces}",
+                  f"EV Charging Spaces: {car_park.ev_charging_spaces}",
+                  ""]
+    return "\n".join(lines)
+
 class ParkingAlgorithm:
-    def __init__(self, connection):
-        self.connection = connection
+    def __init__(self, database, max_staleness=5.0, road_graph=None, traffic_density='medium', traffic=None,
+                 catalog=None, metrics=None, ranking_cache=None):
+        self.database = database
+        # A StaticCatalog over a CarParkTable can stand in for the database-backed catalog
+        self.catalog = catalog or CarParkCatalog(database, car_park_from_row, max_staleness,
+                                                 update_car_park=self.update_car_park)
         self.time_intervals = {
             'low': 5,
             'medium': 10,
             'high': 15
         }
         self.walk_time = 15
+        self.traffic_density = traffic_density
+        self.traffic = traffic  # Optional TrafficRaster; when set, drive times follow its congestion for the time of day
+        self.traffic_time = None  # Datetime whose time-of-day bucket is used (None = now)
+        self.car_park_index = None
+        self.indexed_car_parks = None
+        self.travel_time_table = None
+        self.tabled_car_parks = None
+        self.pinned_destinations = set()
+        self.road_graph = road_graph  # When set, times come from shortest paths on the street graph
+        self.road_graph_times = None
+        self.routed_car_parks = None
+        self.availability_index = None
+        self.availability_key = None  # (car parks, catalog change count) the availability index was built for
+        self.availability_positions = None  # Car park id -> catalog position, for catalogs of CarPark objects
+        self.availability_locations = None
+        self.state_lock = threading.RLock()  # Held while occupancy is updated and while car parks are ranked
+        # Held while a car park's spaces are read and changed by a claim (see holds.py) or an update; a space lock
+        # may be taken while holding the state lock, never the other way round
+        self.space_locks = [threading.Lock() for _ in range(SPACE_LOCK_STRIPES)]
+        self.metrics = metrics if metrics is not None else Metrics()  # Stage timings and counters, always on
+        # Optional RankingCache of recent rankings; occupancy changed elsewhere must then be reported through
+        # space_changed, as it must for the availability index
+        self.ranking_cache = ranking_cache
+        # Latest streamed state of every space an occupancy update has reported, car park id -> {space: occupied};
+        # database reads are older than these, so they are applied again over every re-read car park
+        self.streamed_occupancy = {}
+        self.holds = None  # The SpaceHolds reserving spaces of these car parks, if any
 
     def fetch_car_parks_from_database(self):
-        cursor = self.connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM car_parks")
-        car_parks = []
-        for row in cursor.fetchall():
-            car_parks.append(CarPark(row['id'], row['name'], (row['location_x'], row['location_y']),
-                                      list(map(int, row['parking_spaces'].split(','))), row['handicap_spaces'],
-                                      row['ev_charging_spaces']))
-        cursor.close()
-        return car_parks
+        return self.catalog.get_car_parks()
+
+    def fetch_car_parks_by_ids(self, car_park_ids):
+        return [car_park_from_row(row) for row in self.database.fetch_by_ids(car_park_ids)]
+
+    def fetch_car_parks_in_region(self, min_location, max_location):
+        return [car_park_from_row(row) for row in self.database.fetch_region(min_location, max_location)]
+
+    def apply_occupancy_updates(self, updates):
+        # Applies a coalesced micro-batch {(car park id, space): occupied} in one step, so readers never see half of it.
+        # The spaces keep their streamed state when later catalog refreshes re-read their car parks.
+        changed = rejected = 0
+        with self.state_lock:
+            self.catalog.get_car_parks()
+            car_parks_by_id = self.catalog.by_id
+            touched = {}
+            for (car_park_id, space), occupied in updates.items():
+                car_park = car_parks_by_id.get(car_park_id)
+                if car_park is None or not 0 <= space < car_park.parking_spaces.size:
+                    rejected += 1
+                    continue
+                with self.space_lock(car_park):
+                    if occupied:
+                        changed += car_park.parking_spaces.occupy(space)
+                    else:
+                        changed += car_park.parking_spaces.release(space)
+                    self.streamed_occupancy.setdefault(car_park_id, {})[space] = occupied
+                    if self.holds is not None:
+                        self.holds.space_reported(car_park_id, space)
+                touched[car_park_id] = car_park
+            for car_park in touched.values():
+                self.space_changed(car_park)
+        return changed, rejected
+
+    def space_lock(self, car_park):
+        return self.space_locks[hash(car_park.id) % len(self.space_locks)]
+
+    def update_car_park(self, existing, car_park):
+        # How the catalog copies a re-read car park onto the one in use: under its space lock, so no claim sees it
+        # half replaced, with streamed spaces put back to their streamed state and held spaces kept occupied.
+        # Returns whether that changed the car park.
+        with self.space_lock(existing):
+            before = car_park_state(existing)
+            vars(existing).update(vars(car_park))
+            spaces = existing.parking_spaces
+            for space, occupied in self.streamed_occupancy.get(existing.id, {}).items():
+                if space < spaces.size:
+                    if occupied:
+                        spaces.occupy(space)
+                    else:
+                        spaces.release(space)
+            if self.holds is not None:
+                for space in self.holds.spaces_held(existing.id):
+                    if space < spaces.size:
+                        spaces.occupy(space)
+            return car_park_state(existing) != before
+
+    def space_changed(self, car_park):
+        # Keeps the availability index in step after spaces of car_park were occupied or released elsewhere
+        with self.state_lock:
+            if self.availability_index is None:
+                return
+            if isinstance(car_park, TableRow):
+                if car_park.table is not self.availability_key[0]:
+                    return
+                position = car_park.index
+            else:
+                position = self.availability_positions.get(car_park.id)
+                if position is None:
+                    return
+            if self.availability_index.set_free(position, car_park.has_available_space()) and \
+                    self.ranking_cache is not None:
+                self.ranking_cache.car_park_changed(self.availability_locations[position])
+
+    def get_availability_index(self, car_parks):
+        # Rebuilt when the catalog is replaced or a refresh changes its car parks (which may change space counts or
+        # occupancy); between those, occupancy changes are applied to it through space_changed
+        key = (car_parks, getattr(self.catalog, 'changes', None))
+        if self.availability_index is None or self.availability_key[0] is not car_parks or \
+                self.availability_key[1] != key[1]:
+            with self.metrics.stage('build_availability_index'):
+                self.availability_index = build_availability_index(car_parks)
+                self.availability_locations = np.asarray(car_park_locations(car_parks), dtype=np.float64).reshape(-1, 2)
+                self.availability_positions = None if isinstance(car_parks, CarParkTable) else \
+                    {car_park.id: position for position, car_park in enumerate(car_parks)}
+            self.availability_key = key
+        if self.ranking_cache is not None and self.ranking_cache.catalog_key is not self.availability_key:
+            self.ranking_cache.reset(self.availability_locations, self.availability_key)
+        return self.availability_index
+
+    def ranking_weights(self, bucket=None):
+        # Everything besides the trip and the requirement that rankings depend on (bucket: the traffic time-of-day
+        # bucket the ranking uses), as part of a cache key
+        return self.time_intervals[self.traffic_density], self.time_intervals['low'], bucket
+
+    def ranking_bounds(self, user_location, destination_location, cutoff):
+        # Box holding every car park that takes at most cutoff minutes for this trip, i.e. every car park whose
+        # filling up or freeing up could change a ranking with that worst time; None for anywhere
+        if cutoff is None or self.road_graph is not None:
+            return None
+        walk_interval = self.time_intervals['low']
+        if self.traffic is not None:
+            # Congested drive times have no grid bound, so with a traffic raster only the walk limits the box
+            walk_reach = cutoff / walk_interval
+            return (destination_location[0] - walk_reach, destination_location[0] + walk_reach,
+                    destination_location[1] - walk_reach, destination_location[1] + walk_reach)
+        # Grid times add up separately along x and y, so along each axis the reach is what the least time along the
+        # other axis leaves over
+        drive_interval = self.time_intervals[self.traffic_density]
+        cheaper = min(drive_interval, walk_interval)
+        min_x, max_x = reach_interval(drive_interval, user_location[0], walk_interval, destination_location[0],
+                                      cutoff - cheaper * abs(user_location[1] - destination_location[1]))
+        min_y, max_y = reach_interval(drive_interval, user_location[1], walk_interval, destination_location[1],
+                                      cutoff - cheaper * abs(user_location[0] - destination_location[0]))
+        return min_x, max_x, min_y, max_y
 
     def calculate_time(self, start_location, end_location, traffic_density):
+        # Drive time; calculate_walk_time is the walk from a car park
+        if self.road_graph is not None:
+            return self.road_graph.drive_time(start_location, end_location) * self.traffic_factor(traffic_density)
         x1, y1 = start_location
         x2, y2 = end_location
         time_interval = self.time_intervals[traffic_density]
         return abs(x2 - x1) * time_interval + abs(y2 - y1) * time_interval
 
-    def find_optimal_car_park(self, user_location, destination_location, requires_specialized_space=None):
-        car_parks = self.fetch_car_parks_from_database()
-        time_to_carpark = {}
-        for car_park in car_parks:
-            if car_park.has_available_space():
-                if requires_specialized_space:
-                    if not car_park.has_available_specialized_space(requires_specialized_space):
-                        continue
-                drive_time = self.calculate_time(user_location, car_park.location, self.traffic_density)
-                walk_time = self.calculate_time(car_park.location, destination_location, 'low')
-                total_time = drive_time + walk_time
-                time_to_carpark[car_park] = total_time
-
-        sorted_carparks = sorted(time_to_carpark.items(), key=lambda x: x[1])
-        available_carparks = [car_park for car_park, time in sorted_carparks if car_park.has_available_space()]
-        return available_carparks
-
-    def simulate(self, user_location, destination_location, requires_specialized_space=None):
-        car_parks = self.find_optimal_car_park(user_location, destination_location, requires_specialized_space)
-        if car_parks:
-            print("List of car parks in order of best option:")
-            for i, car_park in enumerate(car_parks, start=1):
-                print(f"{i}. {car_park.name}")
-                print(f"Location: {car_park.location}")
-                print(f"Parking Spaces: {car_park.parking_spaces}")
-                print(f"Handicap Spaces: {car_park.handicap_spaces}")
-                print(f"EV Charging Spaces: {car_park.ev_charging_spaces}")
-                print()
-        else:
-            print("No available parking spaces.")
+    def calculate_walk_time(self, start_location, end_location):
+        if self.road_graph is not None:
+            return self.road_graph.walk_time(start_location, end_location)
+        return self.calculate_time(start_location, end_location, 'low')
+
+    def traffic_factor(self, traffic_density):
+        # Street graph drive times are free-flow times; heavier traffic scales them like the grid intervals do
+        return self.time_intervals[traffic_density] / self.time_intervals['low']
+
+    def get_road_graph_times(self, car_parks):
+        # Car parks are snapped to graph nodes once per catalog
+        if self.road_graph_times is None or self.routed_car_parks is not car_parks:
+            with self.metrics.stage('attach_road_graph'):
+                self.road_graph_times = self.road_graph.attach(car_park_locations(car_parks))
+            self.routed_car_parks = car_parks
+        return self.road_graph_times
+
+    def get_car_park_index(self, car_parks):
+        # The index only depends on car park locations, so it is rebuilt only when the catalog itself changes
+        if self.car_park_index is None or self.indexed_car_parks is not car_parks:
+            with self.metrics.stage('build_index'):
+                self.car_park_index = CarParkIndex(car_parks)
+            self.indexed_car_parks = car_parks
+        return self.car_park_index
+
+    def find_optimal_car_park(self, user_location, destination_location, requires_specialized_space=None, limit=None):
+        if self.road_graph is not None or self.traffic is not None:
+            # Street graph and congestion times have no geometric lower bound to prune with, so rank the whole
+            # catalog at once
+            return self.find_optimal_car_parks([(user_location, destination_location, requires_specialized_space)],
+                                               limit)[0]
+
+        requirement = requirement_types(requires_specialized_space)  # One space type or several, all required
+        drive_interval = self.time_intervals[self.traffic_density]
+        walk_interval = self.time_intervals['low']
+        scanned = filtered = 0
+
+        def accept(car_park):
+            nonlocal scanned, filtered
+            scanned += 1
+            if not car_park.has_available_space() or \
+                    not all(car_park.has_available_specialized_space(space_type) for space_type in requirement):
+                filtered += 1
+                return False
+            return True
+
+        cache = self.ranking_cache
+        with self.metrics.request('find_optimal_car_park'):
+            with self.state_lock:
+                with self.metrics.stage('fetch_car_parks'):
+                    car_parks = self.fetch_car_parks_from_database()
+                if cache is not None:
+                    # Looked up and stored under the state lock, so no occupancy change falls between a ranking and
+                    # its entry
+                    self.get_availability_index(car_parks)  # Also resets the cache when the catalog changes
+                    with self.metrics.stage('cache_lookup'):
+                        key = cache.key(user_location, destination_location, requirement, self.ranking_weights(),
+                                        limit)
+                        ranked = cache.get(key)
+                    if ranked is not None:
+                        self.metrics.count('requests')
+                        return ranked
+                if requirement:
+                    # The car parks matching the requirement come from the availability bitmaps; when there are few
+                    # of them they are ranked directly, at a cost that follows their number rather than the catalog's
+                    availability = self.get_availability_index(car_parks)
+                    with self.metrics.stage('filter'):
+                        candidates = availability.candidates(requirement)
+                    if len(candidates) <= DIRECT_RANKING_LIMIT:
+                        with self.metrics.stage('score'):
+                            locations = self.availability_locations[candidates]
+                            times = grid_times(locations, user_location, drive_interval) + \
+                                grid_times(locations, destination_location, walk_interval)
+                        with self.metrics.stage('sort'):
+                            positions = rank_positions(times, candidates, limit)
+                            ranked = [car_parks[i] for i in positions]
+                        if cache is not None:
+                            # A ranking cut short by the limit only changes through car parks within its worst time
+                            cutoff = times[np.searchsorted(candidates, positions[-1])] \
+                                if ranked and len(ranked) == limit else None
+                            cache.put(key, ranked, self.ranking_bounds(user_location, destination_location, cutoff))
+                        self.metrics.count_all({'requests': 1, 'direct_rankings': 1, 'car_parks_scanned': len(candidates),
+                                                'car_parks_scored': len(candidates)})
+                        return ranked
+                index = self.get_car_park_index(car_parks)
+                with self.metrics.stage('index_search'):
+                    nearest = index.nearest(user_location, destination_location, drive_interval, walk_interval, limit,
+                                            accept)
+                ranked = [car_park for car_park, total_time in nearest]
+                if cache is not None:
+                    cutoff = nearest[-1][1] if nearest and len(nearest) == limit else None
+                    cache.put(key, ranked, self.ranking_bounds(user_location, destination_location, cutoff))
+            # Scanned: visited by the index search (the rest were pruned unseen); scored: passed the filters
+            self.metrics.count_all({'requests': 1, 'car_parks_scanned': scanned, 'car_parks_filtered': filtered,
+                                    'car_parks_scored': scanned - filtered})
+        return ranked
+
+    def get_travel_time_table(self, car_parks):
+        # Rebuilt only when the catalog itself changes; pinned destinations are pinned again on the new table
+        if self.travel_time_table is None or self.tabled_car_parks is not car_parks:
+            with self.metrics.stage('build_travel_time_table'):
+                self.travel_time_table = TravelTimeTable(car_park_locations(car_parks))
+            self.tabled_car_parks = car_parks
+            for destination_location in self.pinned_destinations:
+                self.travel_time_table.pin(destination_location, self.time_intervals['low'])
+        return self.travel_time_table
+
+    def pin_destination(self, destination_location):
+        # Keeps the walk times from a popular destination to every car park in memory
+        with self.state_lock:
+            self.pinned_destinations.add(tuple(destination_location))
+            if self.travel_time_table is not None:
+                self.travel_time_table.pin(destination_location, self.time_intervals['low'])
+
+    def find_optimal_car_parks(self, queries, limit=None, max_cells=1 << 22):
+        # Ranks many (user_location, destination_location, requires_specialized_space) queries in one vectorised
+        # pass over the catalog; each result is the same list find_optimal_car_park returns for that query
+        if not queries:
+            return []
+        with self.metrics.request('find_optimal_car_parks'):
+            return self.rank_queries(queries, limit, max_cells)
+
+    def rank_queries(self, queries, limit, max_cells):
+        metrics = self.metrics
+        with self.state_lock:
+            with metrics.stage('fetch_car_parks'):
+                car_parks = self.fetch_car_parks_from_database()
+            availability = self.get_availability_index(car_parks)
+            locations = self.availability_locations
+            results = [None] * len(queries)
+            bucket = self.traffic.bucket(self.traffic_time) if self.traffic is not None else None
+            cache = self.ranking_cache
+            if cache is not None:
+                # Only the queries without a current entry are ranked. The snapshot of the tile versions is taken
+                # with the occupancy the ranking reads, so entries stored after the lock is let go are still checked
+                # against every change since.
+                with metrics.stage('cache_lookup'):
+                    weights = self.ranking_weights(bucket)
+                    snapshot = cache.snapshot()
+                    keys = [cache.key(query[0], query[1], requirement_types(query[2]), weights, limit)
+                            for query in queries]
+                    results = [cache.get(key) for key in keys]
+            with metrics.stage('filter'):
+                # Queries are grouped by requirement and every group only scores the car parks matching it
+                groups = {}
+                for position, query in enumerate(queries):
+                    if results[position] is None:
+                        groups.setdefault(requirement_types(query[2]), []).append(position)
+                candidates = {requirement: availability.candidates(requirement) for requirement in groups}
+            # With under a quarter of the catalog matching, grid times are worked out for the matches alone;
+            # otherwise they are gathered from the cached whole-catalog vectors of the travel time table
+            direct = {requirement: len(columns) * 4 < len(car_parks) for requirement, columns in candidates.items()}
+            if self.road_graph is not None:
+                graph_times = self.get_road_graph_times(car_parks)
+                drive_factor = self.traffic_factor(self.traffic_density)
+            else:
+                table = None if all(direct.values()) else self.get_travel_time_table(car_parks)
+            drive_interval = self.time_intervals[self.traffic_density]
+            walk_interval = self.time_intervals['low']
+
+        ranked = sum(len(positions) for positions in groups.values())
+        scored = sum(len(candidates[requirement]) * len(positions) for requirement, positions in groups.items())
+        metrics.count_all({'requests': len(queries), 'car_parks_scanned': ranked * len(car_parks),
+                           'car_parks_filtered': ranked * len(car_parks) - scored, 'car_parks_scored': scored})
+        metrics.observe('batch_size', len(queries))
+
+        for requirement, positions in groups.items():
+            columns = candidates[requirement]
+            column_locations = locations[columns]
+            chunk_size = max(1, max_cells // max(len(columns), 1))
+            for start in range(0, len(positions), chunk_size):
+                chunk = positions[start:start + chunk_size]
+                with metrics.stage('score'):
+                    times = np.empty((len(chunk), len(columns)))
+                    for row, position in enumerate(chunk):
+                        user_location, destination_location = queries[position][0], queries[position][1]
+                        if self.road_graph is not None:
+                            # One shortest-path run from the user and one from the destination cover every car park
+                            np.take(graph_times.drive_times(user_location, drive_factor) +
+                                    graph_times.walk_times(destination_location), columns, out=times[row])
+                        elif self.traffic is not None:
+                            # All candidates costed in one call over the congestion prefix sums
+                            walk_times = grid_times(column_locations, destination_location, walk_interval) \
+                                if direct[requirement] else table.times(destination_location, walk_interval)[columns]
+                            np.add(self.traffic.path_times(user_location, column_locations, bucket), walk_times,
+                                   out=times[row])
+                        elif direct[requirement]:
+                            np.add(grid_times(column_locations, user_location, drive_interval),
+                                   grid_times(column_locations, destination_location, walk_interval), out=times[row])
+                        else:
+                            np.take(table.times(user_location, drive_interval) +
+                                    table.times(destination_location, walk_interval), columns, out=times[row])
+                with metrics.stage('sort'):
+                    for row, position in enumerate(chunk):
+                        ranking = rank_positions(times[row], columns, limit)
+                        results[position] = [car_parks[i] for i in ranking]
+                        if cache is not None:
+                            cutoff = times[row, np.searchsorted(columns, ranking[-1])] \
+                                if len(ranking) and len(ranking) == limit else None
+                            cache.put(keys[position], results[position],
+                                      self.ranking_bounds(queries[position][0], queries[position][1], cutoff),
+                                      snapshot)
+        return results
+
+    def simulate(self, user_location, destination_location, requires_specialized_space=None, limit=None):
+        with self.metrics.request('simulate'):
+            car_parks = self.find_optimal_car_park(user_location, destination_location, requires_specialized_space,
+                                                   limit)
+            with self.metrics.stage('print'):
+                print(format_car_parks(car_parks))
 
 if __name__ == "__main__":
-    connection = mysql.connector.connect(
+    import mysql.connector  # Only the database-backed demo needs the MySQL driver
+    from road_graph import RoadGraph
+
+    pool = ConnectionPool(lambda: mysql.connector.connect(
         host="localhost",
         user="your_username",
         password="your_password",
         database="your_database"
-    )
-    algorithm = ParkingAlgorithm(connection)
+    ), mysql.connector.paramstyle, size=8, prepared=True)
+    road_graph = RoadGraph.load(sys.argv[1]) if len(sys.argv) > 1 else None  # Optional street graph CSV
+    metrics = Metrics()
+    algorithm = ParkingAlgorithm(CarParkDatabase(pool, metrics=metrics), road_graph=road_graph, metrics=metrics)
 
     user_location = (random.randint(0, 9), random.randint(0, 9))
     destination_location = (random.randint(0, 9), random.randint(0, 9))
@@ -98,4 +544,7 @@ if __name__ == "__main__":
 
     algorithm.simulate(user_location, destination_location, requires_specialized_space)
 
-    connection.close()
+    print("Metrics:")
+    print(metrics.to_text())
+
+    pool.close()
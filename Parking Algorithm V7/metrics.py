@@ -0,0 +1,231 @@
+import bisect
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds: powers of two from about 1 microsecond to about 1000 seconds, so recording a value
+# is one binary search and an increment, and the memory per histogram is fixed however long it stays on
+BUCKET_BOUNDS = [2.0 ** exponent for exponent in range(-20, 11)]
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # The last bucket counts values above the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the value at this fraction (never more than the largest value seen)
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = fraction * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self.buckets):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+            return self.max
+
+    def snapshot(self):
+        with self.lock:
+            count, total, largest = self.count, self.total, self.max
+        return {
+            'count': count,
+            'total': total,
+            'mean': total / count if count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': largest
+        }
+
+
+class StageTimer:
+    # Times one stage into its histogram; a plain class rather than a generator context manager to keep it cheap
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter() - self.started)
+        return False
+
+
+class RequestTimer(StageTimer):
+    # Times a whole request; the outermost request on a thread also runs inside the request hook, if one is set
+    __slots__ = ('metrics', 'name', 'hook')
+
+    def __init__(self, histogram, metrics, name):
+        super().__init__(histogram)
+        self.metrics = metrics
+        self.name = name
+        self.hook = None
+
+    def __enter__(self):
+        local = self.metrics.local
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        if depth == 0 and self.metrics.request_hook is not None:
+            self.hook = self.metrics.request_hook(self.name)
+            self.hook.__enter__()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        self.metrics.local.depth -= 1
+        if self.hook is not None:
+            self.hook.__exit__(*exc_info)
+        return False
+
+
+class Metrics:
+    def __init__(self, request_hook=None):
+        # request_hook(name) returns a context manager wrapped around every outermost request, e.g. a
+        # SlowRequestProfiler
+        self.request_hook = request_hook
+        self.stages = {}  # Stage name -> Histogram of seconds
+        self.values = {}  # Name -> Histogram of other measurements (e.g. candidates per request)
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Request nesting depth per thread
+
+    def histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = histograms.setdefault(name, Histogram())
+        return histogram
+
+    def stage(self, name):
+        return StageTimer(self.histogram(self.stages, name))
+
+    def request(self, name):
+        return RequestTimer(self.histogram(self.stages, name), self, name)
+
+    def record(self, name, seconds):
+        # For stages timed by the caller
+        self.histogram(self.stages, name).record(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_all(self, amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        self.histogram(self.values, name).record(value)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.values = {}
+            self.counters = {}
+
+    def snapshot(self):
+        with self.lock:
+            stages, values, counters = dict(self.stages), dict(self.values), dict(self.counters)
+        return {
+            'stages': {name: histogram.snapshot() for name, histogram in sorted(stages.items())},
+            'values': {name: histogram.snapshot() for name, histogram in sorted(values.items())},
+            'counters': dict(sorted(counters.items()))
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot['stages']:
+            lines.append(f"{'stage':<28}{'count':>10}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"
+                         f"{'max ms':>10}")
+            for name, stage in snapshot['stages'].items():
+                lines.append(f"{name:<28}{stage['count']:>10}{stage['total'] * 1000:>12.3f}{stage['mean'] * 1000:>10.3f}"
+                             f"{stage['p50'] * 1000:>10.3f}{stage['p99'] * 1000:>10.3f}{stage['max'] * 1000:>10.3f}")
+        for name, value in snapshot['values'].items():
+            lines.append(f"{name}: count {value['count']}, mean {value['mean']:.1f}, p50 {value['p50']:g}, "
+                         f"p99 {value['p99']:g}, max {value['max']:g}")
+        for name, count in snapshot['counters'].items():
+            lines.append(f"{name}: {count}")
+        return '\n'.join(lines)
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_seconds=0.1, sample_every=1, keep=10, sort='cumulative', lines=30):
+        # Request hook that runs every sample_every-th request under cProfile and keeps the report of those slower
+        # than threshold_seconds (the latest keep of them). Any callable returning a context manager can take its
+        # place, e.g. one that starts and stops a sampling profiler.
+        self.threshold_seconds = threshold_seconds
+        self.sample_every = sample_every
+        self.sort = sort
+        self.lines = lines
+        self.reports = deque(maxlen=keep)  # (request name, seconds, profile text)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, name):
+        with self.lock:
+            self.requests += 1
+            sampled = self.requests % self.sample_every == 0
+        return ProfiledRequest(self, name) if sampled else NO_HOOK
+
+    def record(self, name, seconds, profile):
+        if seconds < self.threshold_seconds:
+            return
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats(self.sort).print_stats(self.lines)
+        with self.lock:
+            self.reports.append((name, seconds, output.getvalue()))
+
+
+class ProfiledRequest:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.profiler.record(self.name, time.perf_counter() - self.started, self.profile)
+        return False
+
+
+class NoHook:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_HOOK = NoHook()
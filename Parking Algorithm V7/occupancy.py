@@ -0,0 +1,111 @@
+class OccupancyBitmap:
+    # Packed occupancy of one car park: bit i is set while space i is free, and free_count is kept up to date
+    # on every change so availability checks never scan the spaces.
+    # free_value is the value a free space has in the source list (1 for parking_spaces, 0 for parking_matrix);
+    # iterating or printing the bitmap gives the spaces back in that encoding.
+    def __init__(self, size, free_value=1):
+        self.size = size
+        self.free_value = free_value
+        self.bits = bytearray((size + 7) // 8)
+        self.free_count = 0
+
+    @classmethod
+    def from_spaces(cls, spaces, free_value=1):
+        spaces = list(spaces)
+        bitmap = cls(len(spaces), free_value)
+        for index, space in enumerate(spaces):
+            if space == free_value:
+                bitmap.bits[index >> 3] |= 1 << (index & 7)
+                bitmap.free_count += 1
+        return bitmap
+
+    @classmethod
+    def from_matrix(cls, parking_matrix):
+        # Parking matrices mark occupied spaces with 1 / True and available spaces with 0 / False
+        return cls.from_spaces([int(space) for space in parking_matrix], free_value=0)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        occupied_value = 1 - self.free_value
+        for index in range(self.size):
+            yield self.free_value if self.bits[index >> 3] >> (index & 7) & 1 else occupied_value
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def has_free_space(self):
+        return self.free_count > 0
+
+    def is_free(self, index):
+        return bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def occupy(self, index):
+        # Returns False if the space was already occupied
+        mask = 1 << (index & 7)
+        if not self.bits[index >> 3] & mask:
+            return False
+        self.bits[index >> 3] &= ~mask & 0xFF
+        self.free_count -= 1
+        return True
+
+    def release(self, index):
+        # Returns False if the space was already free
+        mask = 1 << (index & 7)
+        if self.bits[index >> 3] & mask:
+            return False
+        self.bits[index >> 3] |= mask
+        self.free_count += 1
+        return True
+
+    def first_free(self, start=0):
+        # Lowest free space at or after start, or None
+        if self.free_count == 0 or start >= self.size:
+            return None
+        start = max(start, 0)
+        byte_index = start >> 3
+        byte = self.bits[byte_index] & (0xFF << (start & 7))
+        if not byte:
+            rest = self.bits[byte_index + 1:]
+            skipped = len(rest) - len(bytes(rest).lstrip(b'\x00'))
+            if skipped == len(rest):
+                return None
+            byte_index += 1 + skipped
+            byte = self.bits[byte_index]
+        return (byte_index << 3) + (byte & -byte).bit_length() - 1
+
+    def last_free(self, end=None):
+        # Highest free space at or before end, or None
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        if self.free_count == 0 or end < 0:
+            return None
+        byte_index = end >> 3
+        byte = self.bits[byte_index] & (0xFF >> (7 - (end & 7)))
+        if not byte:
+            head = self.bits[:byte_index]
+            kept = len(bytes(head).rstrip(b'\x00'))
+            if kept == 0:
+                return None
+            byte_index = kept - 1
+            byte = self.bits[byte_index]
+        return (byte_index << 3) + byte.bit_length() - 1
+
+    def nearest_free(self, index):
+        # Free space closest to index (the lower one on a tie), or None
+        after = self.first_free(index)
+        if after == index:
+            return index
+        before = self.last_free(index - 1) if index > 0 else None
+        if before is None:
+            return after
+        if after is None or index - before <= after - index:
+            return before
+        return after
+
+    def free_spaces(self):
+        for byte_index, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                yield (byte_index << 3) + low.bit_length() - 1
+                byte ^= low
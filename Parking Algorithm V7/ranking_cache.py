@@ -0,0 +1,141 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+ENTRY_OVERHEAD_BYTES = 256  # Key, entry tuple and dictionary slot of one cache entry, roughly
+
+
+class RankingCache:
+    # LRU cache of ranked car park lists keyed by (origin, destination, requirement, time weights, limit), with the
+    # estimated size of all entries kept under max_bytes.
+    # Entries go stale only when a car park fills up or frees up (free counts moving otherwise never change a
+    # ranking). The catalog area is split into tiles x tiles tiles, each with a version that moves whenever a car
+    # park in it does either. An entry records the area any car park that could change its result must lie in (a
+    # box around the trip, from the worst time in the result; everywhere for an unbounded ranking) and the total
+    # version of the tiles it covers, and a lookup that finds that total moved drops the entry instead of using it.
+    # cell_size quantizes origins and destinations so nearby trips share one entry; results are then only exact for
+    # the trip that filled the entry. Left at None, only identical locations share an entry.
+    def __init__(self, max_bytes=64 << 20, tiles=64, cell_size=None):
+        self.max_bytes = max_bytes
+        self.tiles = tiles
+        self.cell_size = cell_size
+        self.entries = OrderedDict()  # Key -> (car parks, tile box, version total, estimated bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0  # Moves on every reset or clear, so rankings from before one are not stored after it
+        self.lock = threading.Lock()
+        self.reset(np.zeros((0, 2)))
+
+    def reset(self, locations, catalog_key=None):
+        # Drops every entry and fits the tiles to a new catalog's locations (an n x 2 array); catalog_key is kept
+        # for the owner to tell which catalog the cache was last fitted to
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.generation += 1
+            self.catalog_key = catalog_key
+            if len(locations):
+                self.origin = locations.min(axis=0).astype(np.float64)
+                extent = float((locations.max(axis=0) - self.origin).max())
+            else:
+                self.origin = np.zeros(2)
+                extent = 0.0
+            self.tile_size = extent / self.tiles if extent > 0 else 1.0
+            self.versions = np.zeros((self.tiles + 1, self.tiles + 1), dtype=np.int64)
+
+    def clear(self):
+        # For changes the keys do not capture, e.g. a new road graph or traffic raster
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.generation += 1
+
+    def key(self, user_location, destination_location, requirement, weights, limit):
+        # requirement as a sorted tuple of space types; weights is anything hashable the times depend on
+        if self.cell_size is not None:
+            user_location = (user_location[0] // self.cell_size, user_location[1] // self.cell_size)
+            destination_location = (destination_location[0] // self.cell_size,
+                                    destination_location[1] // self.cell_size)
+        return (tuple(user_location), tuple(destination_location), requirement, weights, limit)
+
+    def tile(self, location):
+        tile = ((np.asarray(location, dtype=np.float64) - self.origin) // self.tile_size).astype(np.int64)
+        return np.clip(tile, 0, self.tiles)
+
+    def tile_box(self, bounds):
+        # (min_x, max_x, min_y, max_y) in location units, or None for the whole area -> slices of the version grid
+        if bounds is None:
+            return slice(None), slice(None)
+        min_x, max_x, min_y, max_y = bounds
+        slack = 1e-9 * max(1.0, abs(min_x), abs(max_x), abs(min_y), abs(max_y))  # Rounding in the worst time
+        low = self.tile((min_x - slack, min_y - slack))
+        high = self.tile((max_x + slack, max_y + slack))
+        return slice(low[0], high[0] + 1), slice(low[1], high[1] + 1)
+
+    def get(self, key):
+        # The cached car parks (a new list each time), or None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            car_parks, box, version, size = entry
+            if int(self.versions[box].sum()) != version:
+                del self.entries[key]
+                self.bytes -= size
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(car_parks)
+
+    def put(self, key, car_parks, bounds, snapshot=None):
+        # bounds as for tile_box. snapshot is what snapshot() returned when the ranking read occupancy, for callers
+        # that rank outside the lock that orders them against car_park_changed.
+        size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(car_parks) + \
+            (len(car_parks) * sys.getsizeof(car_parks[0]) if car_parks else 0)
+        if size > self.max_bytes:
+            return
+        box = self.tile_box(bounds)
+        with self.lock:
+            if snapshot is not None and snapshot[0] != self.generation:
+                return
+            version = int((self.versions if snapshot is None else snapshot[1])[box].sum())
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[3]
+            self.entries[key] = (list(car_parks), box, version, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[3]
+                self.evictions += 1
+
+    def car_park_changed(self, location):
+        # A car park at location filled up or freed up
+        tile_x, tile_y = self.tile(location)
+        with self.lock:
+            self.versions[tile_x, tile_y] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.generation, self.versions.copy()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
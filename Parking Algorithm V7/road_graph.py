@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+# Street graphs are CSV edge lists with the header
+#   from_x,from_y,to_x,to_y,drive_minutes,walk_minutes,oneway
+# Nodes are identified by their coordinates. oneway=1 edges can only be driven from -> to; walking is always both ways.
+
+
+class RoadGraph:
+    def __init__(self, node_locations, drive, walk):
+        self.node_locations = node_locations
+        self.drive = drive  # CSR matrix of drive minutes at free flow, row = from node
+        self.walk = walk  # CSR matrix of walk minutes, symmetric since walking goes both ways
+        self.node_tree = cKDTree(node_locations) if len(node_locations) else None
+
+    @classmethod
+    def from_edges(cls, edges):
+        edges = np.asarray(edges, dtype=np.float64).reshape(-1, 7)
+        node_locations, node_ids = np.unique(np.concatenate([edges[:, 0:2], edges[:, 2:4]]), axis=0, return_inverse=True)
+        node_ids = node_ids.reshape(-1)
+        sources, targets = node_ids[:len(edges)], node_ids[len(edges):]
+        two_way = edges[:, 6] == 0
+        num_nodes = len(node_locations)
+
+        def adjacency(rows, cols, weights):
+            # Parallel edges keep their fastest weight
+            order = np.lexsort((weights, cols, rows))
+            rows, cols, weights = rows[order], cols[order], weights[order]
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            return csr_matrix((weights[first], (rows[first], cols[first])), shape=(num_nodes, num_nodes))
+
+        drive = adjacency(np.concatenate([sources, targets[two_way]]), np.concatenate([targets, sources[two_way]]),
+                          np.concatenate([edges[:, 4], edges[two_way, 4]]))
+        walk = adjacency(np.concatenate([sources, targets]), np.concatenate([targets, sources]),
+                         np.concatenate([edges[:, 5], edges[:, 5]]))
+        return cls(node_locations, drive, walk)
+
+    @classmethod
+    def load(cls, path):
+        # The parsed CSR arrays are cached next to the CSV as <path>.npz and reused until the CSV changes
+        cache_path = path + '.npz'
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with np.load(cache_path) as cached:
+                shape = (len(cached['node_locations']),) * 2
+                return cls(cached['node_locations'],
+                           csr_matrix((cached['drive_data'], cached['drive_indices'], cached['drive_indptr']), shape=shape),
+                           csr_matrix((cached['walk_data'], cached['walk_indices'], cached['walk_indptr']), shape=shape))
+
+        graph = cls.from_edges(np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2))
+        temporary_path = cache_path + f'.{os.getpid()}.tmp.npz'
+        np.savez(temporary_path, node_locations=graph.node_locations,
+                 drive_data=graph.drive.data, drive_indices=graph.drive.indices, drive_indptr=graph.drive.indptr,
+                 walk_data=graph.walk.data, walk_indices=graph.walk.indices, walk_indptr=graph.walk.indptr)
+        os.replace(temporary_path, cache_path)
+        return graph
+
+    def nearest_nodes(self, locations):
+        # Snaps locations to their closest graph node (Manhattan distance)
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        if self.node_tree is None or len(locations) == 0:
+            return np.zeros(len(locations), dtype=np.int64)
+        return self.node_tree.query(locations, p=1)[1]
+
+    def drive_time(self, start_location, end_location):
+        start_node, end_node = self.nearest_nodes([start_location, end_location])
+        return float(dijkstra(self.drive, indices=int(start_node))[end_node])
+
+    def walk_time(self, start_location, end_location):
+        start_node, end_node = self.nearest_nodes([start_location, end_location])
+        return float(dijkstra(self.walk, indices=int(start_node))[end_node])
+
+    def attach(self, car_park_locations, max_cached=1024):
+        return RoadGraphTimes(self, self.nearest_nodes(car_park_locations), max_cached)
+
+
+class RoadGraphTimes:
+    def __init__(self, graph, car_park_nodes, max_cached=1024):
+        # Travel times between the graph and one catalog of car parks; each query is one shortest-path run
+        # over the whole graph and the result is read at every car park node at once
+        self.graph = graph
+        self.car_park_nodes = car_park_nodes
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, key, compute):
+        with self.lock:
+            times = self.cache.get(key)
+            if times is not None:
+                self.cache.move_to_end(key)
+                return times
+        times = compute()
+        times.flags.writeable = False
+        with self.lock:
+            self.cache[key] = times
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return times
+
+    def drive_times(self, user_location, factor=1.0):
+        # Minutes to drive from the user to every car park; factor scales free-flow times for traffic
+        node = int(self.graph.nearest_nodes([user_location])[0])
+        base = self.cached(('drive', node), lambda: dijkstra(self.graph.drive, indices=node)[self.car_park_nodes])
+        return base * factor
+
+    def walk_times(self, destination_location):
+        # Minutes to walk from every car park to the destination: walk edges go both ways, so one run from the
+        # destination gives them all
+        node = int(self.graph.nearest_nodes([destination_location])[0])
+        return self.cached(('walk', node), lambda: dijkstra(self.graph.walk, indices=node)[self.car_park_nodes])
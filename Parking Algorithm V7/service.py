@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+import time
+from collections import deque
+
+from car_park_store import CarParkStore
+from database import CarParkDatabase, ConnectionPool
+from holds import SpaceHolds
+from main import CarParkRow, ParkingAlgorithm
+from metrics import Metrics, SlowRequestProfiler
+from ranking_cache import RankingCache
+from traffic import TrafficRaster
+
+# Line protocol: one JSON request per line, e.g.
+#   {"id": 1, "user_location": [2, 3], "destination_location": [7, 7], "requires_specialized_space": null, "limit": 3}
+# answered by one JSON line {"id": 1, "car_parks": [{"id": ..., "name": ..., "location": [...]}, ...]}.
+# requires_specialized_space may also be a list of space types that must all be present, e.g. ["ev_charging", "handicap"].
+# {"stats": true} returns batching and latency counters, the algorithm's stage metrics and the ranking cache's hit
+# rate and evictions instead, and {"profiles": true} the cProfile reports of the slowest recent requests when
+# --profile-slow-ms is set.
+# A request with "hold": true also reserves a space in the best car park for the driver, answered by
+# {"hold": {"id": ..., "car_park": {...}, "space": ..., "expires_in": seconds}} (null when nothing is free);
+# "hold_seconds" overrides --hold-seconds. {"confirm": hold id} keeps the space once the driver has parked and
+# {"release": hold id} frees it, answered by {"confirmed": ...} / {"released": ...} (false once the hold has expired).
+# Holds live in the one service process, so any number of client processes can claim spaces without double booking.
+# A request that cannot be answered gets {"error": message} with its id, and never fails other requests.
+
+
+class RecommendationBatcher:
+    def __init__(self, algorithm, max_delay=0.002, max_batch_size=512, latency_window=10000):
+        self.algorithm = algorithm
+        self.max_delay = max_delay  # Seconds to wait for more requests after the first one of a batch
+        self.max_batch_size = max_batch_size
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.batches = 0
+        self.worker = None
+
+    def start(self):
+        self.worker = asyncio.get_running_loop().create_task(self.run())
+
+    async def recommend(self, user_location, destination_location, requires_specialized_space=None, limit=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((tuple(user_location), tuple(destination_location), requires_specialized_space), limit,
+                              future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # One ranking pass for the whole batch with the largest limit asked for; every result with a smaller
+            # limit is a prefix of it. The pass runs off the event loop so new requests keep queueing meanwhile.
+            limits = [limit for _, limit, _, _ in batch]
+            limit = None if None in limits else max(limits)
+            try:
+                results = await loop.run_in_executor(None, self.algorithm.find_optimal_car_parks,
+                                                     [query for query, _, _, _ in batch], limit)
+            except Exception:
+                # One request should not fail the others, so each is answered on its own
+                for query, request_limit, future, received in batch:
+                    try:
+                        result = (await loop.run_in_executor(None, self.algorithm.find_optimal_car_parks, [query],
+                                                             request_limit))[0]
+                    except Exception as error:
+                        if not future.done():
+                            future.set_exception(error)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    self.record_batch([received])
+                continue
+
+            self.record_batch([received for _, _, _, received in batch])
+            for (_, request_limit, future, _), car_parks in zip(batch, results):
+                if not future.done():
+                    future.set_result(car_parks if request_limit is None else car_parks[:request_limit])
+
+    def record_batch(self, received_times):
+        # Counts one ranking pass and the latency of every request it answered, failed ones included
+        finished = time.perf_counter()
+        self.batches += 1
+        self.requests += len(received_times)
+        self.latencies.extend(finished - received for received in received_times)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'p50_latency_seconds': percentile(0.5),
+            'p99_latency_seconds': percentile(0.99)
+        }
+
+
+def parse_location(request, key):
+    location = request.get(key)
+    if not isinstance(location, (list, tuple)) or len(location) != 2 or \
+            not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in location):
+        raise ValueError(f"{key} must be a list of two numbers")
+    return tuple(location)
+
+
+def parse_query(request):
+    # Checks a recommendation or hold request before it joins a batch, so a malformed one fails alone.
+    # Returns (user_location, destination_location, requires_specialized_space, limit).
+    requirement = request.get('requires_specialized_space')
+    if not (requirement is None or isinstance(requirement, str) or
+            (isinstance(requirement, list) and all(isinstance(space_type, str) for space_type in requirement))):
+        raise ValueError("requires_specialized_space must be null, a space type or a list of space types")
+    limit = request.get('limit')
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+        raise ValueError("limit must be null or a non-negative integer")
+    return parse_location(request, 'user_location'), parse_location(request, 'destination_location'), requirement, limit
+
+
+def car_park_json(car_park):
+    return {'id': car_park.id, 'name': car_park.name, 'location': list(car_park.location)}
+
+
+async def answer_hold(holds, request):
+    loop = asyncio.get_running_loop()
+    if 'confirm' in request:
+        return {'confirmed': await loop.run_in_executor(None, holds.confirm, request['confirm']) is not None}
+    if 'release' in request:
+        return {'released': await loop.run_in_executor(None, holds.release, request['release'])}
+    user_location, destination_location, requirement, _ = parse_query(request)
+    hold_seconds = request.get('hold_seconds')
+    if hold_seconds is not None and (not isinstance(hold_seconds, (int, float)) or hold_seconds <= 0):
+        raise ValueError("hold_seconds must be a positive number")
+    # Claims run on the executor threads; the car park space locks keep them from booking the same space
+    hold = await loop.run_in_executor(None, holds.recommend_and_hold, user_location, destination_location, requirement,
+                                      hold_seconds)
+    if hold is None:
+        return {'hold': None}
+    return {'hold': {'id': hold.id, 'car_park': car_park_json(hold.car_park), 'space': hold.space,
+                     'expires_in': hold.expires_at - holds.clock()}}
+
+
+async def answer(batcher, holds, line, writer):
+    request = None
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        if request.get('stats'):
+            algorithm = batcher.algorithm
+            response = {'stats': dict(batcher.stats(), holds=len(holds)), 'metrics': algorithm.metrics.snapshot()}
+            if algorithm.ranking_cache is not None:
+                response['ranking_cache'] = algorithm.ranking_cache.stats()
+        elif request.get('profiles'):
+            profiler = batcher.algorithm.metrics.request_hook
+            reports = list(profiler.reports) if isinstance(profiler, SlowRequestProfiler) else []
+            response = {'profiles': [{'request': name, 'seconds': seconds, 'profile': profile}
+                                     for name, seconds, profile in reports]}
+        elif request.get('hold') or 'confirm' in request or 'release' in request:
+            response = await answer_hold(holds, request)
+        else:
+            car_parks = await batcher.recommend(*parse_query(request))
+            response = {'car_parks': [car_park_json(car_park) for car_park in car_parks]}
+    except Exception as error:
+        response = {'error': str(error)}
+    if isinstance(request, dict) and 'id' in request:
+        response['id'] = request['id']
+    writer.write((json.dumps(response) + '\n').encode('utf-8'))
+    try:
+        await writer.drain()  # Waits while a slow client's buffer is full instead of growing it without bound
+    except ConnectionError:
+        pass  # The client has gone; handle_connection closes the writer once its other requests finish
+
+
+async def handle_connection(batcher, holds, reader, writer):
+    # Requests on one connection are answered as they finish, so a client may pipeline them and match by id
+    pending = set()
+    try:
+        while line := await reader.readline():
+            if line.strip():
+                task = asyncio.create_task(answer(batcher, holds, line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def expire_holds(holds, interval=1.0):
+    # Expired holds are also freed by the next claim; this returns them to the rankings when no claims come.
+    # Freeing waits for the state lock, which a ranking pass may hold, so it runs off the event loop.
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, holds.expire)
+
+
+async def serve(algorithm, host='127.0.0.1', port=8765, max_delay=0.002, max_batch_size=512, hold_seconds=300.0):
+    batcher = RecommendationBatcher(algorithm, max_delay, max_batch_size)
+    batcher.start()
+    holds = SpaceHolds(algorithm, hold_seconds)
+    expiry = asyncio.create_task(expire_holds(holds))
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(batcher, holds, reader, writer),
+                                        host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        expiry.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve car park recommendations over a JSON line protocol")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    parser.add_argument('--max-batch-size', type=int, default=512)
+    parser.add_argument('--traffic-density', choices=['low', 'medium', 'high'], default='medium')
+    parser.add_argument('--traffic-raster', help="Congestion raster (.npy, buckets x width x height minutes per step)")
+    parser.add_argument('--bucket-minutes', type=int, default=60)
+    parser.add_argument('--store', help="Serve car parks from this car park store file instead of a database")
+    parser.add_argument('--sqlite', help="Read car parks from this SQLite file instead of MySQL")
+    parser.add_argument('--profile-slow-ms', type=float,
+                        help="Profile ranking passes with cProfile and keep the reports of those slower than this")
+    parser.add_argument('--profile-every', type=int, default=1, help="Profile only every n-th ranking pass")
+    parser.add_argument('--hold-seconds', type=float, default=300.0,
+                        help="How long a space stays held for a driver before it is freed again")
+    parser.add_argument('--ranking-cache-mb', type=float, default=64.0,
+                        help="Memory for caching recent rankings (0 turns the cache off)")
+    parser.add_argument('--cache-cell-size', type=int,
+                        help="Share cached rankings between trips starting and ending in the same cells this wide")
+    args = parser.parse_args()
+
+    if args.store:
+        pool = None
+    elif args.sqlite:
+        pool = ConnectionPool(lambda: sqlite3.connect(args.sqlite, check_same_thread=False), sqlite3.paramstyle)
+    else:
+        import mysql.connector
+
+        pool = ConnectionPool(lambda: mysql.connector.connect(
+            host="localhost",
+            user="your_username",
+            password="your_password",
+            database="your_database"
+        ), mysql.connector.paramstyle, size=8, prepared=True)
+    traffic = TrafficRaster.load(args.traffic_raster, args.bucket_minutes) if args.traffic_raster else None
+    metrics = Metrics(SlowRequestProfiler(args.profile_slow_ms / 1000, args.profile_every)
+                      if args.profile_slow_ms is not None else None)
+    algorithm = ParkingAlgorithm(CarParkDatabase(pool, metrics=metrics) if pool else None,
+                                 traffic_density=args.traffic_density, traffic=traffic,
+                                 catalog=CarParkStore(args.store, CarParkRow) if args.store else None, metrics=metrics,
+                                 ranking_cache=RankingCache(int(args.ranking_cache_mb * (1 << 20)),
+                                                            cell_size=args.cache_cell_size)
+                                 if args.ranking_cache_mb > 0 else None)
+
+    try:
+        asyncio.run(serve(algorithm, args.host, args.port, args.max_delay_ms / 1000, args.max_batch_size,
+                          args.hold_seconds))
+    finally:
+        if pool:
+            pool.close()
@@ -0,0 +1,76 @@
+import heapq
+
+
+class CarParkIndex:
+    def __init__(self, car_parks, leaf_size=16):
+        self.car_parks = list(car_parks)
+        self.leaf_size = leaf_size
+        self.order = list(range(len(self.car_parks)))
+        self.xs = [car_park.location[0] for car_park in self.car_parks]
+        self.ys = [car_park.location[1] for car_park in self.car_parks]
+        # Each node is [min_x, min_y, max_x, max_y, left, right, start, stop]; leaves have left == right == -1
+        self.nodes = []
+        if self.car_parks:
+            self._build(0, len(self.order))
+
+    def _build(self, start, stop):
+        members = self.order[start:stop]
+        xs = [self.xs[i] for i in members]
+        ys = [self.ys[i] for i in members]
+        node_id = len(self.nodes)
+        self.nodes.append([min(xs), min(ys), max(xs), max(ys), -1, -1, start, stop])
+        if stop - start <= self.leaf_size:
+            return node_id
+
+        # Split on the wider side of the bounding box at the median car park
+        coordinates = self.xs if max(xs) - min(xs) >= max(ys) - min(ys) else self.ys
+        members.sort(key=coordinates.__getitem__)
+        self.order[start:stop] = members
+        middle = (start + stop) // 2
+        self.nodes[node_id][4] = self._build(start, middle)
+        self.nodes[node_id][5] = self._build(middle, stop)
+        return node_id
+
+    @staticmethod
+    def _distance_to_box(location, node):
+        x, y = location
+        dx = max(node[0] - x, 0, x - node[2])
+        dy = max(node[1] - y, 0, y - node[3])
+        return dx + dy
+
+    def nearest(self, user_location, destination_location, drive_interval, walk_interval, k=None, accept=None):
+        # Best-first search over the tree: a node's bound is the Manhattan drive+walk time to the closest point of
+        # its bounding box, so once that bound exceeds the current k-th best time no car park inside can beat it.
+        # Car parks are filtered by accept(car_park) while they are visited, never after.
+        # Returns up to k (car park, total time) pairs ordered by total time, ties broken by catalog order.
+        if not self.nodes or k == 0:
+            return []
+        ux, uy = user_location
+        dx, dy = destination_location
+        best = []  # max-heap of (-total_time, -index) holding the k best so far
+        to_visit = [(0, 0)]
+        while to_visit:
+            bound, node_id = heapq.heappop(to_visit)
+            if k is not None and len(best) == k and bound > -best[0][0]:
+                break
+            node = self.nodes[node_id]
+            if node[4] == -1:
+                for i in self.order[node[6]:node[7]]:
+                    car_park = self.car_parks[i]
+                    if accept is not None and not accept(car_park):
+                        continue
+                    x, y = car_park.location
+                    total_time = (abs(x - ux) + abs(y - uy)) * drive_interval + (abs(dx - x) + abs(dy - y)) * walk_interval
+                    entry = (-total_time, -i)
+                    if k is None or len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                continue
+            for child_id in (node[4], node[5]):
+                child = self.nodes[child_id]
+                child_bound = self._distance_to_box(user_location, child) * drive_interval + \
+                    self._distance_to_box(destination_location, child) * walk_interval
+                heapq.heappush(to_visit, (child_bound, child_id))
+
+        return [(self.car_parks[-i], -total_time) for total_time, i in sorted(best, reverse=True)]
@@ -0,0 +1,67 @@
+import datetime
+
+import numpy as np
+
+
+class TrafficRaster:
+    def __init__(self, congestion, bucket_minutes=60):
+        # congestion[bucket, x, y] is the minutes it takes to drive one grid step through cell (x, y) in that
+        # time-of-day bucket; a 2-D array is a single bucket for the whole day. Prefix sums along x for every row
+        # and along y for every column make any straight segment, and so any L-shaped grid path, O(1) to cost.
+        congestion = np.asarray(congestion, dtype=np.float64)
+        self.congestion = congestion[None] if congestion.ndim == 2 else congestion
+        self.bucket_minutes = bucket_minutes
+        self.buckets, self.width, self.height = self.congestion.shape
+        self.row_prefix = np.zeros((self.buckets, self.width + 1, self.height))
+        np.cumsum(self.congestion, axis=1, out=self.row_prefix[:, 1:])
+        self.column_prefix = np.zeros((self.buckets, self.width, self.height + 1))
+        np.cumsum(self.congestion, axis=2, out=self.column_prefix[:, :, 1:])
+
+    @classmethod
+    def uniform(cls, width, height, minutes_per_step, buckets=1, bucket_minutes=60):
+        return cls(np.full((buckets, width, height), float(minutes_per_step)), bucket_minutes)
+
+    @classmethod
+    def load(cls, path, bucket_minutes=60):
+        return cls(np.load(path), bucket_minutes)
+
+    def bucket(self, when=None):
+        # Time-of-day bucket for a datetime (now when None); buckets repeat every buckets * bucket_minutes
+        when = when or datetime.datetime.now()
+        return (when.hour * 60 + when.minute) // self.bucket_minutes % self.buckets
+
+    def cells(self, locations):
+        # Locations off the raster are costed as if on its nearest edge
+        locations = np.rint(np.asarray(locations, dtype=np.float64)).astype(np.int64)
+        return np.clip(locations[..., 0], 0, self.width - 1), np.clip(locations[..., 1], 0, self.height - 1)
+
+    def along_x(self, bucket, y, x1, x2):
+        # A step between neighbouring cells costs the mean of the two, so a segment costs its cells minus half its ends
+        low, high = np.minimum(x1, x2), np.maximum(x1, x2)
+        cells = self.congestion[bucket]
+        return self.row_prefix[bucket, high + 1, y] - self.row_prefix[bucket, low, y] - (cells[low, y] + cells[high, y]) / 2
+
+    def along_y(self, bucket, x, y1, y2):
+        low, high = np.minimum(y1, y2), np.maximum(y1, y2)
+        cells = self.congestion[bucket]
+        return self.column_prefix[bucket, x, high + 1] - self.column_prefix[bucket, x, low] - (cells[x, low] + cells[x, high]) / 2
+
+    def path_times(self, start_locations, end_locations, bucket=0):
+        # Drive minutes from start to end locations (broadcast against each other) over the faster of the two
+        # L-shaped grid paths: along x then y, or along y then x
+        x1, y1 = self.cells(start_locations)
+        x2, y2 = self.cells(end_locations)
+        x_first = self.along_x(bucket, y1, x1, x2) + self.along_y(bucket, x2, y1, y2)
+        y_first = self.along_y(bucket, x1, y1, y2) + self.along_x(bucket, y2, x1, x2)
+        return np.minimum(x_first, y_first)
+
+    def path_time(self, start_location, end_location, bucket=0):
+        return float(self.path_times(start_location, end_location, bucket))
+
+    def path_densities(self, start_location, end_locations, bucket=0):
+        # Mean minutes per grid step along each path; a path of no steps takes the congestion of its cell
+        x1, y1 = self.cells(start_location)
+        x2, y2 = self.cells(end_locations)
+        steps = np.abs(x2 - x1) + np.abs(y2 - y1)
+        times = self.path_times(start_location, end_locations, bucket)
+        return np.where(steps > 0, times / np.maximum(steps, 1), self.congestion[bucket, x2, y2])
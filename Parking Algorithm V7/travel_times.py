@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TravelTimeTable:
+    def __init__(self, locations, max_cached=4096):
+        # Manhattan distance splits into |x - car park x| + |y - car park y|, so the distance from every car park to
+        # every grid cell is kept as one row per grid column and one per grid row: (width + height) x car parks
+        # instead of cells x car parks. Time vectors per (cell, traffic interval) are memoised on top of that.
+        self.locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.pinned = {}
+        self.lock = threading.Lock()
+        self.on_grid = len(self.locations) > 0 and bool(np.all(self.locations == np.round(self.locations)))
+        if self.on_grid:
+            self.min_x, self.min_y = self.locations.min(axis=0).astype(int)
+            max_x, max_y = self.locations.max(axis=0).astype(int)
+            self.column_distances = np.abs(np.arange(self.min_x, max_x + 1)[:, None] - self.locations[:, 0]).astype(np.int32)
+            self.row_distances = np.abs(np.arange(self.min_y, max_y + 1)[:, None] - self.locations[:, 1]).astype(np.int32)
+
+    def distances(self, location):
+        x, y = location
+        if self.on_grid and x == int(x) and y == int(y):
+            column, row = int(x) - self.min_x, int(y) - self.min_y
+            if 0 <= column < len(self.column_distances) and 0 <= row < len(self.row_distances):
+                return self.column_distances[column] + self.row_distances[row]
+        # Off the car parks' bounding box (or off the grid) the distance is worked out directly
+        return np.abs(self.locations[:, 0] - x) + np.abs(self.locations[:, 1] - y)
+
+    def times(self, location, interval):
+        # Travel time from location to every car park (the same both ways) at the given minutes per grid step.
+        # The returned vector is shared with the cache and must not be modified.
+        key = (tuple(location), interval)
+        with self.lock:
+            times = self.pinned.get(key)
+            if times is None:
+                times = self.cache.get(key)
+                if times is not None:
+                    self.cache.move_to_end(key)
+        if times is not None:
+            return times
+
+        times = self.distances(location) * float(interval)
+        times.flags.writeable = False
+        with self.lock:
+            self.cache[key] = times
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return times
+
+    def pin(self, location, interval):
+        # Keeps the time vector of a popular location (station, stadium) in memory regardless of cache eviction
+        times = self.times(location, interval)
+        with self.lock:
+            self.pinned[(tuple(location), interval)] = times
+        return times
+
+    def unpin(self, location, interval):
+        with self.lock:
+            self.pinned.pop((tuple(location), interval), None)
@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from versions import VERSION_FOLDERS, load_modules, load_version
+
+DEFAULT_SIZES = [10, 1000, 100000, 1000000]
+MAX_DENSE_ASSIGNMENT = 2000  # Dense n x n assignment (V3/V4) is skipped above this many car parks
+
+
+# Function to generate a synthetic city: car park locations on a square grid, spaces, occupancy and special spaces
+def generate_city(num_car_parks, seed=0, spaces_per_car_park=(8, 64)):
+    rng = np.random.default_rng(seed)
+    grid_size = max(10, int(np.sqrt(num_car_parks) * 4))
+    return {
+        'grid_size': grid_size,
+        'locations': rng.integers(0, grid_size, size=(num_car_parks, 2)),
+        'num_spaces': rng.integers(spaces_per_car_park[0], spaces_per_car_park[1] + 1, size=num_car_parks),
+        'occupancy': rng.uniform(0.2, 1.0, size=num_car_parks),
+        'handicap_spaces': rng.integers(0, 3, size=num_car_parks),
+        'ev_charging_spaces': rng.integers(0, 3, size=num_car_parks),
+        'family_spaces': rng.integers(0, 2, size=num_car_parks),
+        'traffic_density': rng.uniform(0.1, 1.0, size=num_car_parks),
+        'rng': rng
+    }
+
+
+# Function to draw the occupied (1) / available (0) spaces of one car park
+def occupied_spaces(city, index):
+    return (city['rng'].random(city['num_spaces'][index]) < city['occupancy'][index]).astype(int)
+
+
+# Function to draw a random user and destination inside the city
+def random_trip(city):
+    grid_size = city['grid_size']
+    return (random.randrange(grid_size), random.randrange(grid_size)), (random.randrange(grid_size), random.randrange(grid_size))
+
+
+# Function to time one stage a number of times and store its timings in seconds (or why it failed) under its name
+# Returns the result of the last run, or None if the stage raised
+def time_stage(stages, stage, function, repeats=1):
+    timings = []
+    result = None
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - started)
+    except Exception as error:
+        stages[stage] = f"failed: {type(error).__name__}: {error}"
+        return None
+    stages[stage] = timings
+    return result
+
+
+# Function to build the dictionary car parks used by V3 and V4
+def build_dict_car_parks(city, with_special_spaces):
+    user_location, destination_location = random_trip(city)
+    car_parks = []
+    for index, (x, y) in enumerate(city['locations'].tolist()):
+        car_park = {
+            'name': f"Car Park {index}",
+            'time_to_carpark': abs(x - user_location[0]) + abs(y - user_location[1]),
+            'time_from_carpark': abs(x - destination_location[0]) + abs(y - destination_location[1]),
+            'traffic_density': float(city['traffic_density'][index]),
+            'carpark_availability': 1.0 - float(city['occupancy'][index]),
+            'parking_matrix': occupied_spaces(city, index).astype(bool)
+        }
+        if with_special_spaces:
+            car_park['handicapped_space'] = bool(city['handicap_spaces'][index])
+            car_park['family_space'] = bool(city['family_spaces'][index])
+            car_park['ev_charging_space'] = bool(city['ev_charging_spaces'][index])
+        car_parks.append(car_park)
+    return car_parks
+
+
+# Stages of the V3 / V4 main(): per-criterion np.mean/np.std, per-dict calculate_score, sorted, dense assignment
+def benchmark_v3_v4(version, module, city, repeats):
+    with_special_spaces = version == 'V4'
+    weights = {'time_to_destination': 0.2, 'traffic_density': 0.3, 'carpark_availability': 0.5}
+    criteria = ['time_to_carpark', 'time_from_carpark', 'traffic_density', 'carpark_availability']
+    if with_special_spaces:
+        weights.update({'handicapped_space': 0.3, 'family_space': 0.4, 'ev_charging_space': 0.2})
+        criteria += ['handicapped_space', 'family_space', 'ev_charging_space']
+    stages = {}
+
+    car_parks = time_stage(stages, 'build', lambda: build_dict_car_parks(city, with_special_spaces), 1)
+
+    def normalise():
+        means = {criterion: np.mean([cp[criterion] for cp in car_parks]) for criterion in criteria}
+        std_devs = {criterion: np.std([cp[criterion] for cp in car_parks]) for criterion in criteria}
+        return means, std_devs
+    means, std_devs = time_stage(stages, 'normalization', normalise, repeats)
+
+    non_full_car_parks = [cp for cp in car_parks if not np.all(cp['parking_matrix'])]
+    scores = time_stage(stages, 'scoring', lambda: [(cp['name'], module.calculate_score(cp, weights, means, std_devs))
+                                                    for cp in non_full_car_parks], repeats)
+    time_stage(stages, 'rank', lambda: sorted(scores, key=lambda x: x[1], reverse=True), repeats)
+
+    if len(non_full_car_parks) <= MAX_DENSE_ASSIGNMENT:
+        cost_matrix = -np.tile([score for _, score in scores], (len(scores), 1))
+        time_stage(stages, 'assignment', lambda: module.solve_assignment_problem(cost_matrix), repeats)
+    else:
+        stages['assignment'] = f"skipped: dense {len(non_full_car_parks)} x {len(non_full_car_parks)} assignment"
+    return stages
+
+
+# Stages of the V5 main(): occupancy history + forecast, criteria matrix + running statistics, vectorised scoring, argsort,
+# skyline re-ranking, batch assignment, recommend
+def benchmark_v5(module, city, repeats, num_drivers):
+    user_location, destination_location = random_trip(city)
+    criteria = ['time_to_carpark', 'time_from_carpark', 'traffic_density', 'handicapped_space', 'family_space', 'ev_charging_space']
+    weights = {'time_to_destination': 0.8, 'traffic_density': 0.1, 'handicapped_space': 0.1, 'family_space': 0.1,
+               'ev_charging_space': 0.1}
+    stages = {}
+
+    def build():
+        car_parks = []
+        for index, position in enumerate(map(tuple, city['locations'].tolist())):
+            car_parks.append({
+                'name': f"Car Park {index}",
+                'time_to_carpark': module.calculate_time(user_location, position),
+                'time_from_carpark': module.calculate_time(position, destination_location),
+                'traffic_density': float(city['traffic_density'][index]),
+                'parking_matrix': module.OccupancyBitmap.from_matrix(occupied_spaces(city, index)),
+                'handicapped_space': int(city['handicap_spaces'][index] > 0),
+                'family_space': int(city['family_spaces'][index] > 0),
+                'ev_charging_space': int(city['ev_charging_spaces'][index] > 0),
+                'position': position
+            })
+        return car_parks
+    car_parks = time_stage(stages, 'build', build, 1)
+
+    # Occupancy history: a day of samples for every car park, then the free spaces at every car park's ETA in one pass
+    spaces = np.array([len(cp['parking_matrix']) for cp in car_parks])
+    free_counts = np.array([cp['parking_matrix'].free_count for cp in car_parks])
+    history = module.OccupancyHistory(spaces)
+    rng = np.random.default_rng(len(car_parks))
+
+    def record():
+        for sample in range(history.capacity):
+            history.record(np.clip(free_counts + rng.integers(-2, 3, len(car_parks)), 0, spaces), sample * history.sample_minutes)
+    time_stage(stages, 'history_record', record, 1)
+    arrival_minutes = np.array([cp['time_to_carpark'] for cp in car_parks], dtype=np.float64)
+    time_stage(stages, 'forecast', lambda: history.forecast(np.arange(len(car_parks)), arrival_minutes), repeats)
+
+    def normalise():
+        criteria_matrix = module.build_criteria_matrix(car_parks, criteria)
+        running = module.RunningStatistics(criteria)
+        running.add_many(criteria_matrix)
+        return criteria_matrix, running
+    criteria_matrix, running = time_stage(stages, 'normalization', normalise, repeats)
+
+    # A car park leaving the candidate set and joining it again, instead of recomputing the statistics
+    def leave_and_join():
+        running.remove(criteria_matrix[0])
+        running.add(criteria_matrix[0])
+    time_stage(stages, 'normalization_update', leave_and_join, repeats)
+
+    non_full_mask = np.array([cp['parking_matrix'].free_count > 0 for cp in car_parks], dtype=bool)
+    non_full_car_parks = [cp for cp, non_full in zip(car_parks, non_full_mask) if non_full]
+    scores = time_stage(stages, 'scoring', lambda: module.calculate_scores(criteria_matrix[non_full_mask], weights, criteria,
+                                                                           running.means, running.std_devs), repeats)
+    order = time_stage(stages, 'rank', lambda: module.rank_car_parks(scores), repeats)
+
+    # Preference sliders: the skyline is found once per snapshot, then each slider move only re-ranks it
+    ranker = time_stage(stages, 'skyline', lambda: module.SkylineRanker(criteria_matrix[non_full_mask], criteria, running.means,
+                                                                      running.std_devs, k=10), 1)
+    time_stage(stages, 'rerank', lambda: ranker.top_k(weights), repeats)
+    slider_weights = [{key: random.random() for key in weights} for _ in range(256)]
+    time_stage(stages, 'rerank_batch', lambda: ranker.top_k_batch(slider_weights), repeats)
+
+    drivers = []
+    for _ in range(min(num_drivers, len(car_parks))):
+        origin, destination = random_trip(city)
+        drivers.append({'origin': origin, 'destination': destination,
+                        'requirement': random.choice([None, None, 'ev_charging_space'])})
+    time_stage(stages, 'assignment', lambda: module.assign_drivers(drivers, car_parks), 1)
+
+    ranked_car_parks = [(non_full_car_parks[index], scores[index]) for index in order]
+    full_car_parks = [cp['name'] for cp, non_full in zip(car_parks, non_full_mask) if not non_full]
+    positions = [cp['position'] for cp in car_parks]
+    time_stage(stages, 'recommend', lambda: module.recommend_parking(user_location, positions, ranked_car_parks,
+                                                                     full_car_parks), repeats)
+    return stages
+
+
+# Stages of the V6 ParkingAlgorithm: CarPark objects and the full find_optimal_car_park scan and sort
+def benchmark_v6(module, city, repeats):
+    stages = {}
+
+    def build():
+        car_parks = [module.CarPark(index, f"Car Park {index}", tuple(location), (1 - occupied_spaces(city, index)).tolist(),
+                                    int(city['handicap_spaces'][index]), int(city['ev_charging_spaces'][index]))
+                     for index, location in enumerate(city['locations'].tolist())]
+        return module.ParkingAlgorithm(car_parks)
+    algorithm = time_stage(stages, 'build', build, 1)
+    algorithm.traffic_density = 'medium'
+
+    user_location, destination_location = random_trip(city)
+    time_stage(stages, 'rank', lambda: algorithm.find_optimal_car_park(user_location, destination_location), repeats)
+    time_stage(stages, 'recommend', lambda: algorithm.find_optimal_car_park(user_location, destination_location,
+                                                                            'ev_charging')[:5], repeats)
+    return stages
+
+
+# Function to write a city into the car_parks table of a new SQLite file, every row at version 0
+def write_city_database(city, path):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE car_parks (id INTEGER PRIMARY KEY, name TEXT, location_x INTEGER, "
+                       "location_y INTEGER, parking_spaces TEXT, handicap_spaces INTEGER, "
+                       "ev_charging_spaces INTEGER, updated_at INTEGER)")
+    connection.executemany("INSERT INTO car_parks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+        (index, f"Car Park {index}", x, y, ','.join(map(str, 1 - occupied_spaces(city, index))),
+         int(city['handicap_spaces'][index]), int(city['ev_charging_spaces'][index]), 0)
+        for index, (x, y) in enumerate(city['locations'].tolist())))
+    connection.commit()
+    connection.close()
+
+
+# Stages of the V7 ParkingAlgorithm on a SQLite stand-in for the car_parks table
+def benchmark_v7(module, city, repeats, num_queries):
+    stages = {}
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        write_city_database(city, path)
+        pool = module.ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False), sqlite3.paramstyle)
+        algorithm = module.ParkingAlgorithm(module.CarParkDatabase(pool), max_staleness=None)
+        algorithm.traffic_density = 'medium'
+
+        car_parks = time_stage(stages, 'fetch', lambda: (algorithm.catalog.load(), algorithm.catalog.car_parks)[1], 1)
+        time_stage(stages, 'index', lambda: module.CarParkIndex(car_parks), 1)
+        user_location, destination_location = random_trip(city)
+        time_stage(stages, 'rank', lambda: algorithm.find_optimal_car_park(user_location, destination_location), repeats)
+        time_stage(stages, 'recommend', lambda: algorithm.find_optimal_car_park(user_location, destination_location,
+                                                                                'ev_charging', limit=5), repeats)
+        queries = [random_trip(city) + (None,) for _ in range(num_queries)]
+        time_stage(stages, 'recommend_batch', lambda: algorithm.find_optimal_car_parks(queries, limit=5), repeats)
+
+        # Peak-hour traffic: the same few trips asked for again and again, without and then with the ranking cache
+        trips = [random_trip(city) for _ in range(10)]
+        repeated = [random.choice(trips) for _ in range(num_queries)]
+        time_stage(stages, 'recommend_repeat', lambda: [algorithm.find_optimal_car_park(user_location, destination_location,
+                                                                                        limit=5)
+                                                        for user_location, destination_location in repeated], repeats)
+        algorithm.ranking_cache = load_version('V7', 'ranking_cache').RankingCache()
+        time_stage(stages, 'recommend_repeat_cached',
+                   lambda: [algorithm.find_optimal_car_park(user_location, destination_location, limit=5)
+                            for user_location, destination_location in repeated], repeats)
+        pool.close()
+    finally:
+        os.remove(path)
+    return stages
+
+
+# Function to run every version against every city size and collect one record per (version, size, stage)
+def run_benchmarks(versions, sizes, repeats=3, seed=0, num_drivers=10000, num_queries=100, log=print):
+    records = []
+    for version in versions:
+        try:
+            module = load_version(version)
+        except Exception as error:
+            log(f"{version}: skipped ({type(error).__name__}: {error})")
+            records.append({'version': version, 'size': None, 'stage': 'import',
+                            'skipped': f"{type(error).__name__}: {error}"})
+            continue
+
+        for size in sizes:
+            random.seed(seed)
+            city = generate_city(size, seed)
+            try:
+                if version in ('V3', 'V4'):
+                    stages = benchmark_v3_v4(version, module, city, repeats)
+                elif version == 'V5':
+                    stages = benchmark_v5(module, city, repeats, num_drivers)
+                elif version == 'V6':
+                    stages = benchmark_v6(module, city, repeats)
+                else:
+                    stages = benchmark_v7(module, city, repeats, num_queries)
+            except Exception as error:
+                # A stage that failed left nothing for the stages after it
+                stages = {'run': f"failed: {type(error).__name__}: {error}"}
+
+            for stage, timings in stages.items():
+                record = {'version': version, 'size': size, 'stage': stage}
+                if isinstance(timings, str):
+                    record['skipped'] = timings
+                else:
+                    record.update({'repeats': len(timings), 'min_seconds': min(timings),
+                                   'median_seconds': statistics.median(timings)})
+                records.append(record)
+                log(f"{version} {size:>8} {stage:<16} " +
+                    (record['skipped'] if 'skipped' in record else f"{record['min_seconds'] * 1000:12.3f} ms"))
+    return records
+
+
+# Function to compare two result files; returns (version, size, stage, previous, current, ratio) rows
+def compare_results(previous, current):
+    previous_times = {(r['version'], r['size'], r['stage']): r['min_seconds'] for r in previous['results'] if 'min_seconds' in r}
+    rows = []
+    for record in current['results']:
+        key = (record['version'], record['size'], record['stage'])
+        if 'min_seconds' in record and key in previous_times and previous_times[key] > 0:
+            rows.append(key + (previous_times[key], record['min_seconds'], record['min_seconds'] / previous_times[key]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the V3-V7 parking algorithms on synthetic cities")
+    parser.add_argument('--versions', nargs='+', default=list(VERSION_FOLDERS), choices=list(VERSION_FOLDERS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drivers', type=int, default=10000, help="Waiting drivers for the V5 batch assignment")
+    parser.add_argument('--queries', type=int, default=100, help="Queries in the V7 batch recommendation")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'repeats': args.repeats,
+            'seed': args.seed
+        },
+        'results': run_benchmarks(args.versions, args.sizes, args.repeats, args.seed, args.drivers, args.queries)
+    }
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            for version, size, stage, before, after, ratio in compare_results(json.load(previous), results):
+                flag = '  <-- slower' if ratio > 1.2 else ''
+                print(f"{version} {size:>8} {stage:<16} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms  x{ratio:.2f}{flag}")
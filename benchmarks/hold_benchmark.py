@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmark import generate_city, load_modules, occupied_spaces, write_city_database
+
+# Stress test of the V7 recommend-and-hold operation (holds.py): many threads claim spaces at once around one busy
+# destination, and the run fails loudly if any space ends up held twice or lost. Separate processes share holds
+# through service.py ({"hold": true, ...} requests), which runs the same claims on its executor threads.
+# With --catalog sqlite the car parks come from a SQLite car_parks table refreshed on every read, while another
+# thread keeps rewriting rows as they were, so every refresh re-reads spaces that are held in memory only.
+
+
+# Function to build a V7 ParkingAlgorithm over a synthetic city held in a CarParkTable, with no database behind it
+def build_algorithm(main, catalog, city):
+    num_car_parks = len(city['locations'])
+    table = main.CarParkTable({
+        'id': np.arange(num_car_parks, dtype=np.int64),
+        'name': [f"Car Park {index}" for index in range(num_car_parks)],
+        'location': city['locations'],
+        'handicap_spaces': city['handicap_spaces'].astype(np.int32),
+        'ev_charging_spaces': city['ev_charging_spaces'].astype(np.int32)
+    }, [1 - occupied_spaces(city, index) for index in range(num_car_parks)], row_class=main.CarParkRow)
+    return main.ParkingAlgorithm(None, catalog=catalog.StaticCatalog(table))
+
+
+# Function to build a V7 ParkingAlgorithm over a synthetic city written to a SQLite file, refreshing its catalog on
+# every read. Returns the algorithm and its connection pool.
+def build_database_algorithm(main, database, city, path):
+    write_city_database(city, path)
+    pool = database.ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False), sqlite3.paramstyle, size=8)
+    return main.ParkingAlgorithm(database.CarParkDatabase(pool), max_staleness=0), pool
+
+
+# Function to keep rewriting random rows unchanged, half of them at a newer version, until stopped
+def rewrite_rows(path, num_car_parks, stop, rng):
+    connection = sqlite3.connect(path)
+    try:
+        while not stop.wait(0.001):
+            ids = rng.choice(num_car_parks, min(num_car_parks, 20), replace=False).tolist()
+            connection.executemany("UPDATE car_parks SET updated_at = updated_at + ? WHERE id = ?",
+                                   [(int(rng.random() < 0.5), car_park_id) for car_park_id in ids])
+            connection.commit()
+    finally:
+        connection.close()
+
+
+# Function to count the free spaces of every car park
+def free_spaces(car_parks):
+    if hasattr(car_parks, 'free_counts'):
+        return int(car_parks.free_counts.sum())
+    return sum(car_park.parking_spaces.free_count for car_park in car_parks)
+
+
+# Function to draw every driver's trip: users anywhere in the city, destinations inside a square hotspot around
+# the centre covering the given fraction of its width
+def draw_trips(city, num_threads, claims_per_thread, hotspot, rng):
+    grid_size = city['grid_size']
+    half_width = max(0, int(grid_size * hotspot) // 2)
+    centre = grid_size // 2
+    users = rng.integers(0, grid_size, size=(num_threads, claims_per_thread, 2))
+    destinations = rng.integers(max(0, centre - half_width), min(grid_size, centre + half_width + 1),
+                                size=(num_threads, claims_per_thread, 2))
+    return users.tolist(), destinations.tolist()
+
+
+# Function to run one stress round: every thread waits at a barrier, then claims its share of spaces one after
+# another, releasing some of them again straight away. Returns the throughput, latency and consistency figures.
+def run_round(modules, city, num_threads, num_claims, hotspot, release_fraction, hold_seconds, seed,
+              catalog_kind='table'):
+    main, holds_module, catalog, database = modules
+    rng = np.random.default_rng(seed)
+    stop = threading.Event()
+    pool = writer = path = None
+    if catalog_kind == 'sqlite':
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        algorithm, pool = build_database_algorithm(main, database, city, path)
+        writer = threading.Thread(target=rewrite_rows, args=(path, len(city['locations']), stop,
+                                                             np.random.default_rng(seed + 1)))
+    else:
+        algorithm = build_algorithm(main, catalog, city)
+    try:
+        return stress(algorithm, holds_module, city, num_threads, num_claims, hotspot, release_fraction,
+                      hold_seconds, rng, writer, stop)
+    finally:
+        stop.set()
+        if writer is not None and writer.is_alive():
+            writer.join()
+        if pool is not None:
+            pool.close()
+        if path is not None:
+            os.remove(path)
+
+
+# Function to run the drivers of one round against an algorithm, with the row writer (if any) running alongside
+def stress(algorithm, holds_module, city, num_threads, num_claims, hotspot, release_fraction, hold_seconds, rng,
+           writer, stop):
+    holds = holds_module.SpaceHolds(algorithm, hold_seconds)
+    car_parks = algorithm.catalog.get_car_parks()
+    algorithm.get_availability_index(car_parks)
+    free_before = free_spaces(car_parks)
+
+    claims_per_thread = max(1, num_claims // num_threads)
+    users, destinations = draw_trips(city, num_threads, claims_per_thread, hotspot, rng)
+    releases = (rng.random((num_threads, claims_per_thread)) < release_fraction).tolist()
+    latencies = [[] for _ in range(num_threads)]
+    refused = [0] * num_threads
+    errors = []
+    barrier = threading.Barrier(num_threads + 1)
+
+    def driver(thread):
+        barrier.wait()
+        try:
+            for claim in range(claims_per_thread):
+                started = time.perf_counter()
+                hold = holds.recommend_and_hold(tuple(users[thread][claim]), tuple(destinations[thread][claim]))
+                latencies[thread].append(time.perf_counter() - started)
+                if hold is None:
+                    refused[thread] += 1
+                elif releases[thread][claim]:
+                    holds.release(hold.id)
+        except Exception as error:
+            errors.append(f"{type(error).__name__}: {error}")
+
+    threads = [threading.Thread(target=driver, args=(thread,)) for thread in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    if writer is not None:
+        writer.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    stop.set()
+    if writer is not None:
+        writer.join()
+    if errors:
+        raise RuntimeError(errors[0])
+
+    # Every live hold must own a distinct space that is marked occupied, and every other space must be as it was,
+    # after one more refresh when the car parks come from the database
+    car_parks = algorithm.catalog.get_car_parks()
+    active = list(holds.holds.values())
+    held_spaces = {(hold.car_park.id, hold.space) for hold in active}
+    free_after = free_spaces(car_parks)
+    index = algorithm.get_availability_index(car_parks)
+    all_latencies = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+    counters = algorithm.metrics.snapshot()['counters']
+    return {
+        'threads': num_threads,
+        'claims': len(all_latencies),
+        'granted': counters.get('holds_granted', 0),
+        'refused': sum(refused),
+        'conflicts': counters.get('hold_conflicts', 0),
+        'rerankings': counters.get('hold_rerankings', 0),
+        'released': counters.get('holds_released', 0),
+        'expired': counters.get('holds_expired', 0),
+        'active_holds': len(active),
+        'seconds': seconds,
+        'claims_per_second': len(all_latencies) / seconds if seconds else 0.0,
+        'p50_ms': statistics.median(all_latencies) * 1000 if all_latencies else 0.0,
+        'p99_ms': all_latencies[min(int(0.99 * len(all_latencies)), len(all_latencies) - 1)] * 1000
+        if all_latencies else 0.0,
+        'double_bookings': len(active) - len(held_spaces),
+        'held_but_free': sum(hold.car_park.parking_spaces.is_free(hold.space) for hold in active),
+        'lost_spaces': free_before - free_after - len(active),
+        'stale_availability': int(np.count_nonzero(index.free != np.fromiter(
+            (car_park.has_available_space() for car_park in car_parks), dtype=bool, count=len(car_parks))))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the V7 recommend-and-hold operation with concurrent threads")
+    parser.add_argument('--car-parks', type=int, default=2000)
+    parser.add_argument('--spaces', type=int, nargs=2, default=(4, 16), metavar=('MIN', 'MAX'),
+                        help="Spaces per car park")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 16, 256, 1024])
+    parser.add_argument('--claims', type=int, default=5000, help="Claims per round, shared out between the threads")
+    parser.add_argument('--hotspot', type=float, default=0.1,
+                        help="Width of the destination hotspot as a fraction of the city")
+    parser.add_argument('--release-fraction', type=float, default=0.2, help="Share of holds released straight away")
+    parser.add_argument('--hold-seconds', type=float, default=300.0)
+    parser.add_argument('--catalog', choices=['table', 'sqlite'], default='table',
+                        help="Serve the car parks from a CarParkTable, or from SQLite refreshed on every read")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    modules = load_modules('V7', ['main', 'holds', 'catalog', 'database'])
+    threading.stack_size(1 << 20)  # Thousands of drivers at the default stack size would reserve gigabytes
+
+    results = []
+    print(f"{'threads':>8}{'claims':>9}{'granted':>9}{'refused':>9}{'conflicts':>11}{'claims/s':>11}{'p50 ms':>9}"
+          f"{'p99 ms':>9}{'double':>8}{'lost':>6}")
+    for num_threads in args.threads:
+        city = generate_city(args.car_parks, args.seed, tuple(args.spaces))
+        result = run_round(modules, city, num_threads, args.claims, args.hotspot, args.release_fraction,
+                           args.hold_seconds, args.seed, args.catalog)
+        results.append(result)
+        print(f"{result['threads']:>8}{result['claims']:>9}{result['granted']:>9}{result['refused']:>9}"
+              f"{result['conflicts']:>11}{result['claims_per_second']:>11.0f}{result['p50_ms']:>9.3f}"
+              f"{result['p99_ms']:>9.3f}{result['double_bookings']:>8}{result['lost_spaces']:>6}")
+        if result['double_bookings'] or result['held_but_free'] or result['lost_spaces'] or result['stale_availability']:
+            raise SystemExit(f"Inconsistent holds with {num_threads} threads: {result}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'car_parks': args.car_parks, 'claims': args.claims, 'catalog': args.catalog,
+                       'results': results}, output, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,301 @@
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import shlex
+import sys
+
+from versions import ROOT, load_modules
+
+# Single entry point for the parking algorithms:
+#   python parking.py rank --store car_parks.store --user 2 3 --destination 7 7 --limit 3
+#   python parking.py assign --car-parks car_parks.json --drivers drivers.json
+#   python parking.py simulate --sqlite car_parks.db
+#   python parking.py batch queries.jsonl --store car_parks.store --limit 3 --output rankings.jsonl
+#   python parking.py render --user 0 0 --destination 5 5
+#   python parking.py day --store car_parks.store --rate-scale 2
+#   python parking.py montecarlo --scenarios 1000000 --workers 8
+#   python parking.py bench --versions V5 V7 --sizes 1000
+#   python parking.py resident < commands.txt
+# Only the standard library is imported up front; each subcommand loads the version folder it runs on when it is
+# first used, and that folder defers its own heavy dependencies (SciPy, tabulate, the MySQL driver) until needed.
+# rank, simulate, batch and day run on V7; assign, render and montecarlo on V5 (the heads of the two lineages).
+
+# Milliseconds from starting parking.py to having run the command, imports included, on a warm page cache
+STARTUP_BUDGETS_MS = {
+    'rank': 250,
+    'assign': 800,
+    'simulate': 250,
+    'render': 250
+}
+ALGORITHMS = {}  # Data source -> V7 ParkingAlgorithm, reused across resident commands
+
+
+# Function to build (or reuse) the V7 ParkingAlgorithm for the data source given on the command line
+def get_algorithm(args):
+    key = (args.store, args.sqlite, args.traffic_density)
+    if key in ALGORITHMS:
+        return ALGORITHMS[key]
+
+    main, metrics_module = load_modules('V7', ['main', 'metrics'])
+    metrics = metrics_module.Metrics()
+    if args.store:
+        (car_park_store,) = load_modules('V7', ['car_park_store'])
+        algorithm = main.ParkingAlgorithm(None, traffic_density=args.traffic_density,
+                                          catalog=car_park_store.CarParkStore(args.store, main.CarParkRow),
+                                          metrics=metrics)
+    else:
+        (database,) = load_modules('V7', ['database'])
+        if args.sqlite:
+            import sqlite3
+
+            pool = database.ConnectionPool(lambda: sqlite3.connect(args.sqlite, check_same_thread=False),
+                                           sqlite3.paramstyle)
+        else:
+            import mysql.connector
+
+            pool = database.ConnectionPool(lambda: mysql.connector.connect(
+                host="localhost",
+                user="your_username",
+                password="your_password",
+                database="your_database"
+            ), mysql.connector.paramstyle, size=8, prepared=True)
+        algorithm = main.ParkingAlgorithm(database.CarParkDatabase(pool, metrics=metrics),
+                                          traffic_density=args.traffic_density, metrics=metrics)
+    ALGORITHMS[key] = algorithm
+    return algorithm
+
+
+# Function to read V5 style car parks from a JSON list ({"name", "position", "parking_matrix", space flags}),
+# or use the V5 sample car parks when no file is given
+def load_v5_car_parks(path):
+    v5_main, occupancy = load_modules('V5', ['main', 'occupancy'])
+    if path is None:
+        return v5_main.generate_sample_car_parks()[0]
+    with open(path) as file:
+        car_parks = json.load(file)
+    for car_park in car_parks:
+        car_park['position'] = tuple(car_park['position'])
+        car_park['parking_matrix'] = occupancy.OccupancyBitmap.from_matrix(car_park['parking_matrix'])
+    return car_parks
+
+
+def car_park_summary(car_park):
+    return {'id': car_park.id, 'name': car_park.name, 'location': list(car_park.location)}
+
+
+def command_rank(args):
+    algorithm = get_algorithm(args)
+    car_parks = algorithm.find_optimal_car_park(tuple(args.user), tuple(args.destination), args.requirement, args.limit)
+    print(json.dumps([car_park_summary(car_park) for car_park in car_parks]))
+
+
+def command_simulate(args):
+    algorithm = get_algorithm(args)
+    user_location = tuple(args.user) if args.user else (random.randint(0, 9), random.randint(0, 9))
+    destination_location = tuple(args.destination) if args.destination else (random.randint(0, 9), random.randint(0, 9))
+    print("User Location:", user_location)
+    print("Destination Location:", destination_location)
+    print("Requires Specialized Space:", args.requirement)
+    algorithm.simulate(user_location, destination_location, args.requirement, args.limit)
+
+
+def command_batch(args):
+    (batch_queries,) = load_modules('V7', ['batch_queries'])
+    algorithm = get_algorithm(args)
+    queries = sys.stdin if args.queries == '-' else open(args.queries)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', buffering=1 << 20)
+    try:
+        answered, rejected = batch_queries.run_batch(algorithm, queries, output, args.limit, args.chunk_size)
+    finally:
+        for file in (queries, output):
+            if file not in (sys.stdin, sys.stdout):
+                file.close()
+    print(f"Answered {answered} queries, rejected {rejected} lines", file=sys.stderr)
+
+
+def command_day(args):
+    (event_simulation,) = load_modules('V7', ['event_simulation'])
+    algorithm = get_algorithm(args)
+    rates = [rate * args.rate_scale for rate in event_simulation.DEFAULT_ARRIVAL_RATES]
+    simulator = event_simulation.EventSimulator.for_algorithm(
+        algorithm, arrival_rates=rates, stay_minutes=event_simulation.lognormal_stays(args.mean_stay), seed=args.seed)
+    result = simulator.run(args.hours * 60)
+    print(json.dumps({key: result[key] for key in ('arrivals', 'rejected', 'rejected_by_bucket', 'sample_minutes',
+                                                    'occupancy', 'still_parked', 'events', 'events_per_second')}))
+
+
+def command_assign(args):
+    v5_main, assignment = load_modules('V5', ['main', 'assignment'])
+    car_parks = load_v5_car_parks(args.car_parks)
+    if args.drivers:
+        with open(args.drivers) as file:
+            drivers = json.load(file)
+    else:
+        grid = [(x, y) for x in range(11) for y in range(11)]
+        drivers = v5_main.generate_waiting_drivers(args.random_drivers, grid)
+    assignments = assignment.assign_drivers(drivers, car_parks, args.k)
+    print(json.dumps([None if result is None else {'driver': index, 'car_park': car_parks[result[0]]['name'],
+                                                   'space': result[1]}
+                      for index, result in enumerate(assignments)]))
+
+
+def command_render(args):
+    (v5_main,) = load_modules('V5', ['main'])
+    car_parks = load_v5_car_parks(args.car_parks)
+    positions = {car_park['name']: car_park['position'] for car_park in car_parks}
+    print(v5_main.render_location_matrix(tuple(args.user), tuple(args.destination), positions, args.grid_size))
+
+
+def command_montecarlo(args):
+    (monte_carlo,) = load_modules('V5', ['monte_carlo'])
+    car_parks = load_v5_car_parks(args.car_parks)
+    result = monte_carlo.simulate_city(car_parks, args.scenarios, args.workers, args.seed, args.grid_size,
+                                       args.occupancy_prob)
+    print(json.dumps({
+        'scenarios': result['scenarios'],
+        'mean_total_time': result['mean_total_time'],
+        'miss_rate': result['miss_rate'],
+        'choice_distribution': {car_park['name']: share
+                                for car_park, share in zip(car_parks, result['choice_distribution'].tolist())}
+    }))
+
+
+def command_bench(args):
+    import runpy
+
+    argv = sys.argv
+    sys.argv = [str(ROOT / 'benchmarks' / 'benchmark.py')] + args.bench_args
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    finally:
+        sys.argv = argv
+
+
+# Function to keep one warmed process running: every stdin line is a command line (without "parking.py"), and
+# every command is answered with one JSON line {"output": ..., "seconds": ...} or {"error": ...}.
+# Loaded modules, data sources and their caches stay in memory between commands.
+def command_resident(args):
+    parser = build_parser()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        started = time.perf_counter()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                command_args = parser.parse_args(shlex.split(line))
+                if command_args.command in ('resident', 'bench'):
+                    raise ValueError(f"{command_args.command} cannot run inside resident mode")
+                command_args.handler(command_args)
+            response = {'output': output.getvalue(), 'seconds': time.perf_counter() - started}
+        except SystemExit as error:
+            response = {'error': f"invalid command (exit status {error.code})", 'output': output.getvalue()}
+        except Exception as error:
+            response = {'error': f"{type(error).__name__}: {error}", 'output': output.getvalue()}
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+
+def add_source_arguments(parser, requirement=True):
+    parser.add_argument('--store', help="Car park store file (see car_park_store.py)")
+    parser.add_argument('--sqlite', help="SQLite file with a car_parks table (default: MySQL)")
+    parser.add_argument('--traffic-density', choices=['low', 'medium', 'high'], default='medium')
+    if requirement:
+        parser.add_argument('--requirement', choices=['handicap', 'ev_charging'], nargs='+',
+                            help="Space types the car park must have (all of them when several are given)")
+    parser.add_argument('--limit', type=int)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='parking', description="Parking algorithm command line")
+    parser.add_argument('--timings', action='store_true', help="Report startup and run time against the budget")
+    parser.add_argument('--metrics', choices=['text', 'json'],
+                        help="Print the stage timings and counters of the V7 algorithm to stderr when done")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rank = subparsers.add_parser('rank', help="Rank car parks for one trip (V7)")
+    add_source_arguments(rank)
+    rank.add_argument('--user', type=int, nargs=2, required=True, metavar=('X', 'Y'))
+    rank.add_argument('--destination', type=int, nargs=2, required=True, metavar=('X', 'Y'))
+    rank.set_defaults(handler=command_rank)
+
+    simulate = subparsers.add_parser('simulate', help="Print the recommendation for one trip (V7)")
+    add_source_arguments(simulate)
+    simulate.add_argument('--user', type=int, nargs=2, metavar=('X', 'Y'))
+    simulate.add_argument('--destination', type=int, nargs=2, metavar=('X', 'Y'))
+    simulate.set_defaults(handler=command_simulate)
+
+    batch = subparsers.add_parser('batch', help="Rank a JSON lines file of queries into JSON lines (V7)")
+    add_source_arguments(batch, requirement=False)
+    batch.add_argument('queries', help="Queries, one JSON object or [user, destination, requirement] per line "
+                                       "('-' for stdin; see batch_queries.py)")
+    batch.add_argument('--output', default='-', help="File to write the results to ('-' for stdout)")
+    batch.add_argument('--chunk-size', type=int, default=1024, help="Queries ranked per pass")
+    batch.set_defaults(handler=command_batch)
+
+    day = subparsers.add_parser('day', help="Simulate a day of arrivals and departures (V7)")
+    add_source_arguments(day)
+    day.add_argument('--rate-scale', type=float, default=1.0, help="Multiplier on the default arrival rate curve")
+    day.add_argument('--mean-stay', type=float, default=120.0, help="Mean stay in minutes")
+    day.add_argument('--hours', type=float, default=24)
+    day.add_argument('--seed', type=int, default=0)
+    day.set_defaults(handler=command_day)
+
+    assign = subparsers.add_parser('assign', help="Assign a batch of waiting drivers to free spaces (V5)")
+    assign.add_argument('--car-parks', help="JSON list of car parks (default: the V5 sample car parks)")
+    assign.add_argument('--drivers', help="JSON list of drivers with origin, destination and requirement")
+    assign.add_argument('--random-drivers', type=int, default=4, help="Drivers to generate when --drivers is not given")
+    assign.add_argument('--k', type=int, default=8, help="Candidate car parks per driver")
+    assign.set_defaults(handler=command_assign)
+
+    render = subparsers.add_parser('render', help="Render the location grid (V5)")
+    render.add_argument('--car-parks', help="JSON list of car parks (default: the V5 sample car parks)")
+    render.add_argument('--user', type=int, nargs=2, required=True, metavar=('X', 'Y'))
+    render.add_argument('--destination', type=int, nargs=2, required=True, metavar=('X', 'Y'))
+    render.add_argument('--grid-size', type=int, default=11)
+    render.set_defaults(handler=command_render)
+
+    montecarlo = subparsers.add_parser('montecarlo', help="Simulate many independent drivers across processes (V5)")
+    montecarlo.add_argument('--car-parks', help="JSON list of car parks (default: the V5 sample car parks)")
+    montecarlo.add_argument('--scenarios', type=int, default=1000000)
+    montecarlo.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    montecarlo.add_argument('--seed', type=int, default=0)
+    montecarlo.add_argument('--grid-size', type=int, default=11)
+    montecarlo.add_argument('--occupancy-prob', type=float, default=0.5)
+    montecarlo.set_defaults(handler=command_montecarlo)
+
+    bench = subparsers.add_parser('bench', help="Run benchmarks/benchmark.py with the remaining arguments",
+                                  add_help=False)
+    bench.set_defaults(handler=command_bench)
+
+    resident = subparsers.add_parser('resident', help="Answer commands read from stdin in one warmed process")
+    resident.set_defaults(handler=command_resident)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args, extra_args = parser.parse_known_args()
+    if args.command == 'bench':
+        args.bench_args = extra_args
+    elif extra_args:
+        parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+    ready = time.perf_counter()
+    args.handler(args)
+    finished = time.perf_counter()
+
+    if args.timings:
+        total_ms = (finished - STARTED) * 1000
+        budget_ms = STARTUP_BUDGETS_MS.get(args.command)
+        verdict = '' if budget_ms is None else f" (budget {budget_ms} ms{', OVER' if total_ms > budget_ms else ''})"
+        print(f"parking {args.command}: parse {(ready - STARTED) * 1000:.1f} ms, "
+              f"run {(finished - ready) * 1000:.1f} ms, total {total_ms:.1f} ms{verdict}", file=sys.stderr)
+    if args.metrics:
+        for algorithm in ALGORITHMS.values():
+            print(algorithm.metrics.to_text() if args.metrics == 'text' else algorithm.metrics.to_json(), file=sys.stderr)
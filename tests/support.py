@@ -0,0 +1,76 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from versions import load_modules, load_version
+
+# Helpers shared by the tests: V7 algorithms over a SQLite car_parks table, and the brute-force rankings the fast
+# paths must reproduce
+
+
+# Function to create the car_parks table in a new SQLite file and fill it with rows
+def create_database(path, rows):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE car_parks (id INTEGER PRIMARY KEY, name TEXT, location_x INT, location_y INT, "
+                       "parking_spaces TEXT, handicap_spaces INT, ev_charging_spaces INT, updated_at INT)")
+    write_rows(connection, rows)
+    return connection
+
+
+# Function to insert or replace rows of the car_parks table
+def write_rows(connection, rows):
+    connection.executemany("INSERT OR REPLACE INTO car_parks VALUES (:id, :name, :location_x, :location_y, "
+                           ":parking_spaces, :handicap_spaces, :ev_charging_spaces, :updated_at)", rows)
+    connection.commit()
+
+
+# Function to draw rows of car parks with 1-6 spaces on a grid x grid area
+def random_rows(rng, count, grid=30, version=1):
+    rows = []
+    for car_park_id in range(1, count + 1):
+        rows.append({
+            'id': car_park_id,
+            'name': f"Car Park {car_park_id}",
+            'location_x': int(rng.integers(0, grid)),
+            'location_y': int(rng.integers(0, grid)),
+            'parking_spaces': ','.join(str(int(space)) for space in rng.random(int(rng.integers(1, 7))) < 0.6),
+            'handicap_spaces': int(rng.random() < 0.3),
+            'ev_charging_spaces': int(rng.random() < 0.2),
+            'updated_at': version
+        })
+    return rows
+
+
+# Function to build a V7 ParkingAlgorithm reading the car_parks table of a SQLite file through its own catalog
+def database_algorithm(path, **options):
+    main, database = load_modules('V7', ['main', 'database'])
+    pool = database.ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False), sqlite3.paramstyle, size=4)
+    return main.ParkingAlgorithm(database.CarParkDatabase(pool), **options), pool
+
+
+# Function to rank car parks the slow way: every car park with a free space and every required space type, by grid
+# drive time from the user plus walk time to the destination, ties in catalog order
+def brute_force_ranking(algorithm, car_parks, query, limit=None):
+    (availability_index,) = load_modules('V7', ['availability_index'])
+    user_location, destination_location, requirement = query
+    drive_interval = algorithm.time_intervals[algorithm.traffic_density]
+    walk_interval = algorithm.time_intervals['low']
+    ranked = []
+    for position, car_park in enumerate(car_parks):
+        if car_park.has_available_space() and all(car_park.has_available_specialized_space(space_type)
+                                                  for space_type in availability_index.requirement_types(requirement)):
+            time = (abs(car_park.location[0] - user_location[0]) + abs(car_park.location[1] - user_location[1])) * \
+                drive_interval + (abs(car_park.location[0] - destination_location[0]) +
+                                  abs(car_park.location[1] - destination_location[1])) * walk_interval
+            ranked.append((time, position))
+    ranked.sort()
+    return [car_parks[position].id for _, position in ranked[:limit]]
+
+
+# Function to draw queries with every kind of requirement
+def random_queries(rng, count, grid=30):
+    requirements = [None, 'handicap', 'ev_charging', ['handicap', 'ev_charging']]
+    return [((int(rng.integers(0, grid)), int(rng.integers(0, grid))),
+             (int(rng.integers(0, grid)), int(rng.integers(0, grid))),
+             requirements[int(rng.integers(0, len(requirements)))]) for _ in range(count)]
@@ -0,0 +1,77 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from support import load_modules
+
+
+def random_car_parks(rng, count, grid, spaces):
+    (occupancy,) = load_modules('V5', ['occupancy'])
+    return [{'name': f"Car Park {index}", 'position': (int(rng.integers(0, grid)), int(rng.integers(0, grid))),
+             'parking_matrix': occupancy.OccupancyBitmap.from_matrix(
+                 (rng.random(int(rng.integers(*spaces))) < 0.5).astype(int)),
+             'ev_charging_space': int(rng.random() < 0.3)} for index in range(count)]
+
+
+def check_assignments(car_parks, assignments):
+    taken = [assignment for assignment in assignments if assignment is not None]
+    assert len(set(taken)) == len(taken)
+    assert all(space in set(car_parks[car_park]['parking_matrix'].free_spaces()) for car_park, space in taken)
+
+
+def test_drivers_heading_for_one_spot_are_all_placed():
+    # Their k nearest car parks hold far fewer spaces than there are drivers
+    (assignment,) = load_modules('V5', ['assignment'])
+    rng = np.random.default_rng(2)
+    car_parks = random_car_parks(rng, 500, 90, (10, 30))
+    drivers = [{'origin': (45, 45), 'destination': (45, 45)} for _ in range(1500)]
+    assignments = assignment.assign_drivers(drivers, car_parks, k=4)
+    check_assignments(car_parks, assignments)
+    assert all(assignments)
+
+
+def test_assignment_matches_a_dense_solve_over_every_space():
+    (assignment,) = load_modules('V5', ['assignment'])
+    for seed in range(8):
+        rng = np.random.default_rng(seed)
+        car_parks = random_car_parks(rng, 40, 20, (2, 6))
+        drivers = [{'origin': (10, 10) if rng.random() < 0.6 else tuple(int(value) for value in rng.integers(0, 20, 2)),
+                    'destination': tuple(int(value) for value in rng.integers(8, 12, 2)),
+                    'requirement': 'ev_charging_space' if rng.random() < 0.2 else None} for _ in range(60)]
+        assignments = assignment.assign_drivers(drivers, car_parks, k=2)
+        check_assignments(car_parks, assignments)
+
+        # Every free space as its own column; ineligible pairs and leaving a driver out cost more than any placement
+        positions = [car_park['position'] for car_park in car_parks]
+        cost = assignment.calculate_times([driver['origin'] for driver in drivers], positions) + \
+            assignment.calculate_times([driver['destination'] for driver in drivers], positions)
+        eligible = np.array([[driver.get('requirement') is None or bool(car_park['ev_charging_space'])
+                              for car_park in car_parks] for driver in drivers])
+        excluded = (cost.max() + 1) * len(drivers)
+        cost = np.where(eligible, cost, excluded)
+        columns = [index for index, car_park in enumerate(car_parks) for _ in car_park['parking_matrix'].free_spaces()]
+        dense = np.hstack([cost[:, columns], np.full((len(drivers), len(drivers)), excluded)])
+        driver_rows, space_columns = linear_sum_assignment(dense)
+
+        assert sum(assignment is not None for assignment in assignments) == \
+            sum(dense[driver_rows, space_columns] < excluded)
+        placed_cost = sum(cost[driver, assigned[0]] for driver, assigned in enumerate(assignments) if assigned)
+        assert placed_cost == dense[driver_rows, space_columns][dense[driver_rows, space_columns] < excluded].sum()
+
+
+def test_cost_grid_finds_the_k_cheapest_car_parks():
+    # Clustered, non-integer positions with repeats, so cells are uneven and costs tie
+    (assignment,) = load_modules('V5', ['assignment'])
+    rng = np.random.default_rng(3)
+    centres = rng.uniform(0, 100, (5, 2))
+    positions = np.round(centres[rng.integers(0, 5, 3000)] + rng.normal(0, 4, (3000, 2)), 1)
+    origins, destinations = rng.uniform(-10, 110, (500, 2)), rng.uniform(-10, 110, (500, 2))
+    destinations[:100] = origins[:100]
+    grid = assignment.CostGrid(positions)
+    box_low, box_high = grid.trip_boxes(origins, destinations)
+    cost = assignment.calculate_times(origins, positions) + assignment.calculate_times(destinations, positions)
+    for k in (1, 8, 40):
+        rows, car_parks = grid.nearest(box_low, box_high, k)
+        assert np.array_equal(np.bincount(rows, minlength=len(origins)), np.full(len(origins), k))
+        order = np.argsort(rows, kind='stable')
+        found = np.sort(cost[rows[order], car_parks[order]].reshape(len(origins), k), axis=1)
+        np.testing.assert_allclose(found, np.sort(cost, axis=1)[:, :k], rtol=1e-12)
@@ -0,0 +1,66 @@
+import numpy as np
+
+from support import brute_force_ranking, create_database, database_algorithm, random_queries, random_rows, write_rows
+
+
+def ids(car_parks):
+    return [car_park.id for car_park in car_parks]
+
+
+def test_rankings_match_brute_force_through_streamed_updates_and_refreshes(tmp_path):
+    # The batch path reads the availability index, the single path the car parks themselves; both must follow the
+    # catalog when a refresh re-reads rows, whether at the last version seen or a newer one
+    rng = np.random.default_rng(21)
+    path = str(tmp_path / 'car_parks.db')
+    rows = random_rows(rng, 300)
+    connection = create_database(path, rows)
+    algorithm, pool = database_algorithm(path, max_staleness=0)
+    version = 1
+    try:
+        for step in range(40):
+            queries = random_queries(rng, 6)
+            limit = [None, 1, 5, 20][step % 4]
+            car_parks = algorithm.catalog.get_car_parks()
+            expected = [brute_force_ranking(algorithm, car_parks, query, limit) for query in queries]
+            assert [ids(algorithm.find_optimal_car_park(*query, limit=limit)) for query in queries] == expected
+            assert [ids(ranking) for ranking in algorithm.find_optimal_car_parks(queries, limit)] == expected
+
+            updates = {}
+            for _ in range(60):
+                car_park = car_parks[int(rng.integers(0, len(car_parks)))]
+                updates[(car_park.id, int(rng.integers(0, car_park.parking_spaces.size)))] = bool(rng.random() < 0.7)
+            algorithm.apply_occupancy_updates(updates)
+
+            if step % 3 == 0:
+                version += 1  # Otherwise the rows are rewritten at the version the catalog has already seen
+            changed = [rows[index] for index in rng.choice(len(rows), 15, replace=False)]
+            for row in changed:
+                row['parking_spaces'] = ','.join(str(int(space)) for space in rng.random(int(rng.integers(1, 7))) < 0.5)
+                row['updated_at'] = version
+            write_rows(connection, changed)
+    finally:
+        pool.close()
+        connection.close()
+
+
+def test_index_follows_rows_rewritten_at_the_version_already_seen(tmp_path):
+    path = str(tmp_path / 'car_parks.db')
+    rows = [
+        {'id': 1, 'name': 'A', 'location_x': 0, 'location_y': 0, 'parking_spaces': '1,0', 'handicap_spaces': 0,
+         'ev_charging_spaces': 0, 'updated_at': 1},
+        {'id': 2, 'name': 'B', 'location_x': 5, 'location_y': 5, 'parking_spaces': '1,1', 'handicap_spaces': 0,
+         'ev_charging_spaces': 0, 'updated_at': 1}
+    ]
+    connection = create_database(path, rows)
+    algorithm, pool = database_algorithm(path, max_staleness=0)
+    try:
+        query = ((0, 0), (0, 0), None)
+        assert [car_park.name for car_park in algorithm.find_optimal_car_parks([query])[0]] == ['A', 'B']
+        rows[0]['parking_spaces'] = '0,0'  # A fills up, written at the version the catalog has already seen
+        write_rows(connection, rows[:1])
+        single = [car_park.name for car_park in algorithm.find_optimal_car_park(*query)]
+        batch = [car_park.name for car_park in algorithm.find_optimal_car_parks([query])[0]]
+        assert single == batch == ['B']
+    finally:
+        pool.close()
+        connection.close()
@@ -0,0 +1,28 @@
+import io
+import json
+
+import numpy as np
+
+from support import load_modules, random_queries, random_rows
+
+
+def test_batch_rejects_bad_limits_and_answers_the_rest():
+    main, catalog, batch_queries = load_modules('V7', ['main', 'catalog', 'batch_queries'])
+    car_parks = [main.car_park_from_row(row) for row in random_rows(np.random.default_rng(20), 50)]
+    algorithm = main.ParkingAlgorithm(None, catalog=catalog.StaticCatalog(car_parks))
+    queries = random_queries(np.random.default_rng(20), 4)
+    limits = [0, 2, -1, 'two']
+    lines = []
+    for index, ((user_location, destination_location, requirement), limit) in enumerate(zip(queries, limits)):
+        lines.append(json.dumps({'id': index, 'user_location': list(user_location),
+                                 'destination_location': list(destination_location),
+                                 'requires_specialized_space': requirement, 'limit': limit}))
+    output = io.StringIO()
+    assert batch_queries.run_batch(algorithm, lines, output) == (2, 2)
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    for query, limit, result in zip(queries[:2], limits[:2], results[:2]):
+        assert [car_park['id'] for car_park in result['car_parks']] == \
+            [car_park.id for car_park in algorithm.find_optimal_car_park(*query, limit=limit)]
+    for result in results[2:]:
+        assert 'car_parks' not in result and 'non-negative' in result['error']
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from support import load_modules, random_rows
+
+
+def check_table_matches_objects(rows):
+    (main,) = load_modules('V7', ['main'])
+    table = main.car_park_table_from_rows(rows)
+    for row, table_row in zip(rows, table):
+        car_park = main.car_park_from_row(row)
+        assert list(table_row.parking_spaces) == list(car_park.parking_spaces)
+        assert table_row.parking_spaces.free_count == car_park.parking_spaces.free_count
+
+
+def test_table_reads_spaces_as_car_park_objects_do():
+    rows = random_rows(np.random.default_rng(14), 50)
+    check_table_matches_objects(rows)
+
+    # Spaces after commas or with leading zeros are read as int() reads them, not byte by byte
+    rows[3]['parking_spaces'] = '1, 0, 1'
+    rows[7]['parking_spaces'] = '01,1'
+    rows[9]['parking_spaces'] = ' 0 '
+    check_table_matches_objects(rows)
+
+
+def test_table_rejects_an_empty_space_list():
+    (main,) = load_modules('V7', ['main'])
+    rows = random_rows(np.random.default_rng(14), 5)
+    rows[2]['parking_spaces'] = ''
+    with pytest.raises(ValueError):
+        main.car_park_table_from_rows(rows)
@@ -0,0 +1,29 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from support import create_database, load_modules, random_rows
+
+
+def test_pool_uses_the_drivers_paramstyle_and_rejects_others(tmp_path):
+    (database,) = load_modules('V7', ['database'])
+    path = str(tmp_path / 'car_parks.db')
+    rows = random_rows(np.random.default_rng(5), 30)
+    create_database(path, rows).close()
+
+    for paramstyle in ('named', 'numeric', None):
+        with pytest.raises(ValueError):
+            database.ConnectionPool(lambda: sqlite3.connect(path), paramstyle)
+
+    pool = database.ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False), sqlite3.paramstyle)
+    car_park_database = database.CarParkDatabase(pool, batch_size=8)
+    try:
+        ids = [3, 11, 12, 29]
+        assert sorted(row['id'] for row in car_park_database.fetch_by_ids(ids)) == ids
+        assert len(car_park_database.fetch_region((0, 0), (30, 30))) == len(rows)
+        metrics = car_park_database.metrics()
+        assert metrics['query_time']['count'] == 2 and metrics['pool_wait']['count'] == 2
+        assert metrics['rows_fetched'] == len(ids) + len(rows)
+    finally:
+        pool.close()
@@ -0,0 +1,62 @@
+from support import create_database, database_algorithm, load_modules, write_rows
+
+
+def car_park_row(car_park_id, parking_spaces, version=1, location=(0, 0)):
+    return {'id': car_park_id, 'name': f"Car Park {car_park_id}", 'location_x': location[0],
+            'location_y': location[1], 'parking_spaces': parking_spaces, 'handicap_spaces': 0,
+            'ev_charging_spaces': 0, 'updated_at': version}
+
+
+def test_holds_survive_refreshes_from_the_database(tmp_path):
+    # Every read refreshes, re-reading the row (still showing both spaces free) at the version already seen
+    (holds_module,) = load_modules('V7', ['holds'])
+    path = str(tmp_path / 'car_parks.db')
+    rows = [car_park_row(1, '1,1')]
+    connection = create_database(path, rows)
+    algorithm, pool = database_algorithm(path, max_staleness=0)
+    holds = holds_module.SpaceHolds(algorithm)
+    try:
+        first = holds.recommend_and_hold((0, 0), (0, 0))
+        write_rows(connection, rows)
+        second = holds.recommend_and_hold((0, 0), (0, 0))
+        write_rows(connection, rows)
+        assert holds.recommend_and_hold((0, 0), (0, 0)) is None
+        assert {first.space, second.space} == {0, 1}
+
+        # A full reload keeps them too
+        algorithm.catalog.invalidate()
+        (car_park,) = algorithm.catalog.get_car_parks()
+        assert car_park is first.car_park and car_park.parking_spaces.free_count == 0
+
+        assert holds.release(first.id)
+        assert holds.recommend_and_hold((0, 0), (0, 0)).space == first.space
+    finally:
+        pool.close()
+        connection.close()
+
+
+def test_streamed_occupancy_survives_refreshes_and_expiry(tmp_path):
+    (holds_module,) = load_modules('V7', ['holds'])
+    path = str(tmp_path / 'car_parks.db')
+    rows = [car_park_row(1, '1,1,1')]
+    connection = create_database(path, rows)
+    algorithm, pool = database_algorithm(path, max_staleness=0)
+    now = [0.0]
+    holds = holds_module.SpaceHolds(algorithm, hold_seconds=10, clock=lambda: now[0])
+    try:
+        hold = holds.recommend_and_hold((0, 0), (0, 0))
+        other = 2 if hold.space != 2 else 1
+        # The driver parks without confirming, and a sensor reports another space taken
+        algorithm.apply_occupancy_updates({(1, hold.space): True, (1, other): True})
+        write_rows(connection, rows)
+        (car_park,) = algorithm.catalog.get_car_parks()
+        assert not car_park.parking_spaces.is_free(other)
+
+        now[0] = 11.0
+        assert holds.expire() == 1
+        (car_park,) = algorithm.catalog.get_car_parks()
+        assert not car_park.parking_spaces.is_free(hold.space)
+        assert car_park.parking_spaces.free_count == 1
+    finally:
+        pool.close()
+        connection.close()
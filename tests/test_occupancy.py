@@ -0,0 +1,40 @@
+import numpy as np
+
+from support import load_modules
+
+
+def bitmaps(spaces):
+    # The same spaces as a V7 bitmap, a V5 bitmap and a V5 table row reading the table's shared buffer
+    (v7_occupancy,) = load_modules('V7', ['occupancy'])
+    v5_occupancy, v5_table = load_modules('V5', ['occupancy', 'car_park_table'])
+    table = v5_table.CarParkTable({'id': [1]}, [spaces])
+    return [v7_occupancy.OccupancyBitmap.from_spaces(spaces), v5_occupancy.OccupancyBitmap.from_spaces(spaces),
+            table[0]['parking_spaces']], table
+
+
+def test_every_bitmap_copy_follows_a_list_of_spaces():
+    rng = np.random.default_rng(6)
+    for _ in range(30):
+        size = int(rng.integers(1, 40))
+        spaces = [int(space) for space in rng.random(size) < 0.3]
+        copies, table = bitmaps(spaces)
+        for _ in range(100):
+            index = int(rng.integers(0, size))
+            if rng.random() < 0.5:
+                results = [bitmap.occupy(index) for bitmap in copies]
+                assert results == [bool(spaces[index])] * len(copies)
+                spaces[index] = 0
+            else:
+                results = [bitmap.release(index) for bitmap in copies]
+                assert results == [not spaces[index]] * len(copies)
+                spaces[index] = 1
+            free = [space for space in range(size) if spaces[space]]
+            nearest = min(free, key=lambda space: (abs(space - index), space)) if free else None
+            for bitmap in copies:
+                assert list(bitmap) == spaces and bitmap.free_count == len(free)
+                assert list(bitmap.free_spaces()) == free
+                assert bitmap.first_free(index) == next((space for space in free if space >= index), None)
+                assert bitmap.last_free(index) == next((space for space in reversed(free) if space <= index), None)
+                assert bitmap.nearest_free(index) == nearest
+        # The row view wrote through to the table
+        assert list(table[0]['parking_spaces']) == spaces and int(table.free_counts[0]) == sum(spaces)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from support import (brute_force_ranking, create_database, database_algorithm, load_modules, random_queries,
+                     random_rows, write_rows)
+
+
+def ids(car_parks):
+    return [car_park.id for car_park in car_parks]
+
+
+def test_cached_rankings_match_uncached_through_updates_and_refreshes(tmp_path):
+    # Two algorithms over one table, only one of them caching, fed the same occupancy updates and table rewrites
+    (ranking_cache,) = load_modules('V7', ['ranking_cache'])
+    rng = np.random.default_rng(23)
+    path = str(tmp_path / 'car_parks.db')
+    rows = random_rows(rng, 150)
+    connection = create_database(path, rows)
+    cache = ranking_cache.RankingCache(max_bytes=64 << 10, tiles=8)
+    cached, cached_pool = database_algorithm(path, max_staleness=0, ranking_cache=cache)
+    uncached, uncached_pool = database_algorithm(path, max_staleness=0)
+    trips = random_queries(rng, 30)  # Few trips, so most lookups repeat one
+    try:
+        for round_number in range(40):
+            updates = {}
+            for row in rng.choice(rows, 5, replace=False):
+                space = int(rng.integers(0, len(row['parking_spaces'].split(','))))
+                updates[(row['id'], space)] = bool(rng.random() < 0.5)
+            for algorithm in (cached, uncached):
+                algorithm.apply_occupancy_updates(updates)
+            if round_number % 10 == 9:
+                # A rewrite moves some car parks and changes their spaces, and the catalog re-reads them
+                for row in rng.choice(rows, 10, replace=False):
+                    row.update(random_rows(rng, 1, version=round_number)[0], id=row['id'], name=row['name'])
+                write_rows(connection, rows)
+
+            queries = [trips[int(rng.integers(0, len(trips)))] for _ in range(20)]
+            limits = [[None, 1, 3, 10][int(rng.integers(0, 4))] for _ in queries]
+            for query, limit in zip(queries, limits):
+                expected = ids(uncached.find_optimal_car_park(*query, limit=limit))
+                assert ids(cached.find_optimal_car_park(*query, limit=limit)) == expected
+                assert expected == brute_force_ranking(cached, cached.catalog.get_car_parks(), query, limit)
+            assert [ids(ranked) for ranked in cached.find_optimal_car_parks(queries, 3)] == \
+                [ids(ranked) for ranked in uncached.find_optimal_car_parks(queries, 3)]
+
+        stats = cache.stats()
+        assert stats['hits'] and stats['invalidations'] and stats['evictions']
+    finally:
+        cached_pool.close()
+        uncached_pool.close()
+        connection.close()
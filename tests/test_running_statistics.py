@@ -0,0 +1,47 @@
+import numpy as np
+
+from support import load_modules
+
+
+def test_statistics_follow_car_parks_leaving_and_joining():
+    running_statistics, scoring = load_modules('V5', ['running_statistics', 'scoring'])
+    rng = np.random.default_rng(8)
+    criteria_matrix = rng.normal(10, 3, (200, 4))
+    criteria_matrix[rng.random(criteria_matrix.shape) < 0.1] = np.nan
+    statistics = running_statistics.RunningStatistics(['a', 'b', 'c', 'd'])
+    statistics.add_many(criteria_matrix[:150])
+
+    candidates = set(range(150))
+    for _ in range(300):
+        index = int(rng.integers(0, len(criteria_matrix)))
+        if index in candidates:
+            statistics.remove(criteria_matrix[index])
+            candidates.remove(index)
+        else:
+            statistics.add(criteria_matrix[index])
+            candidates.add(index)
+        means, std_devs = scoring.criteria_statistics(criteria_matrix[sorted(candidates)])
+        np.testing.assert_allclose(statistics.means, means, rtol=1e-9)
+        np.testing.assert_allclose(statistics.std_devs, std_devs, rtol=1e-7)
+
+
+def test_statistics_follow_car_parks_changing_their_values():
+    running_statistics, scoring = load_modules('V5', ['running_statistics', 'scoring'])
+    rng = np.random.default_rng(18)
+    criteria_matrix = rng.normal(10, 3, (100, 4))
+    criteria_matrix[rng.random(criteria_matrix.shape) < 0.1] = np.nan
+    statistics = running_statistics.RunningStatistics(['a', 'b', 'c', 'd'])
+    statistics.add_many(criteria_matrix)
+
+    for _ in range(300):
+        # Some values change, including to and from NaN
+        index = int(rng.integers(0, len(criteria_matrix)))
+        new_values = criteria_matrix[index].copy()
+        changed = rng.random(4) < 0.5
+        new_values[changed] = rng.normal(10, 3, changed.sum())
+        new_values[rng.random(4) < 0.1] = np.nan
+        statistics.update(criteria_matrix[index], new_values)
+        criteria_matrix[index] = new_values
+        means, std_devs = scoring.criteria_statistics(criteria_matrix)
+        np.testing.assert_allclose(statistics.means, means, rtol=1e-9)
+        np.testing.assert_allclose(statistics.std_devs, std_devs, rtol=1e-7)
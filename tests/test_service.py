@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import numpy as np
+
+from support import brute_force_ranking, load_modules, random_queries, random_rows
+
+
+class Writer:
+    # Collects the response lines service.answer writes, and counts how often it waits for them to be sent
+    def __init__(self):
+        self.responses = []
+        self.drains = 0
+
+    def write(self, data):
+        self.responses.append(json.loads(data))
+
+    async def drain(self):
+        self.drains += 1
+
+
+def static_algorithm(seed, count=200):
+    main, catalog = load_modules('V7', ['main', 'catalog'])
+    car_parks = [main.car_park_from_row(row) for row in random_rows(np.random.default_rng(seed), count)]
+    return main.ParkingAlgorithm(None, catalog=catalog.StaticCatalog(car_parks))
+
+
+def answer_all(algorithm, requests):
+    # Sends every request at once, so the batcher groups them; returns the responses by id and the batcher
+    service, holds = load_modules('V7', ['service', 'holds'])
+
+    async def run():
+        batcher = service.RecommendationBatcher(algorithm, max_delay=0.01)
+        batcher.start()
+        writer = Writer()
+        try:
+            await asyncio.gather(*(service.answer(batcher, holds.SpaceHolds(algorithm), json.dumps(request), writer)
+                                   for request in requests))
+        finally:
+            batcher.worker.cancel()
+        assert writer.drains == len(writer.responses)
+        return {response['id']: response for response in writer.responses}, batcher
+
+    return asyncio.run(run())
+
+
+def request_json(request_id, query, limit):
+    user_location, destination_location, requirement = query
+    return {'id': request_id, 'user_location': list(user_location),
+            'destination_location': list(destination_location), 'requires_specialized_space': requirement,
+            'limit': limit}
+
+
+def test_batched_answers_match_single_rankings():
+    algorithm = static_algorithm(9)
+    rng = np.random.default_rng(9)
+    queries = random_queries(rng, 80)
+    limits = [[None, 0, 1, 3, 10][int(rng.integers(0, 5))] for _ in queries]
+    responses, batcher = answer_all(algorithm, [request_json(index, query, limit)
+                                                for index, (query, limit) in enumerate(zip(queries, limits))])
+
+    assert batcher.stats()['batches'] < len(queries)
+    car_parks = algorithm.catalog.get_car_parks()
+    for index, (query, limit) in enumerate(zip(queries, limits)):
+        expected = [car_park.id for car_park in algorithm.find_optimal_car_park(*query, limit=limit)]
+        assert expected == brute_force_ranking(algorithm, car_parks, query, limit)
+        assert [car_park['id'] for car_park in responses[index]['car_parks']] == expected
+
+
+def test_failing_and_malformed_requests_fail_alone():
+    algorithm = static_algorithm(10, 50)
+    rankings = algorithm.find_optimal_car_parks
+
+    def find_optimal_car_parks(queries, limit=None, *args):
+        if any(query[0] == (99, 99) for query in queries):
+            raise RuntimeError("ranking failed")
+        return rankings(queries, limit, *args)
+
+    algorithm.find_optimal_car_parks = find_optimal_car_parks
+    good = random_queries(np.random.default_rng(10), 5)
+    requests = [request_json(index, query, 3) for index, query in enumerate(good)] + [
+        request_json('poisoned', ((99, 99), (1, 1), None), 3),
+        {'id': 'short', 'user_location': [1], 'destination_location': [1, 1]},
+        {'id': 'limit', 'user_location': [1, 1], 'destination_location': [1, 1], 'limit': -1},
+        {'id': 'requirement', 'user_location': [1, 1], 'destination_location': [1, 1],
+         'requires_specialized_space': 3}
+    ]
+    responses, batcher = answer_all(algorithm, requests)
+
+    # Requests answered one by one after their batch failed are counted as well, the failing one included
+    stats = batcher.stats()
+    assert stats['requests'] == len(good) + 1 and stats['p99_latency_seconds'] > 0
+    for index, query in enumerate(good):
+        assert [car_park['id'] for car_park in responses[index]['car_parks']] == \
+            [car_park.id for car_park in algorithm.find_optimal_car_park(*query, limit=3)]
+    assert responses['poisoned']['error'] == "ranking failed"
+    for request_id in ('short', 'limit', 'requirement'):
+        assert 'car_parks' not in responses[request_id] and responses[request_id]['error']
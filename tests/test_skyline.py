@@ -0,0 +1,45 @@
+import numpy as np
+
+from support import load_modules
+
+CRITERIA = ['time_to_carpark', 'time_from_carpark', 'traffic_density', 'handicapped_space', 'family_space',
+            'ev_charging_space', 'forecast_free_spaces']
+WEIGHT_KEYS = ['time_to_destination', 'traffic_density', 'handicapped_space', 'family_space', 'ev_charging_space',
+               'forecast_free_spaces']
+
+
+def random_criteria(rng, count):
+    # Few distinct values, so whole rows repeat and scores tie exactly
+    criteria_matrix = rng.integers(0, 4, (count, len(CRITERIA))).astype(float)
+    criteria_matrix[rng.random(criteria_matrix.shape) < 0.05] = np.nan
+    return criteria_matrix
+
+
+def random_weights(rng):
+    # Mostly non-negative weights, which rank from the band, some with a negative one (the 'Less traffic' slider)
+    weights = {key: float(rng.choice([0.0, 0.5, 1.0, rng.random()])) for key in WEIGHT_KEYS}
+    if rng.random() < 0.3:
+        weights[WEIGHT_KEYS[int(rng.integers(0, len(WEIGHT_KEYS)))]] = -float(rng.random())
+    return weights
+
+
+def test_top_k_matches_a_full_sort():
+    (scoring,) = load_modules('V5', ['scoring'])
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        criteria_matrix = random_criteria(rng, int(rng.integers(1, 300)))
+        ranker = scoring.SkylineRanker(criteria_matrix, CRITERIA, k=int(rng.integers(1, 6)))
+        settings = [random_weights(rng) for _ in range(10)]
+        for k in range(ranker.k + 3):
+            batch_indices, batch_scores = ranker.top_k_batch(settings, k)
+            for weights, indices_row, scores_row in zip(settings, batch_indices, batch_scores):
+                scores = scoring.calculate_scores(criteria_matrix, weights, CRITERIA)
+                expected = scoring.rank_car_parks(scores)[:k]
+                indices, top_scores = ranker.top_k(weights, k)
+                assert indices.tolist() == expected.tolist()
+                np.testing.assert_allclose(top_scores, scores[expected])
+
+                # The batch may only swap car parks whose scores tie up to rounding
+                np.testing.assert_allclose(scores_row, scores[expected], rtol=1e-12, atol=1e-12)
+                np.testing.assert_allclose(scores[indices_row], scores[expected], rtol=1e-12, atol=1e-12)
+                assert len(set(indices_row.tolist())) == len(indices_row)
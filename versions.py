@@ -0,0 +1,51 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+# The version folders, shared by parking.py, the benchmarks and the tests. Only the standard library is imported
+# here, so loading this module costs the command line nothing.
+
+ROOT = Path(__file__).resolve().parent
+VERSION_FOLDERS = {
+    'V3': 'Parking Algorithm V3',
+    'V4': 'Parking Algorithm V4',
+    'V5': 'Parking Algorithm V5',
+    'V6': 'Parking Algorithm V6',
+    'V7': 'Parking Algorithm V7'
+}
+LOADED = {}  # (version, module name) -> module, kept for the life of the process
+
+
+# Function to import modules from a version folder under their own names. The folders are separate projects with
+# clashing module names (main, occupancy, ...), so the sibling modules they import are dropped from sys.modules
+# again; modules loaded in one call share the same siblings. The loaded modules themselves stay registered under
+# their own names so that functions in them can be handed to worker processes.
+def load_modules(version, names):
+    missing = [name for name in names if (version, name) not in LOADED]
+    if missing:
+        folder = ROOT / VERSION_FOLDERS[version]
+        modules_before = set(sys.modules)
+        sys.path.insert(0, str(folder))
+        try:
+            for name in missing:
+                spec = importlib.util.spec_from_file_location(f"parking_{version.lower()}_{name}", folder / f'{name}.py')
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[spec.name] = module
+                try:
+                    spec.loader.exec_module(module)
+                except BaseException:
+                    del sys.modules[spec.name]
+                    raise
+                LOADED[(version, name)] = module
+        finally:
+            sys.path.remove(str(folder))
+            for name in set(sys.modules) - modules_before:
+                module_file = getattr(sys.modules[name], '__file__', None) or ''
+                if module_file.startswith(str(folder)) and not name.startswith('parking_'):
+                    del sys.modules[name]
+    return [LOADED[(version, name)] for name in names]
+
+
+# Function to import one module of a version folder (its main.py by default)
+def load_version(version, name='main'):
+    return load_modules(version, [name])[0]